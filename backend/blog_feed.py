@@ -0,0 +1,162 @@
+# blog_feed.py
+# RSS и JSON Feed для опубликованных статей.
+#
+# Готовые байты лежат в памяти процесса вместе с ETag/Last-Modified и
+# пересобираются только после публикации/изменения/удаления статьи
+# (invalidate() из эндпоинтов блога). Штамп (count, max(updated_at)) сверяется
+# с БД, поэтому изменения, сделанные через другой воркер, тоже подхватываются.
+import json
+import hashlib
+import datetime
+from email.utils import format_datetime
+from xml.sax.saxutils import escape as xml_escape
+
+from sqlalchemy import select, func, desc
+
+from models import BlogPost
+from blog_render import needs_render, render_post
+
+FEED_SIZE = 50
+FEED_TITLE = "Блог Мапка.рф"
+FEED_DESCRIPTION = "Статьи о кружках и секциях для детей"
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+# (kind, base) -> dict(body, etag, last_modified, stamp)
+_cache = {}
+
+
+def invalidate():
+    _cache.clear()
+
+
+def _dt(v):
+    if v is None:
+        return None
+    if v.tzinfo is None:
+        v = v.replace(tzinfo=datetime.timezone.utc)
+    return v
+
+
+async def _stamp(session):
+    r = await session.execute(
+        select(func.count(), func.max(BlogPost.updated_at)).where(BlogPost.status == "published")
+    )
+    count, last = r.one()
+    return (int(count or 0), _dt(last))
+
+
+async def _load_posts(session):
+    r = await session.execute(
+        select(BlogPost)
+        .where(BlogPost.status == "published")
+        .order_by(desc(BlogPost.published_at), desc(BlogPost.updated_at))
+        .limit(FEED_SIZE)
+    )
+    return r.scalars().all()
+
+
+def _html(p):
+    """Пререндер статьи; если фоновый blog.render ещё не отработал — рендерим здесь."""
+    if p.rendered_html is not None and not needs_render(p):
+        return p.rendered_html
+    return render_post(p)["html"]
+
+
+def _build_rss(posts, base: str) -> bytes:
+    # от данных, а не от времени сборки: байты (и ETag) одинаковы во всех воркерах
+    built = max((_dt(p.updated_at) for p in posts if p.updated_at), default=None) or _EPOCH
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<rss version="2.0" xmlns:atom="http://www.w3.org/2005/Atom" xmlns:content="http://purl.org/rss/1.0/modules/content/">',
+        "<channel>",
+        f"<title>{xml_escape(FEED_TITLE)}</title>",
+        f"<link>{xml_escape(base)}/blog</link>",
+        f"<description>{xml_escape(FEED_DESCRIPTION)}</description>",
+        "<language>ru</language>",
+        f'<atom:link href="{xml_escape(base)}/blog/feed.xml" rel="self" type="application/rss+xml"/>',
+        f"<lastBuildDate>{format_datetime(built)}</lastBuildDate>",
+    ]
+    for p in posts:
+        link = f"{base}/blog/{p.slug}"
+        pub = _dt(p.published_at or p.updated_at or p.created_at)
+        parts.append("<item>")
+        parts.append(f"<title>{xml_escape(p.title or '')}</title>")
+        parts.append(f"<link>{xml_escape(link)}</link>")
+        parts.append(f'<guid isPermaLink="false">{p.id}</guid>')
+        if pub:
+            parts.append(f"<pubDate>{format_datetime(pub)}</pubDate>")
+        if p.excerpt:
+            parts.append(f"<description>{xml_escape(p.excerpt)}</description>")
+        html = _html(p)
+        if html:
+            # ]]> внутри CDATA разбиваем
+            html = html.replace("]]>", "]]]]><![CDATA[>")
+            parts.append(f"<content:encoded><![CDATA[{html}]]></content:encoded>")
+        if p.category:
+            parts.append(f"<category>{xml_escape(p.category)}</category>")
+        for t in p.tags or []:
+            parts.append(f"<category>{xml_escape(str(t))}</category>")
+        if p.cover_image:
+            parts.append(f'<enclosure url="{xml_escape(p.cover_image)}" type="image/jpeg" length="0"/>')
+        parts.append("</item>")
+    parts.append("</channel>")
+    parts.append("</rss>")
+    return "\n".join(parts).encode("utf-8")
+
+
+def _build_json(posts, base: str) -> bytes:
+    items = []
+    for p in posts:
+        html = _html(p)
+        item = {
+            "id": str(p.id),
+            "url": f"{base}/blog/{p.slug}",
+            "title": p.title or "",
+            "summary": p.excerpt or None,
+            "content_html": html or None,
+            "content_text": None if html else (p.excerpt or p.content or ""),
+            "image": p.cover_image or None,
+            "date_published": _dt(p.published_at).isoformat() if p.published_at else None,
+            "date_modified": _dt(p.updated_at).isoformat() if p.updated_at else None,
+            "tags": list(p.tags or []),
+        }
+        if p.author_name:
+            item["authors"] = [{"name": p.author_name}]
+        items.append({k: v for k, v in item.items() if v is not None})
+    feed = {
+        "version": "https://jsonfeed.org/version/1.1",
+        "title": FEED_TITLE,
+        "home_page_url": f"{base}/blog",
+        "feed_url": f"{base}/blog/feed.json",
+        "description": FEED_DESCRIPTION,
+        "language": "ru",
+        "items": items,
+    }
+    return json.dumps(feed, ensure_ascii=False).encode("utf-8")
+
+
+_BUILDERS = {
+    "rss": _build_rss,
+    "json": _build_json,
+}
+
+
+async def get_feed(session, kind: str, base: str) -> dict:
+    stamp = await _stamp(session)
+    key = (kind, base)
+    cached = _cache.get(key)
+    if cached and cached["stamp"] == stamp:
+        return cached
+
+    posts = await _load_posts(session)
+    body = _BUILDERS[kind](posts, base)
+    last = stamp[1] or datetime.datetime.now(datetime.timezone.utc)
+    entry = {
+        "body": body,
+        "etag": '"' + hashlib.sha256(body).hexdigest()[:32] + '"',
+        "last_modified": last.replace(microsecond=0),
+        "stamp": stamp,
+    }
+    _cache[key] = entry
+    return entry
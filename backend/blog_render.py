@@ -0,0 +1,331 @@
+# blog_render.py
+# Серверный рендер статьи: content_blocks (или content: markdown/HTML) + faq -> HTML.
+#
+# Результат (html, оглавление, время чтения, FAQPage JSON-LD) считается один раз
+# на ревизию статьи и хранится в blog_posts.rendered_*; публичный эндпоинт
+# отдаёт его как есть, без обхода блоков на каждом запросе.
+import re
+import json
+import hashlib
+from html import escape
+from html.parser import HTMLParser
+
+# меняем при изменении логики рендера — старые ревизии пересчитаются при чтении
+RENDERER_VERSION = "r1"
+
+WORDS_PER_MINUTE = 180
+
+_ALLOWED_TAGS = {
+    "p", "br", "hr", "h2", "h3", "h4", "ul", "ol", "li", "strong", "b", "em", "i", "u", "s",
+    "a", "blockquote", "code", "pre", "figure", "figcaption", "img", "table", "thead",
+    "tbody", "tr", "th", "td", "mark", "span", "div",
+}
+_VOID_TAGS = {"br", "hr", "img"}
+_ALLOWED_ATTRS = {
+    "a": {"href", "title"},
+    "img": {"src", "alt", "title", "width", "height", "loading"},
+    "h2": {"id"}, "h3": {"id"}, "h4": {"id"},
+    "th": {"colspan", "rowspan"}, "td": {"colspan", "rowspan"},
+}
+# содержимое этих тегов выбрасываем целиком; void-теги (embed) сюда нельзя —
+# у них нет закрывающего тега, drop_depth не вернулся бы к нулю и съел бы остаток статьи.
+# embed и прочие не из _ALLOWED_TAGS просто не выводятся.
+_DROP_CONTENT_TAGS = {"script", "style", "iframe", "object", "noscript", "template"}
+# "/" — только путь на своём сайте: "//host/x" — протокол-относительная ссылка наружу
+_SAFE_URL_RE = re.compile(r"^(https?:|mailto:|tel:|/(?!/)|#)", re.I)
+
+
+class _Sanitizer(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out = []
+        self.open_tags = []
+        self.drop_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _DROP_CONTENT_TAGS:
+            self.drop_depth += 1
+            return
+        if self.drop_depth or tag not in _ALLOWED_TAGS:
+            return
+        allowed = _ALLOWED_ATTRS.get(tag, set())
+        parts = [tag]
+        for k, v in attrs:
+            if k not in allowed or v is None:
+                continue
+            if k in ("href", "src") and not _SAFE_URL_RE.match(v.strip()):
+                continue
+            parts.append(f'{k}="{escape(v, quote=True)}"')
+        if tag == "a":
+            parts.append('rel="noopener noreferrer"')
+        self.out.append("<" + " ".join(parts) + ">")
+        if tag not in _VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag in _DROP_CONTENT_TAGS:
+            self.drop_depth -= 1
+
+    def handle_endtag(self, tag):
+        if tag in _DROP_CONTENT_TAGS:
+            self.drop_depth = max(0, self.drop_depth - 1)
+            return
+        if self.drop_depth or tag not in self.open_tags:
+            return
+        # закрываем всё, что осталось открытым внутри
+        while self.open_tags:
+            t = self.open_tags.pop()
+            self.out.append(f"</{t}>")
+            if t == tag:
+                break
+
+    def handle_data(self, data):
+        if not self.drop_depth:
+            self.out.append(escape(data, quote=False))
+
+    def result(self):
+        while self.open_tags:
+            self.out.append(f"</{self.open_tags.pop()}>")
+        return "".join(self.out)
+
+
+def sanitize_html(html: str) -> str:
+    p = _Sanitizer()
+    p.feed(str(html or ""))
+    p.close()
+    return p.result()
+
+
+def strip_html(html: str) -> str:
+    return re.sub(r"\s+", " ", re.sub(r"<[^>]*>", " ", str(html or ""))).strip()
+
+
+def _is_html(s: str) -> bool:
+    return bool(re.search(r"<\w+[\s\S]*?>", str(s or "")))
+
+
+def _inline_md(text: str) -> str:
+    s = escape(str(text or ""), quote=True)
+    s = re.sub(r"\[([^\]]+)\]\(((?:https?://|/(?!/))[^\s)]+)\)", r'<a href="\2" rel="noopener noreferrer">\1</a>', s)
+    s = re.sub(r"\*\*([^*]+)\*\*", r"<strong>\1</strong>", s)
+    s = re.sub(r"\*([^*]+)\*", r"<em>\1</em>", s)
+    return s
+
+
+def markdown_to_html(md: str) -> str:
+    """Тот же упрощённый markdown, что понимает страница статьи во фронте."""
+    out = []
+    in_list = False
+    for raw in str(md or "").replace("\r\n", "\n").replace("\r", "\n").split("\n"):
+        line = raw.strip()
+        if not line:
+            if in_list:
+                out.append("</ul>")
+                in_list = False
+            continue
+        hm = re.match(r"^(#{1,4})\s+(.+?)\s*$", line)
+        if hm:
+            if in_list:
+                out.append("</ul>")
+                in_list = False
+            lvl = min(max(len(hm.group(1)), 2), 4)
+            out.append(f"<h{lvl}>{_inline_md(hm.group(2))}</h{lvl}>")
+            continue
+        lm = re.match(r"^[-*]\s+(.+)$", line)
+        if lm:
+            if not in_list:
+                out.append("<ul>")
+                in_list = True
+            out.append(f"<li>{_inline_md(lm.group(1))}</li>")
+            continue
+        if in_list:
+            out.append("</ul>")
+            in_list = False
+        out.append(f"<p>{_inline_md(line)}</p>")
+    if in_list:
+        out.append("</ul>")
+    return "\n".join(out)
+
+
+def _text_html(value) -> str:
+    """Текст блока: HTML санитизируем, обычный текст — как inline markdown."""
+    s = str(value or "").strip()
+    if not s:
+        return ""
+    return sanitize_html(s) if _is_html(s) else _inline_md(s)
+
+
+def _block_text(b: dict):
+    for k in ("html", "text", "content", "value"):
+        v = b.get(k)
+        if isinstance(v, str) and v.strip():
+            return v
+    return ""
+
+
+def _render_block(b) -> str:
+    if isinstance(b, str):
+        return f"<p>{_text_html(b)}</p>" if b.strip() else ""
+    if not isinstance(b, dict):
+        return ""
+    kind = str(b.get("type") or "paragraph").lower()
+    data = b.get("data") if isinstance(b.get("data"), dict) else b
+
+    if kind in ("heading", "header", "h2", "h3", "h4"):
+        level = data.get("level") or (int(kind[1]) if kind in ("h2", "h3", "h4") else 2)
+        try:
+            level = min(max(int(level), 2), 4)
+        except (TypeError, ValueError):
+            level = 2
+        inner = _text_html(_block_text(data))
+        return f"<h{level}>{inner}</h{level}>" if inner else ""
+
+    if kind in ("list", "ul", "ol", "bullets", "numbered"):
+        items = data.get("items") or []
+        ordered = kind in ("ol", "numbered") or str(data.get("style") or "").lower() == "ordered"
+        tag = "ol" if ordered else "ul"
+        lis = []
+        for it in items:
+            txt = _block_text(it) if isinstance(it, dict) else it
+            inner = _text_html(txt)
+            if inner:
+                lis.append(f"<li>{inner}</li>")
+        return f"<{tag}>{''.join(lis)}</{tag}>" if lis else ""
+
+    if kind in ("quote", "blockquote"):
+        inner = _text_html(_block_text(data))
+        return f"<blockquote>{inner}</blockquote>" if inner else ""
+
+    if kind in ("image", "img", "picture"):
+        src = str(data.get("url") or data.get("src") or "").strip()
+        if not src or not _SAFE_URL_RE.match(src):
+            return ""
+        alt = escape(str(data.get("alt") or data.get("caption") or ""), quote=True)
+        caption = _text_html(data.get("caption"))
+        img = f'<img src="{escape(src, quote=True)}" alt="{alt}" loading="lazy">'
+        return f"<figure>{img}<figcaption>{caption}</figcaption></figure>" if caption else f"<figure>{img}</figure>"
+
+    if kind == "code":
+        return f"<pre><code>{escape(str(_block_text(data)))}</code></pre>"
+
+    if kind in ("divider", "delimiter", "hr"):
+        return "<hr>"
+
+    if kind in ("html", "raw"):
+        return sanitize_html(_block_text(data))
+
+    if kind in ("markdown", "md"):
+        return markdown_to_html(_block_text(data))
+
+    # paragraph / text / неизвестный тип с текстом
+    inner = _text_html(_block_text(data))
+    return f"<p>{inner}</p>" if inner else ""
+
+
+_HEADING_RE = re.compile(r"<h([234])([^>]*)>([\s\S]*?)</h\1>", re.I)
+
+
+def _slug_for_toc(text: str) -> str:
+    s = re.sub(r"[^\w]+", "-", strip_html(text).lower().replace("&nbsp;", " "))
+    return s.strip("-_")[:80]
+
+
+def _with_toc(html: str):
+    toc = []
+    used = set()
+
+    def repl(m):
+        level, attrs, inner = m.group(1), m.group(2), m.group(3)
+        title = strip_html(inner)
+        existing = re.search(r"\sid=[\"']([^\"']+)[\"']", attrs or "")
+        hid = existing.group(1) if existing else (_slug_for_toc(title) or f"section-{len(toc) + 1}")
+        base, n = hid, 2
+        while hid in used:
+            hid = f"{base}-{n}"
+            n += 1
+        used.add(hid)
+        toc.append({"id": hid, "title": title, "level": int(level)})
+        if existing:
+            return m.group(0)
+        return f"<h{level}{attrs} id=\"{hid}\">{inner}</h{level}>"
+
+    return _HEADING_RE.sub(repl, html), toc
+
+
+def render_revision(post) -> str:
+    src = json.dumps(
+        [post.content, post.content_blocks, post.faq],
+        ensure_ascii=False, sort_keys=True, default=str,
+    )
+    return RENDERER_VERSION + ":" + hashlib.sha256(src.encode("utf-8")).hexdigest()[:32]
+
+
+def render_post(post) -> dict:
+    """content_blocks/content + faq -> {html, toc, reading_time, faq_jsonld, revision}."""
+    blocks = post.content_blocks
+    if isinstance(blocks, dict):
+        blocks = blocks.get("blocks") or blocks.get("items") or []
+    if isinstance(blocks, list) and blocks:
+        body = "\n".join(h for h in (_render_block(b) for b in blocks) if h)
+    elif _is_html(post.content):
+        body = sanitize_html(post.content)
+    else:
+        body = markdown_to_html(post.content or "")
+
+    body, toc = _with_toc(body)
+
+    faq_items = []
+    for item in post.faq or []:
+        if not isinstance(item, dict):
+            continue
+        q = str(item.get("q") or "").strip()
+        a = str(item.get("a") or "").strip()
+        if q and a:
+            a_html = sanitize_html(a) if _is_html(a) else markdown_to_html(a)
+            faq_items.append((q, a_html))
+
+    faq_jsonld = None
+    if faq_items:
+        toc.append({"id": "faq", "title": "Частые вопросы", "level": 2})
+        parts = ['<section id="faq"><h2>Частые вопросы</h2>']
+        for q, a_html in faq_items:
+            parts.append(f"<details><summary>{escape(q)}</summary>{a_html}</details>")
+        parts.append("</section>")
+        body = body + "\n" + "".join(parts)
+        faq_jsonld = {
+            "@context": "https://schema.org",
+            "@type": "FAQPage",
+            "mainEntity": [
+                {
+                    "@type": "Question",
+                    "name": q,
+                    "acceptedAnswer": {"@type": "Answer", "text": strip_html(a_html)},
+                }
+                for q, a_html in faq_items
+            ],
+        }
+
+    words = len(strip_html(body).split())
+    return {
+        "html": body,
+        "toc": toc,
+        "reading_time": max(1, round(words / WORDS_PER_MINUTE)) if words else 0,
+        "faq_jsonld": faq_jsonld,
+        "revision": render_revision(post),
+    }
+
+
+def apply_render(post) -> None:
+    """Записывает результат render_post() в колонки статьи."""
+    r = render_post(post)
+    post.rendered_html = r["html"]
+    post.rendered_toc = r["toc"]
+    post.reading_time_min = r["reading_time"]
+    post.faq_jsonld = r["faq_jsonld"]
+    post.render_revision = r["revision"]
+
+
+def needs_render(post) -> bool:
+    rev = getattr(post, "render_revision", None)
+    return not rev or not rev.startswith(RENDERER_VERSION + ":")
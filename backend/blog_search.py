@@ -0,0 +1,95 @@
+# blog_search.py
+# Полнотекстовый поиск по блогу (tsvector с русской морфологией).
+#
+# Вес A — заголовок, B — анонс и теги, C — текст статьи (content + content_blocks),
+# D — FAQ. Вектор пересчитывается при создании/обновлении статьи
+# и хранится в blog_posts.search_vector под GIN-индексом.
+from sqlalchemy import func, literal, literal_column, select, update
+
+from models import BlogPost
+
+SEARCH_CONFIG = "russian"
+
+# служебные ключи блоков, в которых нет читаемого текста
+_SKIP_KEYS = {"id", "type", "url", "src", "href", "image", "style", "level", "align", "variant", "class", "className"}
+
+HEADLINE_OPTIONS = "MaxWords=35, MinWords=15, MaxFragments=2, FragmentDelimiter=' … ', StartSel=<mark>, StopSel=</mark>"
+
+
+def blocks_plain_text(blocks) -> str:
+    """Собирает весь читаемый текст из content_blocks (произвольный JSON редактора)."""
+    parts = []
+
+    def walk(node, key=None):
+        if node is None or key in _SKIP_KEYS:
+            return
+        if isinstance(node, str):
+            s = node.strip()
+            if s:
+                parts.append(s)
+        elif isinstance(node, dict):
+            for k, v in node.items():
+                walk(v, k)
+        elif isinstance(node, (list, tuple)):
+            for v in node:
+                walk(v, key)
+
+    walk(blocks)
+    return "\n".join(parts)
+
+
+def faq_plain_text(faq) -> str:
+    parts = []
+    for item in faq or []:
+        if isinstance(item, dict):
+            parts.extend(str(item.get(k) or "").strip() for k in ("q", "a"))
+    return "\n".join(p for p in parts if p)
+
+
+def _weighted(text: str, weight: str):
+    # вес — "char"-литерал ('A'..'D'), параметр varchar postgres не приведёт
+    return func.setweight(func.to_tsvector(SEARCH_CONFIG, literal(text or "")), literal_column(f"'{weight}'"))
+
+
+def search_vector_expr(post: BlogPost):
+    """SQL-выражение tsvector для статьи (присваивается в post.search_vector перед commit)."""
+    body = "\n".join(x for x in (post.content or "", blocks_plain_text(post.content_blocks)) if x)
+    tags = " ".join(str(t) for t in (post.tags or []))
+    return (
+        _weighted(post.title, "A")
+        .op("||")(_weighted(" ".join(x for x in (post.excerpt or "", tags) if x), "B"))
+        .op("||")(_weighted(body, "C"))
+        .op("||")(_weighted(faq_plain_text(post.faq), "D"))
+    )
+
+
+def search_query(q: str):
+    # websearch_to_tsquery понимает "фразы", OR и -исключения и не падает на мусоре
+    return func.websearch_to_tsquery(SEARCH_CONFIG, q)
+
+
+def rank_expr(tsq):
+    return func.ts_rank_cd(BlogPost.search_vector, tsq)
+
+
+def snippet_expr(tsq):
+    doc = func.concat_ws(" … ", BlogPost.excerpt, BlogPost.content)
+    return func.ts_headline(SEARCH_CONFIG, doc, tsq, HEADLINE_OPTIONS)
+
+
+async def reindex_missing(session, batch_size: int = 200) -> int:
+    """Досчитывает search_vector для статей, у которых его ещё нет (после добавления колонки)."""
+    done = 0
+    while True:
+        r = await session.execute(
+            select(BlogPost).where(BlogPost.search_vector.is_(None)).limit(batch_size)
+        )
+        posts = r.scalars().all()
+        if not posts:
+            return done
+        for p in posts:
+            await session.execute(
+                update(BlogPost).where(BlogPost.id == p.id).values(search_vector=search_vector_expr(p))
+            )
+        await session.commit()
+        done += len(posts)
@@ -0,0 +1,491 @@
+# catalog.py
+# Каталог кружков в памяти процесса: колонки + строки со __slots__.
+#
+# Числовые поля (координаты, возраст, цена, категория, updated_at) лежат в
+# array-колонках по позиции кружка, "богатые" части — в _ClubRow: slug, имя,
+# слоты расписания и JSON-карточка. Карточка кружка, не менявшегося со снимка
+# (catalog_snapshot.py), не копируется в процесс — читается из mmap.
+#
+# Загрузка — из снимка (без БД), затем инкрементально из БД: кружки с updated_at
+# не старше водяного знака и удалённые (club_tombstones). Обновление раз в
+# CATALOG_REFRESH_SECONDS и сразу после записи (своей — invalidate(), чужой —
+# NOTIFY "club"). Пока запись не подхвачена, а также если обновления не удаются
+# дольше CATALOG_MAX_STALE секунд, fresh() возвращает None и эндпоинты идут в БД.
+#
+# Рейтинг (ratings.py) updated_at не меняет: по reload_ratings() (свой отзыв или
+# NOTIFY "rating") каталог сравнивает rating_count/rating_sum с БД и перечитывает
+# только отличающиеся карточки. Каталог при этом не сбрасывается — до ближайшего
+# обновления отдаётся прежний рейтинг. Снимок после отзывов не пересобирается,
+# поэтому каталог из снимка сверяет рейтинги всех кружков.
+import os
+import json
+import time
+import uuid
+import bisect
+import asyncio
+import datetime
+from array import array
+
+from sqlalchemy import select, delete
+from sqlalchemy.orm import selectinload
+
+from models import Club, ClubTombstone
+import catalog_snapshot
+from catalog_snapshot import ORIGIN_TOKEN, NONE_INT, slot_tuples
+from distance import numpy, haversine_km, haversine_one
+
+CATALOG_MEMORY = os.getenv("CATALOG_MEMORY", "on").strip().lower() not in ("0", "off", "false", "no")
+CATALOG_REFRESH_SECONDS = float(os.getenv("CATALOG_REFRESH_SECONDS", "2"))
+# граница устаревания: дольше без успешного обновления — читаем из БД
+CATALOG_MAX_STALE = float(os.getenv("CATALOG_MAX_STALE", "30"))
+CATALOG_TOMBSTONE_DAYS = int(os.getenv("CATALOG_TOMBSTONE_DAYS", "7"))
+# updated_at ставит приложение до COMMIT: запись с меньшим updated_at может
+# закоммититься позже водяного знака — перечитываем окно с запасом
+REFRESH_OVERLAP_SECONDS = 10.0
+LOAD_CHUNK = 500
+
+_ORIGIN_TOKEN_BYTES = ORIGIN_TOKEN.encode("utf-8")
+
+
+def _epoch(dt) -> float:
+    return dt.timestamp() if dt is not None else 0.0
+
+
+def _since(ts: float) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(max(0.0, ts - REFRESH_OVERLAP_SECONDS), datetime.timezone.utc)
+
+
+class _Slot:
+    """Слот расписания в памяти; атрибуты как у Schedule (для schedule_search._slot_out)."""
+    __slots__ = ("weekday", "start_min", "end_min", "note")
+
+    def __init__(self, weekday, start_min, end_min, note):
+        self.weekday = weekday
+        self.start_min = start_min
+        self.end_min = end_min
+        self.note = note
+
+    @staticmethod
+    def _time(m):
+        return None if m is None else datetime.time(m // 60, m % 60)
+
+    @property
+    def start_time(self):
+        return self._time(self.start_min)
+
+    @property
+    def end_time(self):
+        return self._time(self.end_min)
+
+    def sort_key(self):
+        return (99 if self.weekday is None else self.weekday, -1 if self.start_min is None else self.start_min)
+
+
+class _ClubRow:
+    __slots__ = ("id", "slug", "name", "slots", "blob", "snap_pos")
+
+    def __init__(self, club_id, slug, name, slots, blob=None, snap_pos=-1):
+        self.id = club_id
+        self.slug = slug
+        self.name = name or ""
+        self.slots = tuple(_Slot(*t) for t in slots)
+        self.blob = blob          # bytes; None — карточка в снимке (snap_pos)
+        self.snap_pos = snap_pos
+
+
+class Catalogue:
+    def __init__(self, snapshot=None):
+        self.snapshot = snapshot
+        self.rows = []            # позиция -> _ClubRow (None — удалён)
+        self.by_id = {}
+        self.by_slug = {}
+        self.order = []           # живые позиции в порядке NAME_ORDER (name, id)
+        self._order_np = None     # тот же порядок массивом NumPy (сбрасывается при записи)
+        self.alive = bytearray()
+        self.lat = array("d")
+        self.lon = array("d")
+        self.updated = array("d")
+        self.min_age = array("i")
+        self.max_age = array("i")
+        self.price = array("i")
+        self.category = array("I")
+        self.rating_n = array("i")
+        self.rating_sum = array("i")
+        self.categories = []
+        self._cat_index = {}
+        self.watermark = 0.0      # max updated_at загруженных кружков (epoch)
+        self.tomb_mark = 0.0      # max deleted_at обработанных надгробий (epoch)
+        self.refreshed_at = 0.0   # время начала последнего успешного обновления
+        self.rated = set()        # id кружков, у которых изменился рейтинг
+        self.check_ratings = False  # сверить рейтинги всех кружков
+
+    # ---------- загрузка ----------
+
+    @classmethod
+    def from_snapshot(cls, snap):
+        cat = cls(snap)
+        for name in ("lat", "lon", "updated", "min_age", "max_age", "price", "category", "rating_n", "rating_sum"):
+            getattr(cat, name).frombytes(getattr(snap, name).cast("B"))
+        cat.categories = list(snap.categories)
+        cat._cat_index = {c: i for i, c in enumerate(cat.categories)}
+        cat.alive = bytearray(b"\1" * snap.count)
+        for i in range(snap.count):
+            row = _ClubRow(snap.club_id(i), snap.slug(i), snap.name(i), snap.slot_tuples(i), None, i)
+            cat.rows.append(row)
+            cat.by_id[row.id] = i
+            cat.by_slug[row.slug] = i
+        cat.order = sorted(range(snap.count), key=cat._key)
+        cat.watermark = snap.watermark
+        cat.tomb_mark = snap.built_at
+        cat.check_ratings = True
+        return cat
+
+    def _key(self, pos):
+        # тот же порядок, что NAME_ORDER в БД: COLLATE "C" по имени, затем id
+        row = self.rows[pos]
+        return (row.name, row.id)
+
+    def _category_code(self, value) -> int:
+        value = value or ""
+        if value not in self._cat_index:
+            self._cat_index[value] = len(self.categories)
+            self.categories.append(value)
+        return self._cat_index[value]
+
+    def _upsert(self, row, out, c, updated):
+        lat, lon = out.get("lat"), out.get("lon")
+        values = (
+            float("nan") if lat is None else float(lat),
+            float("nan") if lon is None else float(lon),
+            updated,
+            NONE_INT if c.min_age is None else c.min_age,
+            NONE_INT if c.max_age is None else c.max_age,
+            NONE_INT if c.price_cents is None else c.price_cents,
+            self._category_code(c.category),
+            c.rating_count or 0,
+            c.rating_sum or 0,
+        )
+        cols = (self.lat, self.lon, self.updated, self.min_age, self.max_age, self.price, self.category,
+                self.rating_n, self.rating_sum)
+        pos = self.by_id.get(row.id)
+        if pos is None:
+            pos = len(self.rows)
+            for col, v in zip(cols, values):
+                col.append(v)
+            self.alive.append(1)
+            self.rows.append(row)
+            self.by_id[row.id] = pos
+        else:
+            old = self.rows[pos]
+            for col, v in zip(cols, values):
+                col[pos] = v
+            if self.by_slug.get(old.slug) == pos:
+                del self.by_slug[old.slug]
+            self.order.remove(pos)
+            self.rows[pos] = row
+        self.by_slug[row.slug] = pos
+        bisect.insort(self.order, pos, key=self._key)
+        self._order_np = None
+
+    def _remove(self, club_id):
+        pos = self.by_id.pop(club_id, None)
+        if pos is None:
+            return
+        row = self.rows[pos]
+        if self.by_slug.get(row.slug) == pos:
+            del self.by_slug[row.slug]
+        self.order.remove(pos)
+        self.rows[pos] = None
+        self.alive[pos] = 0
+        self._order_np = None
+
+    async def refresh(self, session_factory, serialize) -> int:
+        """Догрузить изменения из БД. Возвращает число изменённых/удалённых кружков."""
+        started = time.time()
+        changed = []
+        rated = set(self.rated)
+        check_all = self.check_ratings or len(rated) > LOAD_CHUNK
+        async with session_factory() as session:
+            stmt = select(Club.id, Club.updated_at)
+            if self.watermark:
+                stmt = stmt.where(Club.updated_at >= _since(self.watermark))
+            ids = []
+            for club_id, updated_at in (await session.execute(stmt)).all():
+                pos = self.by_id.get(str(club_id))
+                if pos is None or self.updated[pos] != _epoch(updated_at):
+                    ids.append(club_id)
+            if check_all or rated:
+                seen = set(ids)
+                stmt = select(Club.id, Club.rating_count, Club.rating_sum)
+                if not check_all:
+                    stmt = stmt.where(Club.id.in_([uuid.UUID(cid) for cid in rated]))
+                for club_id, n, total in (await session.execute(stmt)).all():
+                    pos = self.by_id.get(str(club_id))
+                    if pos is None or club_id in seen:
+                        continue
+                    if self.rating_n[pos] != (n or 0) or self.rating_sum[pos] != (total or 0):
+                        ids.append(club_id)
+            for i in range(0, len(ids), LOAD_CHUNK):
+                q = await session.execute(
+                    select(Club)
+                    .where(Club.id.in_(ids[i:i + LOAD_CHUNK]))
+                    .options(
+                        selectinload(Club.address),
+                        selectinload(Club.images),
+                        selectinload(Club.schedules),
+                        selectinload(Club.teacher),
+                    )
+                )
+                for c in q.scalars().all():
+                    out = serialize(c, ORIGIN_TOKEN)
+                    blob = json.dumps(out, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+                    row = _ClubRow(str(c.id), c.slug, c.name, slot_tuples(c.schedules), blob)
+                    changed.append((row, out, c, _epoch(c.updated_at)))
+                session.expunge_all()
+            tombs = (await session.execute(
+                select(ClubTombstone.club_id, ClubTombstone.deleted_at)
+                .where(ClubTombstone.deleted_at >= _since(self.tomb_mark))
+            )).all()
+
+        # применяем без await — запросы никогда не видят каталог наполовину обновлённым
+        for row, out, c, updated in changed:
+            self._upsert(row, out, c, updated)
+            self.watermark = max(self.watermark, updated)
+        removed = 0
+        for club_id, deleted_at in tombs:
+            if str(club_id) in self.by_id:
+                self._remove(str(club_id))
+                removed += 1
+            self.tomb_mark = max(self.tomb_mark, _epoch(deleted_at))
+        self.rated -= rated
+        if check_all:
+            self.check_ratings = False
+        self.refreshed_at = started
+        return len(changed) + removed
+
+    # ---------- запросы ----------
+
+    def find(self, key: str):
+        """Позиция по id или slug (None — нет в каталоге)."""
+        pos = self.by_id.get(key)
+        if pos is None:
+            pos = self.by_slug.get(key)
+        return pos
+
+    def _order_array(self):
+        if self._order_np is None:
+            np = numpy()
+            self._order_np = np.fromiter(self.order, dtype=np.int64, count=len(self.order))
+        return self._order_np
+
+    def _candidates(self, near=None, radius_km=None, sort="name", category=None, age=None):
+        """Позиции в порядке выдачи после фасетов и радиуса + расстояния по позициям (или None).
+
+        С NumPy — маски по колонкам целиком (np.frombuffer без копий), без NumPy — циклом.
+        """
+        np = numpy()
+        if np is None:
+            return self._candidates_py(near, radius_km, sort, category, age)
+        if not self.order:
+            return [], None
+        order = self._order_array()
+        mask = np.frombuffer(self.alive, dtype=np.uint8).astype(bool)
+        if category is not None:
+            code = self._cat_index.get(category)
+            if code is None:
+                return [], None
+            mask &= np.frombuffer(self.category, dtype=np.uintc) == code
+        if age is not None:
+            lo = np.frombuffer(self.min_age, dtype=np.intc)
+            hi = np.frombuffer(self.max_age, dtype=np.intc)
+            mask &= ((lo == NONE_INT) | (lo <= age)) & ((hi == NONE_INT) | (hi >= age))
+        dist = None
+        if near is not None:
+            dist = haversine_km(np.frombuffer(self.lat), np.frombuffer(self.lon), *near)
+            if radius_km is not None:
+                mask &= dist <= radius_km  # NaN (нет координат) не проходит
+        cand = order[mask[order]]
+        if sort == "distance":
+            # stable: при равном расстоянии — порядок по имени; NaN в конце
+            cand = cand[np.argsort(dist[cand], kind="stable")]
+        return cand.tolist(), dist
+
+    def _candidates_py(self, near, radius_km, sort, category, age):
+        cand = []
+        for pos in self.order:
+            if category is not None and self.categories[self.category[pos]] != category:
+                continue
+            if age is not None:
+                lo, hi = self.min_age[pos], self.max_age[pos]
+                if (lo != NONE_INT and lo > age) or (hi != NONE_INT and hi < age):
+                    continue
+            cand.append(pos)
+        dist = None
+        if near is not None:
+            dist = {pos: haversine_one(self.lat[pos], self.lon[pos], *near) for pos in cand}
+            if radius_km is not None:
+                cand = [p for p in cand if dist[p] is not None and dist[p] <= radius_km]
+            if sort == "distance":
+                cand.sort(key=lambda p: (dist[p] is None, dist[p] or 0.0))
+        return cand, dist
+
+    def page(self, offset: int, limit: int, slot_pred=None, near=None, radius_km=None,
+             sort: str = "name", category=None, age=None):
+        """(позиции, {позиция: [совпавшие слоты]} | None, {позиция: км} | None)."""
+        cand, dist = self._candidates(near, radius_km, sort, category, age)
+        matched = None
+        if slot_pred is None:
+            out = cand[offset:offset + limit]
+        else:
+            out, matched, skipped = [], {}, 0
+            for pos in cand:
+                if len(out) >= limit:
+                    break
+                hits = [s for s in self.rows[pos].slots if slot_pred(s)]
+                if not hits:
+                    continue
+                if skipped < offset:
+                    skipped += 1
+                    continue
+                out.append(pos)
+                matched[pos] = sorted(hits, key=_Slot.sort_key)
+        distances = None
+        if dist is not None:
+            distances = {}
+            for pos in out:
+                d = dist[pos]
+                distances[pos] = None if d is None or d != d else round(float(d), 3)
+        return out, matched, distances
+
+    def blob(self, pos: int) -> bytes:
+        row = self.rows[pos]
+        return row.blob if row.blob is not None else self.snapshot.blob(row.snap_pos)
+
+    def json_one(self, pos: int, origin: str) -> bytes:
+        return self.blob(pos).replace(_ORIGIN_TOKEN_BYTES, origin.encode("utf-8"))
+
+    def json_array(self, positions, origin: str, extra: dict = None) -> bytes:
+        """JSON-массив карточек; extra — {позиция: dict}, поля дописываются в карточку."""
+        parts = []
+        for pos in positions:
+            blob = self.blob(pos)
+            if extra and pos in extra:
+                tail = json.dumps(extra[pos], ensure_ascii=False, separators=(",", ":"))[1:]
+                blob = blob[:-1] + b"," + tail.encode("utf-8")
+            parts.append(blob)
+        return (b"[" + b",".join(parts) + b"]").replace(_ORIGIN_TOKEN_BYTES, origin.encode("utf-8"))
+
+    def stats(self) -> dict:
+        return {
+            "clubs": len(self.order),
+            "positions": len(self.rows),
+            "snapshot_version": self.snapshot.version if self.snapshot is not None else None,
+            "from_snapshot": sum(1 for p in self.order if self.rows[p].blob is None),
+            "refreshed_at": self.refreshed_at,
+        }
+
+
+# ---- каталог этого воркера ----
+
+_cat = None
+_task = None
+_wakeup = None
+_generation = 0
+_synced_generation = 0
+
+
+def invalidate() -> None:
+    """После COMMIT записи в кружки: до следующего обновления читаем из БД."""
+    global _generation
+    _generation += 1
+    wake()
+
+
+def reload_ratings(club_ids=None) -> None:
+    """Рейтинг кружков изменился (updated_at тот же); None — сверить рейтинги всех."""
+    cat = _cat
+    if cat is not None:
+        if club_ids is None:
+            cat.check_ratings = True
+        else:
+            cat.rated.update(str(cid) for cid in club_ids)
+    wake()
+
+
+def wake() -> None:
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+def fresh():
+    """Каталог, если он догнал все известные записи и не старше CATALOG_MAX_STALE."""
+    cat = _cat
+    if cat is None or _synced_generation != _generation:
+        return None
+    if time.time() - cat.refreshed_at > CATALOG_MAX_STALE:
+        return None
+    return cat
+
+
+def status() -> dict:
+    cat = _cat
+    return {
+        "enabled": CATALOG_MEMORY,
+        "fresh": fresh() is not None,
+        **(cat.stats() if cat is not None else {}),
+    }
+
+
+async def prune_tombstones(session) -> None:
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=CATALOG_TOMBSTONE_DAYS)
+    await session.execute(delete(ClubTombstone).where(ClubTombstone.deleted_at < cutoff))
+
+
+async def _maintain(session_factory, serialize):
+    global _cat, _synced_generation
+    # NumPy (~0.1 с импорта) — в потоке, пока каталог ещё не собран и запросы идут в БД
+    await asyncio.to_thread(numpy)
+    while True:
+        gen = _generation
+        try:
+            snap = catalog_snapshot.current()
+            if _cat is None or (snap is not None and snap is not _cat.snapshot):
+                # новая версия снимка: собираем каталог заново и подменяем целиком
+                fresh_cat = Catalogue.from_snapshot(snap) if snap is not None else Catalogue()
+                await fresh_cat.refresh(session_factory, serialize)
+                if _cat is not None:
+                    # отметки, пришедшие во время сборки, — к следующему обновлению
+                    fresh_cat.rated |= _cat.rated
+                    fresh_cat.check_ratings |= _cat.check_ratings
+                _cat = fresh_cat
+            else:
+                await _cat.refresh(session_factory, serialize)
+            _synced_generation = gen
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print("[WARN] club catalogue refresh failed:", e)
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=CATALOG_REFRESH_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+def start(session_factory, serialize) -> None:
+    """serialize(club, base_origin) -> dict — сериализатор карточки из main.py."""
+    global _task, _wakeup
+    if CATALOG_MEMORY and _task is None:
+        _wakeup = asyncio.Event()
+        _task = asyncio.get_running_loop().create_task(_maintain(session_factory, serialize))
+
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
@@ -0,0 +1,349 @@
+# catalog_snapshot.py
+# Снимок каталога кружков в одном файле, который все воркеры отображают в память (mmap).
+#
+# Снимок строит фоновая задача catalog.snapshot (одна на всех, см. jobs.py) после
+# записи в кружки: колонки (id, координаты, категория, возраст, цена, updated_at, рейтинг)
+# лежат упакованными массивами, имя, slug и слоты расписания — для каталога в памяти
+# (catalog.py), карточка каждого кружка — готовым JSON. Новая версия
+# пишется во временный файл и подменяется os.replace(): читатель видит либо старую,
+# либо новую версию целиком. Перезапущенный воркер собирает каталог из файла без БД.
+# В процесс копируются колонки, id, имена, slug и слоты (каталог в памяти, индексы
+# по id/slug); JSON-карточки — большая часть файла — остаются в общих страницах
+# (page cache) и читаются из mmap при отдаче.
+#
+# Формат (порядок байт родной — файл локальный для машины):
+#   заголовок   MAGIC, версия, число кружков, число секций
+#   оглавление  (имя, смещение, длина) на каждую секцию
+#   секции      выровнены на 8 байт, числовые читаются memoryview.cast() без копий
+#
+# CLI:  python catalog_snapshot.py            # собрать снимок сейчас
+#       python catalog_snapshot.py --info     # версия и размер текущего
+import os
+import sys
+import json
+import mmap
+import time
+import uuid
+import struct
+import asyncio
+import argparse
+from array import array
+
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+
+from models import Club
+import jobs
+
+CATALOG_SNAPSHOT_PATH = os.getenv("CATALOG_SNAPSHOT_PATH", "catalog.snapshot")
+CATALOG_SNAPSHOT = os.getenv("CATALOG_SNAPSHOT", "on").strip().lower() not in ("0", "off", "false", "no")
+# как часто воркер проверяет (stat), не подменили ли файл
+CATALOG_CHECK_SECONDS = float(os.getenv("CATALOG_CHECK_SECONDS", "1"))
+# задержка пересборки: пачка записей подряд — одна сборка (dedup_key)
+CATALOG_REBUILD_DELAY = float(os.getenv("CATALOG_REBUILD_DELAY", "1"))
+CATALOG_BUILD_CHUNK = 500
+
+MAGIC = b"MPKCAT04"
+_HEADER = struct.Struct("=8sQII")
+_TOC = struct.Struct("=16sQQ")
+
+# base_origin при сериализации (символ из Private Use Area): при отдаче заменяется на origin запроса
+ORIGIN_TOKEN = "\ue000"
+
+NONE_INT = -2 ** 31
+
+# порядок выдачи "по имени" — один и тот же в БД (запасной путь, сборка снимка) и в
+# catalog.py: побайтовое сравнение UTF-8 (COLLATE "C") совпадает с порядком str в Python,
+# а порядок по локали БД в процессе не воспроизвести
+NAME_ORDER = (Club.name.collate("C"), Club.id)
+
+# секция -> typecode для array/memoryview.cast
+_TYPED = {
+    "lat": "d",
+    "lon": "d",
+    "updated": "d",
+    "min_age": "i",
+    "max_age": "i",
+    "price": "i",
+    "category": "I",
+    "rating_n": "i",
+    "rating_sum": "i",
+    "blob_off": "Q",
+    "slug_off": "Q",
+    "name_off": "Q",
+    "slot_off": "Q",
+    "slots": "i",
+}
+
+
+def _f(v) -> float:
+    return float("nan") if v is None else float(v)
+
+
+def _i(v) -> int:
+    return NONE_INT if v is None else int(v)
+
+
+def _epoch(dt) -> float:
+    return dt.timestamp() if dt is not None else 0.0
+
+
+def _minutes(t):
+    return None if t is None else t.hour * 60 + t.minute
+
+
+def slot_tuples(schedules) -> list:
+    """Schedule -> [(weekday, start_min, end_min, note)] — вид слотов в снимке и в catalog.py."""
+    return [(s.weekday, _minutes(s.start_time), _minutes(s.end_time), s.note or "") for s in schedules or ()]
+
+
+def pack(rows, version: int, built_at: float, watermark: float) -> bytes:
+    """rows: [(club_id: UUID, slug, name, lat, lon, updated, min_age, max_age, price_cents, category,
+    rating_count, rating_sum, slots, blob: bytes)]."""
+    n = len(rows)
+    categories, cat_index = [], {}
+    notes, note_index = [], {}
+    cols = {name: array(code) for name, code in _TYPED.items()}
+    ids, blobs, slugs, names = bytearray(), bytearray(), bytearray(), bytearray()
+    for off in ("blob_off", "slug_off", "name_off", "slot_off"):
+        cols[off].append(0)
+    for club_id, slug, name, lat, lon, updated, min_age, max_age, price, category, rating_n, rating_sum, slots, blob in rows:
+        ids += club_id.bytes
+        cols["lat"].append(_f(lat))
+        cols["lon"].append(_f(lon))
+        cols["updated"].append(updated)
+        cols["min_age"].append(_i(min_age))
+        cols["max_age"].append(_i(max_age))
+        cols["price"].append(_i(price))
+        cat = category or ""
+        if cat not in cat_index:
+            cat_index[cat] = len(categories)
+            categories.append(cat)
+        cols["category"].append(cat_index[cat])
+        cols["rating_n"].append(rating_n or 0)
+        cols["rating_sum"].append(rating_sum or 0)
+        blobs += blob
+        cols["blob_off"].append(len(blobs))
+        slugs += (slug or "").encode("utf-8")
+        cols["slug_off"].append(len(slugs))
+        names += (name or "").encode("utf-8")
+        cols["name_off"].append(len(names))
+        for weekday, start, end, note in slots:
+            if note not in note_index:
+                note_index[note] = len(notes)
+                notes.append(note)
+            cols["slots"].extend((_i(weekday), _i(start), _i(end), note_index[note]))
+        cols["slot_off"].append(len(cols["slots"]) // 4)
+
+    meta = {"version": version, "built_at": built_at, "watermark": watermark, "count": n}
+    sections = [
+        ("meta", json.dumps(meta).encode("utf-8")),
+        ("ids", bytes(ids)),
+        *((name, col.tobytes()) for name, col in cols.items()),
+        ("categories", json.dumps(categories, ensure_ascii=False).encode("utf-8")),
+        ("notes", json.dumps(notes, ensure_ascii=False).encode("utf-8")),
+        ("blobs", bytes(blobs)),
+        ("slugs", bytes(slugs)),
+        ("names", bytes(names)),
+    ]
+
+    pos = _HEADER.size + _TOC.size * len(sections)
+    toc, body = [], []
+    for name, data in sections:
+        pad = -pos % 8
+        body.append(b"\0" * pad)
+        pos += pad
+        toc.append(_TOC.pack(name.encode("ascii"), pos, len(data)))
+        body.append(data)
+        pos += len(data)
+    return b"".join([_HEADER.pack(MAGIC, version, n, len(sections)), *toc, *body])
+
+
+class Snapshot:
+    """Версия каталога, отображённая в память только на чтение."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.ident = (st.st_ino, st.st_mtime_ns)
+        self.size = st.st_size
+        buf = memoryview(self._mm)
+        magic, self.version, self.count, n_sections = _HEADER.unpack_from(buf, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: not a catalogue snapshot")
+        sections = {}
+        pos = _HEADER.size
+        for _ in range(n_sections):
+            name, off, length = _TOC.unpack_from(buf, pos)
+            pos += _TOC.size
+            sections[name.rstrip(b"\0").decode("ascii")] = buf[off:off + length]
+
+        meta = json.loads(bytes(sections["meta"]))
+        self.built_at = meta["built_at"]
+        self.watermark = meta["watermark"]
+        self.ids = sections["ids"]
+        self.blobs = sections["blobs"]
+        self.slugs = sections["slugs"]
+        self.names = sections["names"]
+        self.categories = json.loads(bytes(sections["categories"]))
+        self.notes = json.loads(bytes(sections["notes"]))
+        for name, code in _TYPED.items():
+            setattr(self, name, sections[name].cast(code))
+
+    def club_id(self, i: int) -> str:
+        return str(uuid.UUID(bytes=bytes(self.ids[i * 16:i * 16 + 16])))
+
+    def slug(self, i: int) -> str:
+        return bytes(self.slugs[self.slug_off[i]:self.slug_off[i + 1]]).decode("utf-8")
+
+    def name(self, i: int) -> str:
+        return bytes(self.names[self.name_off[i]:self.name_off[i + 1]]).decode("utf-8")
+
+    def slot_tuples(self, i: int) -> list:
+        out = []
+        for k in range(self.slot_off[i] * 4, self.slot_off[i + 1] * 4, 4):
+            weekday, start, end, note = self.slots[k:k + 4]
+            out.append((
+                None if weekday == NONE_INT else weekday,
+                None if start == NONE_INT else start,
+                None if end == NONE_INT else end,
+                self.notes[note],
+            ))
+        return out
+
+    def blob(self, i: int) -> bytes:
+        return bytes(self.blobs[self.blob_off[i]:self.blob_off[i + 1]])
+
+
+# ---- текущая версия в этом воркере ----
+
+_current = None
+_checked_at = 0.0
+
+
+def current(path: str = CATALOG_SNAPSHOT_PATH):
+    """Текущий снимок (None — файла ещё нет). Подмену файла замечает по stat()."""
+    global _current, _checked_at
+    if not CATALOG_SNAPSHOT:
+        return None
+    now = time.monotonic()
+    if now - _checked_at < CATALOG_CHECK_SECONDS:
+        return _current
+    _checked_at = now
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        _current = None
+        return None
+    if _current is None or _current.ident != (st.st_ino, st.st_mtime_ns):
+        try:
+            # старый mmap закроется сам, когда на него не останется ссылок
+            _current = Snapshot(path)
+        except (OSError, ValueError, KeyError) as e:
+            print("[WARN] catalogue snapshot open failed:", e)
+    return _current
+
+
+def recheck() -> None:
+    """Следующий current() перечитает stat() сразу (NOTIFY "catalog" от сборщика)."""
+    global _checked_at
+    _checked_at = 0.0
+
+
+def status() -> dict:
+    snap = current()
+    if snap is None:
+        return {"enabled": CATALOG_SNAPSHOT, "version": None}
+    return {
+        "enabled": CATALOG_SNAPSHOT,
+        "version": snap.version,
+        "count": snap.count,
+        "bytes": snap.size,
+        "built_at": snap.built_at,
+    }
+
+
+async def enqueue_rebuild(session) -> None:
+    """Пересобрать снимок после записи в кружки — в транзакции session."""
+    await jobs.enqueue(
+        session, "catalog.snapshot", {}, dedup_key="catalog.snapshot", delay=CATALOG_REBUILD_DELAY,
+    )
+
+
+# ---- сборка ----
+
+async def build(session_factory, serialize, path: str = CATALOG_SNAPSHOT_PATH) -> int:
+    """Собрать снимок из БД и атомарно подменить файл. serialize(club, base_origin) -> dict."""
+    built_at = time.time()
+    rows = []
+    watermark = 0.0
+    async with session_factory() as session:
+        ids = (await session.execute(select(Club.id).order_by(*NAME_ORDER))).scalars().all()
+        for i in range(0, len(ids), CATALOG_BUILD_CHUNK):
+            chunk = ids[i:i + CATALOG_BUILD_CHUNK]
+            q = await session.execute(
+                select(Club)
+                .where(Club.id.in_(chunk))
+                .options(
+                    selectinload(Club.address),
+                    selectinload(Club.images),
+                    selectinload(Club.schedules),
+                    selectinload(Club.teacher),
+                )
+            )
+            by_id = {c.id: c for c in q.scalars().all()}
+            for club_id in chunk:
+                c = by_id.get(club_id)
+                if c is None:  # удалён между запросами
+                    continue
+                out = serialize(c, ORIGIN_TOKEN)
+                updated = _epoch(c.updated_at)
+                watermark = max(watermark, updated)
+                rows.append((
+                    c.id, c.slug, c.name, out.get("lat"), out.get("lon"), updated,
+                    c.min_age, c.max_age, c.price_cents, c.category, c.rating_count, c.rating_sum,
+                    slot_tuples(c.schedules),
+                    json.dumps(out, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8"),
+                ))
+            session.expunge_all()
+
+    prev = current(path)
+    version = max(time.time_ns(), (prev.version + 1) if prev is not None else 0)
+    data = await asyncio.to_thread(pack, rows, version, built_at, watermark)
+    await asyncio.to_thread(_write_atomic, path, data)
+    recheck()
+    return version
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+async def _main():
+    ap = argparse.ArgumentParser(description="Build the mmap catalogue snapshot")
+    ap.add_argument("--info", action="store_true", help="print current snapshot info and exit")
+    args = ap.parse_args()
+    if args.info:
+        print(json.dumps(status(), ensure_ascii=False, indent=2))
+        return
+
+    # сериализатор карточки — из main.py, чтобы JSON совпадал с API
+    from main import _serialize_club
+    from db import AsyncSessionLocal
+
+    version = await build(AsyncSessionLocal, _serialize_club)
+    print(json.dumps(status(), ensure_ascii=False, indent=2))
+    print(f"[INFO] catalogue snapshot {version} written to {CATALOG_SNAPSHOT_PATH}")
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(_main())
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,206 @@
+# club_export.py
+# Потоковая выгрузка каталога кружков: CSV / NDJSON / Parquet (колоночный, zstd).
+#
+# Кружки читаются серверным курсором пачками по EXPORT_BATCH_SIZE (без ORM-объектов
+# и identity map), расписания подгружаются одним запросом на пачку. Память не
+# растёт с размером каталога. Колонки совпадают с тем, что понимает club_import.py,
+# так что выгрузку можно загрузить обратно.
+#
+# CLI:  python club_export.py --format csv -o clubs.csv
+import os
+import io
+import csv
+import sys
+import json
+import asyncio
+import argparse
+import tempfile
+
+from sqlalchemy import select
+
+from models import Club, Address, Schedule
+from club_fields import WEEKDAY_MAP
+import lazy
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+FORMATS = ("csv", "ndjson", "parquet")
+
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+COLUMNS = [
+    "id", "slug", "name", "category", "tags", "description", "meta_description",
+    "location", "street", "city", "lat", "lon", "phone", "webSite",
+    "min_age", "max_age", "price_rub", "price_notes", "pricing", "socialLinks",
+    "schedules", "image", "created_at", "updated_at",
+]
+
+_WEEKDAY_NAMES = {v: k.capitalize() for k, v in WEEKDAY_MAP.items()}
+
+_CLUB_COLUMNS = (
+    Club.id, Club.slug, Club.name, Club.category, Club.tags, Club.description,
+    Club.meta_description, Club.lat, Club.lon, Club.phone, Club.webSite,
+    Club.min_age, Club.max_age, Club.price_cents, Club.price_notes, Club.pricing,
+    Club.social_links, Club.main_image_url, Club.created_at, Club.updated_at,
+    Address.street, Address.city,
+)
+
+
+def _format_schedule(s) -> str:
+    """Строка расписания в том же виде, что парсит импорт: 'Понедельник 10:00-11:30'."""
+    day = _WEEKDAY_NAMES.get(s.weekday, "" if s.weekday is None else str(s.weekday))
+    if s.start_time and s.end_time:
+        time_str = f"{s.start_time.strftime('%H:%M')}-{s.end_time.strftime('%H:%M')}"
+    elif s.start_time or s.end_time:
+        time_str = (s.start_time or s.end_time).strftime("%H:%M")
+    else:
+        time_str = s.note or ""
+    return " ".join(p for p in (day, time_str) if p)
+
+
+def _flat_row(r, schedules) -> dict:
+    parts = [p.strip() for p in (r.street or "", r.city or "") if p and p.strip()]
+    return {
+        "id": str(r.id),
+        "slug": r.slug,
+        "name": r.name,
+        "category": r.category,
+        "tags": ", ".join(str(t) for t in (r.tags or [])),
+        "description": r.description,
+        "meta_description": r.meta_description,
+        "location": ", ".join(parts),
+        "street": r.street,
+        "city": r.city,
+        "lat": r.lat,
+        "lon": r.lon,
+        "phone": r.phone,
+        "webSite": r.webSite,
+        "min_age": r.min_age,
+        "max_age": r.max_age,
+        "price_rub": round(r.price_cents / 100.0, 2) if r.price_cents is not None else None,
+        "price_notes": r.price_notes,
+        "pricing": json.dumps(r.pricing, ensure_ascii=False) if r.pricing else None,
+        "socialLinks": json.dumps(r.social_links, ensure_ascii=False) if r.social_links else None,
+        "schedules": "; ".join(x for x in (_format_schedule(s) for s in schedules) if x),
+        "image": r.main_image_url,
+        "created_at": r.created_at.isoformat() if r.created_at else None,
+        "updated_at": r.updated_at.isoformat() if r.updated_at else None,
+    }
+
+
+async def iter_batches(session, batch_size: int = EXPORT_BATCH_SIZE):
+    """Пачки плоских dict'ов (по порядку id). Держит открытым серверный курсор."""
+    stmt = (
+        select(*_CLUB_COLUMNS)
+        .outerjoin(Address, Club.address_id == Address.id)
+        .order_by(Club.id)
+        .execution_options(yield_per=batch_size)
+    )
+    result = await session.stream(stmt)
+    async for rows in result.partitions(batch_size):
+        ids = [r.id for r in rows]
+        rs = await session.execute(
+            select(Schedule.club_id, Schedule.weekday, Schedule.start_time, Schedule.end_time, Schedule.note)
+            .where(Schedule.club_id.in_(ids))
+            .order_by(Schedule.club_id, Schedule.weekday, Schedule.start_time)
+        )
+        by_club = {}
+        for s in rs.all():
+            by_club.setdefault(s.club_id, []).append(s)
+        yield [_flat_row(r, by_club.get(r.id, ())) for r in rows]
+
+
+def _csv_chunk(rows, header: bool) -> bytes:
+    buf = io.StringIO()
+    w = csv.DictWriter(buf, fieldnames=COLUMNS, extrasaction="ignore")
+    if header:
+        w.writeheader()
+    w.writerows(rows)
+    # BOM в начале — чтобы Excel открыл кириллицу без мастера импорта
+    return (("\ufeff" if header else "") + buf.getvalue()).encode("utf-8")
+
+
+def _ndjson_chunk(rows) -> bytes:
+    return "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in rows).encode("utf-8")
+
+
+async def stream_text(session_factory, fmt: str, batch_size: int = EXPORT_BATCH_SIZE):
+    """Async-генератор байтов CSV/NDJSON — для StreamingResponse и CLI."""
+    async with session_factory() as session:
+        first = True
+        async for rows in iter_batches(session, batch_size):
+            if fmt == "csv":
+                yield _csv_chunk(rows, header=first)
+            else:
+                yield _ndjson_chunk(rows)
+            first = False
+        if first and fmt == "csv":
+            yield _csv_chunk([], header=True)
+
+
+def _arrow_schema(pyarrow):
+    ints = {"min_age", "max_age"}
+    floats = {"lat", "lon", "price_rub"}
+    return pyarrow.schema([
+        (c, pyarrow.int32() if c in ints else pyarrow.float64() if c in floats else pyarrow.string())
+        for c in COLUMNS
+    ])
+
+
+async def write_parquet(session_factory, path: str, batch_size: int = EXPORT_BATCH_SIZE) -> int:
+    """Parquet (zstd) по пачкам: одна row group на пачку, сжатие — в потоке."""
+    pq = lazy.optional("pyarrow.parquet")  # Parquet — опционально
+    if pq is None:
+        raise ValueError("parquet export requires pyarrow")
+    pyarrow = lazy.optional("pyarrow")
+    schema = _arrow_schema(pyarrow)
+    writer = pq.ParquetWriter(path, schema, compression="zstd")
+    total = 0
+    try:
+        async with session_factory() as session:
+            async for rows in iter_batches(session, batch_size):
+                table = pyarrow.Table.from_pylist(rows, schema=schema)
+                await asyncio.to_thread(writer.write_table, table)
+                total += len(rows)
+    finally:
+        await asyncio.to_thread(writer.close)
+    return total
+
+
+def temp_parquet_path() -> str:
+    fd, path = tempfile.mkstemp(prefix="clubs-export-", suffix=".parquet")
+    os.close(fd)
+    return path
+
+
+async def _main(argv=None):
+    p = argparse.ArgumentParser(description="Export clubs catalogue")
+    p.add_argument("--format", choices=FORMATS, default="csv")
+    p.add_argument("-o", "--output", help="output file (default: stdout for csv/ndjson)")
+    args = p.parse_args(argv)
+
+    from db import AsyncSessionLocal
+
+    if args.format == "parquet":
+        if not args.output:
+            p.error("--output is required for parquet")
+        n = await write_parquet(AsyncSessionLocal, args.output)
+        print(f"exported {n} clubs -> {args.output}", file=sys.stderr)
+        return 0
+
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        async for chunk in stream_text(AsyncSessionLocal, args.format):
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main()))
@@ -0,0 +1,374 @@
+# club_fields.py
+# Нормализация полей кружка из payload админки (общая для create/update и bulk-импорта).
+import uuid
+from datetime import time as dt_time
+
+
+def _to_float(v):
+    try:
+        if v is None:
+            return None
+        if isinstance(v, str):
+            v = v.strip().replace(",", ".")
+            if v == "":
+                return None
+        return float(v)
+    except Exception:
+        return None
+
+
+def _to_int(v):
+    try:
+        if v is None:
+            return None
+        if isinstance(v, str):
+            vv = v.strip().replace(',', '.')
+            if vv == '' or vv.lower() in ('null', 'undefined'):
+                return None
+            v = vv
+        return int(float(v))
+    except Exception:
+        return None
+
+
+def _to_uuid(v):
+    try:
+        if v is None or isinstance(v, uuid.UUID):
+            return v
+        v = str(v).strip()
+        return uuid.UUID(v) if v else None
+    except Exception:
+        return None
+
+
+def _jsonable(obj):
+    """Convert Pydantic models (and nested structures) into plain JSON-serializable objects."""
+    if obj is None:
+        return None
+
+    # pydantic v2
+    md = getattr(obj, "model_dump", None)
+    if callable(md):
+        try:
+            return _jsonable(md())
+        except Exception:
+            pass
+
+    # pydantic v1
+    dct = getattr(obj, "dict", None)
+    if callable(dct):
+        try:
+            return _jsonable(dct())
+        except Exception:
+            pass
+
+    if isinstance(obj, (str, int, float, bool)):
+        return obj
+
+    if isinstance(obj, (list, tuple)):
+        return [_jsonable(x) for x in obj]
+
+    if isinstance(obj, dict):
+        return {k: _jsonable(v) for k, v in obj.items()}
+
+    # last resort
+    try:
+        return str(obj)
+    except Exception:
+        return None
+
+
+def _normalize_club_pricing(pricing):
+    """Normalize pricing payload for JSONB: list of cards.
+
+    Accepts list of dicts (or Pydantic models). Filters out fully empty cards.
+    """
+    if pricing is None:
+        return None
+
+    out = []
+    for item in (pricing or []):
+        if item is None:
+            continue
+        d = _jsonable(item)
+        if not isinstance(d, dict):
+            continue
+
+        title = str(d.get('title') or '').strip()
+        # UI (админка) может присылать short description как subtitle ИЛИ desc
+        subtitle = str(d.get('subtitle') or d.get('desc') or d.get('description') or '').strip()
+        badge = str(d.get('badge') or '').strip()
+        unit = str(d.get('unit') or '').strip()
+        cta_text = str(d.get('cta_text') or d.get('ctaText') or '').strip()
+        # UI может прислать group или kind/type (single/subscription/...)
+        group = str(d.get('group') or d.get('kind') or d.get('type') or '').strip()
+
+        price_text = d.get('price_text')
+        if price_text is None:
+            price_text = d.get('priceText')
+        price_text = str(price_text).strip() if isinstance(price_text, str) else (str(price_text).strip() if price_text is not None else '')
+
+        price_rub = d.get('price_rub')
+        if price_rub is None:
+            price_rub = d.get('priceRub')
+        if price_rub is not None and str(price_rub).strip() != '':
+            try:
+                price_rub = float(str(price_rub).replace(',', '.'))
+            except Exception:
+                price_rub = None
+        else:
+            price_rub = None
+
+        details_list = []
+        details_text = d.get('detailsText')
+        if details_text is None:
+            details_text = d.get('details_text')
+        # старый формат админки: details как строка
+        if details_text is None and isinstance(d.get('details'), str):
+            details_text = d.get('details')
+        if isinstance(details_text, str) and details_text.strip():
+            for line in details_text.splitlines():
+                s = line.strip()
+                if s:
+                    details_list.append(s)
+        raw_details = d.get('details')
+        if isinstance(raw_details, list):
+            for x in raw_details:
+                s = str(x).strip()
+                if s and s not in details_list:
+                    details_list.append(s)
+
+        if not any([title, subtitle, badge, unit, price_text, price_rub, details_list]):
+            continue
+
+        out.append({
+            'id': str(d.get('id') or '').strip() or None,
+            'group': group or None,
+            'title': title or None,
+            'subtitle': subtitle or None,
+            'badge': badge or None,
+            'unit': unit or None,
+            'price_rub': price_rub,
+            'price_text': price_text or None,
+            'cta_text': cta_text or None,
+            'details': details_list,
+            'detailsText': details_text if isinstance(details_text, str) else None,
+        })
+
+    # allow clearing by sending []
+    return out
+
+
+def _split_location(loc_str: str):
+    if not loc_str:
+        return None, None
+    parts = [p.strip() for p in loc_str.split(",", 1)]
+    if len(parts) == 2 and parts[1]:
+        return parts[0], parts[1]
+    return loc_str.strip(), None
+
+
+WEEKDAY_MAP = {
+    "понедельник": 0, "вторник": 1, "среда": 2,
+    "четверг": 3, "пятница": 4, "суббота": 5, "воскресенье": 6
+}
+
+
+def _parse_schedule_item(s):
+    """{"day": "Понедельник", "time": "10:00-11:30"} -> поля Schedule (или None, если пусто)."""
+    if not isinstance(s, dict):
+        return None
+    raw_day = (s.get("day") or "").strip()
+    raw_time = (s.get("time") or "").strip()
+
+    if (not raw_time) and any(ch.isdigit() for ch in raw_day):
+        raw_time = raw_day
+        raw_day = ""
+
+    if not raw_day and not raw_time:
+        return None
+
+    weekday_val = None
+    if raw_day:
+        try:
+            weekday_val = int(raw_day)
+        except Exception:
+            weekday_val = WEEKDAY_MAP.get(raw_day.lower(), None)
+
+    start_time_obj = None
+    end_time_obj = None
+    note = None
+    if raw_time:
+        t = raw_time.replace("–", "-").replace("—", "-")
+        parts = [p.strip() for p in t.split("-", 1)]
+        if len(parts) == 2 and parts[0] and parts[1]:
+            try:
+                hh, mm = [int(x) for x in parts[0].split(":")]
+                start_time_obj = dt_time(hh, mm)
+            except Exception:
+                start_time_obj = None
+            try:
+                hh, mm = [int(x) for x in parts[1].split(":")]
+                end_time_obj = dt_time(hh, mm)
+            except Exception:
+                end_time_obj = None
+            if start_time_obj is None and end_time_obj is None:
+                note = raw_time
+        else:
+            note = raw_time
+
+    if weekday_val is None and not start_time_obj and not end_time_obj and not note:
+        return None
+
+    return {
+        "weekday": weekday_val,
+        "start_time": start_time_obj,
+        "end_time": end_time_obj,
+        "note": note,
+    }
+
+
+def _club_values_from_payload(payload: dict) -> dict:
+    """Колонки Club для нового кружка (без slug/address_id — их выдаёт вызывающий код)."""
+    lat = _to_float(payload.get("lat"))
+    lon = _to_float(payload.get("lon"))
+
+    # price
+    price_cents = None
+    if payload.get("price_rub") is not None:
+        try:
+            price_rub = float(payload.get("price_rub") or 0)
+            price_cents = int(round(price_rub * 100))
+        except Exception:
+            price_cents = None
+    elif payload.get("price_cents") is not None:
+        try:
+            price_cents = int(payload.get("price_cents"))
+        except Exception:
+            price_cents = None
+
+    phone = payload.get("phone") or ""
+    webSite = payload.get("webSite") or payload.get("website") or ""
+    social_links = payload.get("socialLinks") or payload.get("social_links") or {}
+    if not isinstance(social_links, dict):
+        social_links = {}
+    tags = payload.get("tags") or []
+    if not isinstance(tags, (list, tuple)):
+        tags = []
+    pricing_in = None
+    if "pricing" in payload:
+        pricing_in = payload.get("pricing")
+    elif "pricingItems" in payload:
+        pricing_in = payload.get("pricingItems")
+    elif "pricing_items" in payload:
+        pricing_in = payload.get("pricing_items")
+    pricing_norm = _normalize_club_pricing(pricing_in) if pricing_in is not None else None
+
+    return dict(
+        name=payload.get("name"),
+        description=payload.get("description") or "",
+        meta_description=((payload.get("meta_description") if "meta_description" in payload else None) or (payload.get("metaDescription") if "metaDescription" in payload else None) or None),
+        pricing=pricing_norm,
+        main_image_url=payload.get("image") or None,
+        price_cents=price_cents,
+        tags=list(tags),
+        category=(payload.get("category") or "").strip() or None,
+        min_age=_to_int(payload.get("minAge") or payload.get("min_age")),
+        max_age=_to_int(payload.get("maxAge") or payload.get("max_age")),
+        price_notes=(payload.get("priceNotes") or payload.get("price_notes") or "").strip() or None,
+        phone=phone,
+        webSite=webSite,
+        social_links=dict(social_links),
+        group_size=_to_int(payload.get("group_size")) or None,
+        teacher_id=_to_uuid(payload.get("teacher_id")),
+        lat=lat,
+        lon=lon,
+    )
+
+
+def _club_patch_values(payload: dict, current_social=None, merge: bool = False) -> dict:
+    """Колонки Club, которые затрагивает payload (только присланные ключи).
+
+    merge=True — JSON Merge Patch (RFC 7396): null очищает поле,
+    socialLinks сливается с текущими по ключам (null удаляет ключ).
+    """
+    out = {}
+    if "name" in payload:
+        out["name"] = payload.get("name")
+    if "description" in payload:
+        out["description"] = payload.get("description")
+
+    if "meta_description" in payload or "metaDescription" in payload:
+        v = payload.get("meta_description") if "meta_description" in payload else payload.get("metaDescription")
+        out["meta_description"] = (str(v).strip() if v is not None else None) or None
+
+    if "image" in payload:
+        out["main_image_url"] = payload.get("image")
+
+    if "price_rub" in payload:
+        v = payload.get("price_rub")
+        if v is None and merge:
+            out["price_cents"] = None
+        else:
+            try:
+                out["price_cents"] = int(round(float(v or 0) * 100))
+            except Exception:
+                out["price_cents"] = None
+    elif "price_cents" in payload:
+        try:
+            out["price_cents"] = int(payload.get("price_cents"))
+        except Exception:
+            out["price_cents"] = None
+
+    if "phone" in payload:
+        out["phone"] = payload.get("phone") or ""
+    if "webSite" in payload or "website" in payload:
+        out["webSite"] = payload.get("webSite") or payload.get("website") or ""
+
+    if "category" in payload:
+        v = payload.get("category")
+        out["category"] = (str(v).strip() if v is not None else None) or None
+    if "minAge" in payload or "min_age" in payload:
+        out["min_age"] = _to_int(payload.get("minAge") if "minAge" in payload else payload.get("min_age"))
+    if "maxAge" in payload or "max_age" in payload:
+        out["max_age"] = _to_int(payload.get("maxAge") if "maxAge" in payload else payload.get("max_age"))
+    if "priceNotes" in payload or "price_notes" in payload:
+        v = payload.get("priceNotes") if "priceNotes" in payload else payload.get("price_notes")
+        out["price_notes"] = (str(v).strip() if v is not None else None) or None
+
+    if ("pricing" in payload) or ("pricingItems" in payload) or ("pricing_items" in payload):
+        pricing_in = payload.get("pricing")
+        if pricing_in is None and "pricingItems" in payload:
+            pricing_in = payload.get("pricingItems")
+        if pricing_in is None and "pricing_items" in payload:
+            pricing_in = payload.get("pricing_items")
+        out["pricing"] = _normalize_club_pricing(pricing_in)
+
+    if "tags" in payload:
+        tags = payload.get("tags") or []
+        if not isinstance(tags, (list, tuple)):
+            tags = []
+        out["tags"] = list(tags)
+
+    if "socialLinks" in payload or "social_links" in payload:
+        social = payload.get("socialLinks") if "socialLinks" in payload else payload.get("social_links")
+        if merge and isinstance(social, dict):
+            merged = dict(current_social or {})
+            for k, v in social.items():
+                if v is None:
+                    merged.pop(k, None)
+                else:
+                    merged[k] = v
+            social = merged
+        if not isinstance(social, dict):
+            social = {}
+        out["social_links"] = dict(social)
+
+    return out
+
+
+def _schedule_key(s):
+    """Содержимое строки расписания — для диффа существующих Schedule с присланными."""
+    if isinstance(s, dict):
+        return (s.get("weekday"), s.get("start_time"), s.get("end_time"), s.get("note") or None)
+    return (s.weekday, s.start_time, s.end_time, s.note or None)
@@ -0,0 +1,389 @@
+# club_import.py
+# Массовый импорт кружков из CSV / JSON / NDJSON / XLSX.
+#
+# Файл читается потоково пачками по IMPORT_BATCH_SIZE строк, каждая строка
+# проходит ту же нормализацию, что и api_create_club (club_fields.py), и пишется
+# многострочными INSERT'ами (addresses, clubs, schedules) в одной транзакции.
+# Ошибочные строки не ломают импорт — они попадают в отчёт с номером строки.
+#
+# CLI:  python club_import.py clubs.csv [--format csv] [--dry-run]
+import os
+import io
+import re
+import csv
+import sys
+import json
+import uuid
+import asyncio
+import argparse
+import datetime
+
+from sqlalchemy import insert
+
+from models import Club, Address, Schedule
+from club_fields import _club_values_from_payload, _parse_schedule_item, _split_location, _to_int
+from slugs import _slugify_basic, taken_slugs, pick_free_slug
+import jobs
+import lazy
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+
+FORMATS = ("csv", "json", "ndjson", "xlsx")
+
+# алиасы колонок из партнёрских таблиц -> ключи payload админки
+_COLUMN_ALIASES = {
+    "название": "name", "title": "name",
+    "адрес": "location", "address": "location",
+    "категория": "category",
+    "описание": "description",
+    "телефон": "phone",
+    "сайт": "webSite", "website": "webSite", "site": "webSite",
+    "теги": "tags",
+    "расписание": "schedules", "schedule": "schedules",
+    "цена": "price_rub", "price": "price_rub",
+    "возраст_от": "minAge", "возраст_до": "maxAge",
+    "min_age": "minAge", "max_age": "maxAge",
+    "latitude": "lat", "longitude": "lon", "lng": "lon",
+}
+
+_JSON_FIELDS = ("pricing", "pricingItems", "pricing_items", "socialLinks", "social_links")
+
+# текстовые поля payload -> предел длины колонки (None — Text). Ячейки XLSX приходят
+# числами (телефон) и датами — приводим к str; dict/list в текстовое поле — ошибка строки
+_TEXT_FIELDS = {
+    "name": 255, "category": 255, "phone": 64,
+    "webSite": 1024, "website": 1024, "image": 1024,
+    "description": None, "meta_description": None, "metaDescription": None,
+    "priceNotes": None, "price_notes": None, "location": None, "slug": None,
+}
+# integer-колонки (Postgres int4): значение вне диапазона — DataError на INSERT всей пачки
+_INT4_FIELDS = (("min_age", "minAge"), ("max_age", "maxAge"), ("price_cents", "price_rub"))
+_INT4_MIN, _INT4_MAX = -2 ** 31, 2 ** 31 - 1
+
+
+def detect_format(filename: str, explicit: str | None = None) -> str:
+    if explicit:
+        fmt = explicit.strip().lower()
+    else:
+        ext = os.path.splitext(filename or "")[1].lower().lstrip(".")
+        fmt = {"jsonl": "ndjson", "xls": "xlsx"}.get(ext, ext)
+    if fmt not in FORMATS:
+        raise ValueError(f"unsupported format: {fmt or '?'} (expected {'|'.join(FORMATS)})")
+    return fmt
+
+
+class RowError:
+    """Строка, которую не удалось разобрать (битый JSON в ndjson) — ошибка этой строки, не всего импорта."""
+
+    def __init__(self, message: str):
+        self.message = message
+
+
+def iter_rows(fileobj, fmt: str):
+    """Построчно отдаёт dict'ы из бинарного файла (без чтения всего файла в память).
+
+    Неразобранная строка ndjson — RowError (validate_row вернёт её как ошибку строки).
+    """
+    if fmt == "xlsx":
+        openpyxl = lazy.optional("openpyxl")  # XLSX — опционально
+        if openpyxl is None:
+            raise ValueError("xlsx import requires openpyxl")
+        wb = openpyxl.load_workbook(fileobj, read_only=True, data_only=True)
+        try:
+            rows = wb.active.iter_rows(values_only=True)
+            header = [str(h or "").strip() for h in next(rows, [])]
+            for values in rows:
+                if values is None or all(v is None or str(v).strip() == "" for v in values):
+                    continue
+                yield {h: v for h, v in zip(header, values) if h}
+        finally:
+            wb.close()
+        return
+
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        first = text.readline()
+        delimiter = ";" if first.count(";") > first.count(",") else ","
+        reader = csv.DictReader(_chain_line(first, text), delimiter=delimiter)
+        for row in reader:
+            yield row
+    elif fmt == "ndjson":
+        for line in text:
+            line = line.strip()
+            if line:
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    yield RowError(f"bad JSON: {e}")
+    else:
+        # JSON-массив целиком (или {"items": [...]}); для больших файлов — ndjson
+        data = json.load(text)
+        if isinstance(data, dict):
+            data = data.get("items") or data.get("clubs") or []
+        for item in data:
+            yield item
+
+
+def _chain_line(first, rest):
+    yield first
+    yield from rest
+
+
+def _parse_schedules_text(text: str):
+    """'Понедельник 10:00-11:00; Среда 17:30-19:00' -> [{"day": ..., "time": ...}]."""
+    out = []
+    for chunk in re.split(r"[;\n]+", text or ""):
+        chunk = chunk.strip()
+        if not chunk:
+            continue
+        m = re.match(r"^([^\d\s,]+)[\s,]+(.+)$", chunk)
+        if m:
+            out.append({"day": m.group(1), "time": m.group(2).strip()})
+        else:
+            out.append({"day": chunk, "time": ""})
+    return out
+
+
+def row_to_payload(row: dict) -> dict:
+    payload = {}
+    for k, v in (row or {}).items():
+        if k is None:
+            continue
+        key = str(k).strip()
+        key = _COLUMN_ALIASES.get(key.lower(), key)
+        if isinstance(v, str):
+            v = v.strip()
+            if v == "":
+                continue
+        if v is None:
+            continue
+        payload[key] = v
+
+    if isinstance(payload.get("tags"), str):
+        payload["tags"] = [t.strip() for t in re.split(r"[,;]", payload["tags"]) if t.strip()]
+    if isinstance(payload.get("schedules"), str):
+        payload["schedules"] = _parse_schedules_text(payload["schedules"])
+    for f in _JSON_FIELDS:
+        if isinstance(payload.get(f), str):
+            payload[f] = json.loads(payload[f])
+    return payload
+
+
+def _as_text(v):
+    """Значение ячейки -> str (79991234567.0 -> "79991234567"); None — это не текст."""
+    if isinstance(v, bool):
+        return None
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    if isinstance(v, (str, int, float, datetime.date, datetime.time)):
+        return str(v)
+    return None
+
+
+def _validate_schedules(raw_schedules, errors: list) -> list:
+    out = []
+    for i, s in enumerate(raw_schedules, 1):
+        if not isinstance(s, dict):
+            errors.append(f"schedule #{i} must be an object")
+            continue
+        item = {}
+        for key in ("day", "time"):
+            if s.get(key) is None:
+                continue
+            text = _as_text(s[key])
+            if text is None:
+                errors.append(f"schedule #{i}: {key} must be text")
+            else:
+                item[key] = text
+        parsed = _parse_schedule_item(item)
+        if parsed is None:
+            continue
+        if parsed["weekday"] is not None and not 0 <= parsed["weekday"] <= 7:
+            errors.append(f"schedule #{i}: day out of range")
+            continue
+        out.append(parsed)
+    return out
+
+
+def validate_row(row: dict):
+    """-> (payload, errors). payload уже нормализован тем же кодом, что и api_create_club."""
+    errors = []
+    if isinstance(row, RowError):
+        return None, [row.message]
+    if not isinstance(row, dict):
+        return None, [f"row must be an object, got {type(row).__name__}"]
+    try:
+        payload = row_to_payload(row)
+    except (ValueError, TypeError) as e:
+        return None, [f"bad JSON field: {e}"]
+
+    for key, limit in _TEXT_FIELDS.items():
+        if payload.get(key) is None:
+            continue
+        text = _as_text(payload[key])
+        if text is None:
+            errors.append(f"{key} must be text, got {type(payload.pop(key)).__name__}")
+            continue
+        if limit is not None and len(text.strip()) > limit:
+            errors.append(f"{key} is longer than {limit} chars")
+        payload[key] = text
+    if isinstance(payload.get("tags"), list):
+        tags = [_as_text(t) for t in payload["tags"]]
+        if any(t is None for t in tags):
+            errors.append("tags must be a list of strings")
+            tags = [t for t in tags if t is not None]
+        payload["tags"] = tags
+    for key in ("pricing", "pricingItems", "pricing_items"):
+        if payload.get(key) is not None and not isinstance(payload[key], list):
+            errors.append(f"{key} must be a list")
+            payload.pop(key)
+
+    name = (payload.get("name") or "").strip()
+    if not name:
+        errors.append("name is required")
+    payload["name"] = name
+
+    values = _club_values_from_payload(payload)
+    lat, lon = values["lat"], values["lon"]
+    if (lat is None) != (lon is None):
+        errors.append("lat and lon must be set together")
+    if lat is not None and not -90 <= lat <= 90:
+        errors.append("lat out of range")
+    if lon is not None and not -180 <= lon <= 180:
+        errors.append("lon out of range")
+    if values["min_age"] is not None and values["max_age"] is not None and values["min_age"] > values["max_age"]:
+        errors.append("minAge > maxAge")
+    if payload.get("price_rub") is not None and values["price_cents"] is None:
+        errors.append("price_rub is not a number")
+    for column, key in _INT4_FIELDS:
+        if values[column] is not None and not _INT4_MIN <= values[column] <= _INT4_MAX:
+            errors.append(f"{key} out of range")
+    if payload.get("group_size") is not None and _to_int(payload["group_size"]) is None:
+        errors.append("group_size is not a number")
+    elif values["group_size"] is not None and not 0 < values["group_size"] <= 100000:
+        errors.append("group_size out of range")
+    if payload.get("teacher_id") is not None and values["teacher_id"] is None:
+        errors.append("teacher_id is not a UUID")
+
+    raw_schedules = payload.get("schedules") or []
+    if not isinstance(raw_schedules, list):
+        errors.append("schedules must be a list or 'День ЧЧ:ММ-ЧЧ:ММ; ...' string")
+        raw_schedules = []
+    schedules = _validate_schedules(raw_schedules, errors)
+
+    return {
+        "values": values,
+        "slug": payload.get("slug"),
+        "location": str(payload.get("location") or "").strip(),
+        "schedules": schedules,
+    }, errors
+
+
+def _take(it, n):
+    """Следующие n строк итератора (вызывается в потоке — парсинг не блокирует event loop)."""
+    out = []
+    for row in it:
+        out.append(row)
+        if len(out) >= n:
+            break
+    return out
+
+
+async def import_clubs(session, rows, dry_run: bool = False, batch_size: int = IMPORT_BATCH_SIZE) -> dict:
+    """Импорт в рамках переданной сессии. Коммит/откат — на вызывающем коде."""
+    taken = await taken_slugs(session, "club")
+    report = {"total": 0, "imported": 0, "failed": 0, "errors": [], "ids": [], "dry_run": dry_run}
+    now = datetime.datetime.utcnow()
+    it = iter(rows)
+    line_no = 0
+
+    while True:
+        batch = await asyncio.to_thread(_take, it, batch_size)
+        if not batch:
+            break
+
+        addresses, clubs, schedules = [], [], []
+        for row in batch:
+            line_no += 1
+            report["total"] += 1
+            parsed, errors = validate_row(row)
+            if errors:
+                report["failed"] += 1
+                name = str((row or {}).get("name") or (row or {}).get("название") or "") if isinstance(row, dict) else ""
+                report["errors"].append({"row": line_no, "name": name, "errors": errors})
+                continue
+
+            values = parsed["values"]
+            club_id = uuid.uuid4()
+            slug = pick_free_slug(_slugify_basic(parsed["slug"] or values["name"], fallback="club"), taken)
+            taken.add(slug)
+
+            address_id = None
+            if parsed["location"]:
+                street_val, city_val = _split_location(parsed["location"])
+                if street_val:
+                    address_id = uuid.uuid4()
+                    addresses.append({
+                        "id": address_id, "street": street_val, "city": city_val,
+                        "lat": values["lat"], "lon": values["lon"],
+                    })
+
+            clubs.append({
+                **values,
+                "id": club_id,
+                "slug": slug,
+                "address_id": address_id,
+                "created_at": now,
+                "updated_at": now,
+            })
+            for item in parsed["schedules"]:
+                schedules.append({"id": uuid.uuid4(), "club_id": club_id, **item})
+            report["ids"].append(str(club_id))
+
+        if not dry_run:
+            # executemany -> многострочные INSERT ... VALUES (insertmanyvalues)
+            if addresses:
+                await session.execute(insert(Address), addresses)
+            if clubs:
+                await session.execute(insert(Club), clubs)
+            if schedules:
+                await session.execute(insert(Schedule), schedules)
+        report["imported"] += len(clubs)
+
+    return report
+
+
+async def _main(argv=None):
+    p = argparse.ArgumentParser(description="Bulk import clubs")
+    p.add_argument("path")
+    p.add_argument("--format", choices=FORMATS)
+    p.add_argument("--dry-run", action="store_true")
+    p.add_argument("--report", help="write JSON report to this file")
+    args = p.parse_args(argv)
+
+    from db import AsyncSessionLocal
+
+    fmt = detect_format(args.path, args.format)
+    with open(args.path, "rb") as f:
+        async with AsyncSessionLocal() as session:
+            report = await import_clubs(session, iter_rows(f, fmt), dry_run=args.dry_run)
+            if args.dry_run:
+                await session.rollback()
+            else:
+                if report["ids"]:
+                    # статические страницы сгенерирует воркер очереди (API или python jobs.py)
+                    await jobs.enqueue(session, "club.static", {"club_ids": report["ids"]})
+                await session.commit()
+
+    summary = {k: v for k, v in report.items() if k != "ids"}
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as out:
+            json.dump(summary, out, ensure_ascii=False, indent=2)
+    print(f"total={report['total']} imported={report['imported']} failed={report['failed']}")
+    for e in report["errors"][:50]:
+        print(f"  row {e['row']}: {e['name']}: {'; '.join(e['errors'])}")
+    return 0 if not report["failed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main()))
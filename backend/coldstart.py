@@ -0,0 +1,126 @@
+# coldstart.py
+# Холодный старт воркера: профиль импорта и бенчмарк с бюджетом.
+#
+#   python coldstart.py profile [--top 25]      # что импортирует main и сколько это стоит
+#   python coldstart.py bench [--runs 5] [--budget-ms 1200]
+#
+# Каждый замер — отдельный интерпретатор (кэш модулей пустой, как после рестарта):
+# import main + create_app(). Старт с БД (startup-хуки) сюда не входит — только то,
+# что воркер делает до того, как начнёт принимать соединения. bench выходит с кодом 1,
+# если медиана превысила бюджет (COLDSTART_BUDGET_MS) — шаг CI/деплоя ловит регрессию.
+# Тяжёлые необязательные пакеты грузятся лениво (lazy.py) и в профиль не попадают.
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+COLDSTART_BUDGET_MS = float(os.getenv("COLDSTART_BUDGET_MS", "1200"))
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+_PROBE = """
+import time, json
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+main.create_app()
+t2 = time.perf_counter()
+print(json.dumps({"import_ms": (t1 - t0) * 1000, "app_ms": (t2 - t1) * 1000}))
+"""
+
+
+def _run(args, env_extra=None):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        # create_app() создаёт каталоги — не мусорим в рабочей копии
+        env.setdefault("MEDIA_DIR", os.path.join(tmp, "media"))
+        env.setdefault("STATIC_CLUBS_DIR", os.path.join(tmp, "static_clubs"))
+        env.update(env_extra or {})
+        return subprocess.run([sys.executable, *args], cwd=HERE, env=env, capture_output=True, text=True)
+
+
+def measure() -> dict:
+    """Один холодный старт в новом процессе: {"import_ms", "app_ms", "total_ms"}."""
+    p = _run(["-c", _PROBE], {"PYTHONWARNINGS": "ignore"})
+    if p.returncode != 0:
+        raise RuntimeError(p.stderr.strip() or f"probe exited with {p.returncode}")
+    out = json.loads(p.stdout.strip().splitlines()[-1])
+    out["total_ms"] = out["import_ms"] + out["app_ms"]
+    return out
+
+
+def import_profile() -> list:
+    """[(cumulative_ms, self_ms, module)] прямых импортов main по -X importtime."""
+    p = _run(["-X", "importtime", "-c", "import main; main.create_app()"], {"PYTHONWARNINGS": "ignore"})
+    if p.returncode != 0:
+        raise RuntimeError(p.stderr.strip() or f"import exited with {p.returncode}")
+    rows = []
+    for line in p.stderr.splitlines():
+        if not line.startswith("import time:") or line.count("|") < 2:
+            continue
+        self_us, cum_us, name = line[len("import time:"):].split("|", 2)
+        try:
+            rows.append((int(cum_us), int(self_us), name[1:].rstrip()))
+        except ValueError:
+            continue  # заголовок "self [us] | cumulative | imported package"
+    # importtime печатает дочерние модули до родителя; прямые импорты main — на отступ глубже
+    depth = None
+    direct = []
+    for cum, own, name in reversed(rows):
+        level = len(name) - len(name.lstrip())
+        if name.strip() == "main":
+            depth = level + 2
+            continue
+        if depth is not None and level == depth:
+            direct.append((cum / 1000, own / 1000, name.strip()))
+        elif depth is not None and level < depth:
+            break
+    return sorted(direct, reverse=True)
+
+
+def _cmd_profile(args):
+    rows = import_profile()
+    total = sum(r[0] for r in rows)
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module   (импорты main: {total:.0f} ms)")
+    for cum, own, name in rows[:args.top]:
+        print(f"{cum:14.1f} {own:9.1f}  {name}")
+    return 0
+
+
+def _cmd_bench(args):
+    runs = [measure() for _ in range(max(1, args.runs))]
+    median = statistics.median(r["total_ms"] for r in runs)
+    print(json.dumps({
+        "runs": len(runs),
+        "median_ms": round(median, 1),
+        "min_ms": round(min(r["total_ms"] for r in runs), 1),
+        "import_ms": round(statistics.median(r["import_ms"] for r in runs), 1),
+        "app_ms": round(statistics.median(r["app_ms"] for r in runs), 1),
+        "budget_ms": args.budget_ms,
+    }, ensure_ascii=False, indent=2))
+    if median > args.budget_ms:
+        print(f"[ERROR] cold start {median:.0f} ms is over budget {args.budget_ms:.0f} ms "
+              f"(python coldstart.py profile — что подорожало)", file=sys.stderr)
+        return 1
+    return 0
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Cold start profile / benchmark for main.py")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("profile", help="import-time profile of main (python -X importtime)")
+    p.add_argument("--top", type=int, default=25)
+    p.set_defaults(fn=_cmd_profile)
+    b = sub.add_parser("bench", help="median cold start over fresh interpreters; exit 1 if over budget")
+    b.add_argument("--runs", type=int, default=5)
+    b.add_argument("--budget-ms", type=float, default=COLDSTART_BUDGET_MS)
+    b.set_defaults(fn=_cmd_bench)
+    args = ap.parse_args(argv)
+    return args.fn(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,19 +3,40 @@ import os
 import asyncio
 import logging
 
-from sqlalchemy import text
+from sqlalchemy import text, inspect
 
 # Добавить корень проекта в sys.path (чтобы импорты работали при запуске из любого места)
 PROJECT_ROOT = os.path.abspath(os.path.dirname(__file__))
 if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
-from db import engine  # noqa: E402
+from db import engine, AsyncSessionLocal  # noqa: E402
 from models import Base  # noqa: E402
+from blog_search import reindex_missing  # noqa: E402
+import migrations  # noqa: E402
 
 logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
 
 
+def _add_missing_columns(sync_conn) -> None:
+    """ALTER TABLE ... ADD COLUMN для новых nullable-колонок моделей.
+
+    Только простые случаи (nullable, без server_default): всё остальное — миграцией.
+    """
+    insp = inspect(sync_conn)
+    existing_tables = set(insp.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        have = {c["name"] for c in insp.get_columns(table.name)}
+        for col in table.columns:
+            if col.name in have or not col.nullable or col.server_default is not None:
+                continue
+            col_type = col.type.compile(dialect=sync_conn.dialect)
+            logging.info(f"add column {table.name}.{col.name} {col_type}")
+            sync_conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN IF NOT EXISTS "{col.name}" {col_type}'))
+
+
 async def init_db() -> None:
     """Создает все недостающие таблицы/индексы по SQLAlchemy моделям.
 
@@ -41,6 +62,8 @@ async def init_db() -> None:
         # Создать недостающие таблицы
         await conn.run_sync(Base.metadata.create_all)
 
+        await conn.run_sync(_add_missing_columns)
+
         # Быстрая проверка, что blog_posts есть (если модель BlogPost добавлена в models.py)
         try:
             r = await conn.execute(text("SELECT to_regclass('public.blog_posts');"))
@@ -48,6 +71,20 @@ async def init_db() -> None:
         except Exception as e:
             logging.warning(f'Не удалось проверить blog_posts: {e}')
 
+    # create_all создаёт индексы только вместе с новой таблицей — на существующие
+    # таблицы индексы ставят миграции и досоздание по моделям, оба CONCURRENTLY
+    # (вне транзакции, запись в таблицы не блокируется)
+    await migrations.migrate(engine)
+    built = await migrations.create_missing_model_indexes(engine)
+    if built:
+        logging.info(f"model indexes built: {', '.join(built)}")
+
+    # search_vector для статей, созданных до появления полнотекстового поиска
+    async with AsyncSessionLocal() as session:
+        n = await reindex_missing(session)
+        if n:
+            logging.info(f"blog search_vector reindexed: {n}")
+
 
 if __name__ == '__main__':
     asyncio.run(init_db())
@@ -3,6 +3,7 @@ from sqlalchemy.exc import NoResultFound
 from sqlalchemy.orm import selectinload
 from models import Club, Review
 from db import AsyncSessionLocal
+from ratings import apply_ratings, publish as publish_ratings
 
 async def get_clubs(limit: int = 100, offset: int = 0):
     """
@@ -14,7 +15,6 @@ async def get_clubs(limit: int = 100, offset: int = 0):
             select(Club)
             .options(
                 selectinload(Club.images),
-                selectinload(Club.reviews),
                 selectinload(Club.schedules),
                 selectinload(Club.teacher),
                 selectinload(Club.address),
@@ -31,7 +31,6 @@ async def get_club_by_id(club_id):
             select(Club)
             .options(
                 selectinload(Club.images),
-                selectinload(Club.reviews),
                 selectinload(Club.schedules),
                 selectinload(Club.teacher),
                 selectinload(Club.address)
@@ -54,6 +53,10 @@ async def create_review_for_club(club_id: str, payload):
             text=getattr(payload, "text", None)
         )
         session.add(review)
+        # средняя оценка и число отзывов — в той же транзакции (ratings.py)
+        if review.rating is not None:
+            await apply_ratings(session, {club.id: (1, review.rating)})
+            await publish_ratings(session, [club.id])
         await session.commit()
         await session.refresh(review)
         return review
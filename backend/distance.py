@@ -0,0 +1,63 @@
+# distance.py
+# Расстояние от точки пользователя до кружков (список под картой: near=, radius_km=).
+#
+# Гаверсинус по всему набору координат — один векторный проход NumPy: catalog.py
+# держит lat/lon колонками array('d'), np.frombuffer() читает их без копии.
+# Без NumPy тот же расчёт идёт циклом на math — медленнее, результат тот же.
+# distance_sql() — то же выражение для запроса в БД (когда каталог в памяти отстал).
+# NumPy импортируется при первом расчёте (lazy.py), не при старте воркера.
+import math
+
+from sqlalchemy import func
+
+import lazy
+
+EARTH_RADIUS_KM = 6371.0088
+
+SORTS = ("name", "distance")
+
+
+def numpy():
+    """Модуль numpy или None (NumPy — опционально)."""
+    return lazy.optional("numpy")
+
+
+def parse_near(value: str):
+    """'55.75,37.61' -> (lat, lon); ValueError на мусоре."""
+    lat_s, sep, lon_s = (value or "").partition(",")
+    try:
+        lat, lon = float(lat_s), float(lon_s)
+    except ValueError:
+        raise ValueError("near must be 'lat,lon'")
+    if not sep or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError("near must be 'lat,lon'")
+    return lat, lon
+
+
+def haversine_km(lats, lons, lat: float, lon: float):
+    """Массивы координат (NaN — нет координат) -> массив расстояний в км."""
+    np = numpy()
+    phi1 = np.radians(lats)
+    phi2 = math.radians(lat)
+    dphi = phi1 - phi2
+    dlmb = np.radians(lons) - math.radians(lon)
+    a = np.sin(dphi * 0.5) ** 2 + np.cos(phi1) * math.cos(phi2) * np.sin(dlmb * 0.5) ** 2
+    return (2 * EARTH_RADIUS_KM) * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def haversine_one(lat1, lon1, lat2: float, lon2: float):
+    if lat1 is None or lon1 is None or math.isnan(lat1) or math.isnan(lon1):
+        return None
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((phi1 - phi2) / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon1 - lon2) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def distance_sql(lat_col, lon_col, lat: float, lon: float):
+    """Гаверсинус в SQL (NULL, если у кружка нет координат)."""
+    a = (
+        func.power(func.sin(func.radians(lat_col - lat) * 0.5), 2)
+        + math.cos(math.radians(lat)) * func.cos(func.radians(lat_col))
+        * func.power(func.sin(func.radians(lon_col - lon) * 0.5), 2)
+    )
+    return 2 * EARTH_RADIUS_KM * func.asin(func.sqrt(func.least(a, 1.0)))
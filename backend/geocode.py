@@ -0,0 +1,386 @@
+# geocode.py
+# Серверный геокодинг: кэш по нормализованному адресу + фоновая пачечная задача.
+#
+# - geocode_cache: addr_norm -> lat/lon (или not_found). Один и тот же адрес у
+#   нескольких кружков геокодится один раз; повторные запуски берут из кэша.
+# - Провайдер подключаемый (GEOCODER_PROVIDER=yandex|stub или set_provider()),
+#   stub читает ответы из JSON-файла — для локальной разработки и тестов.
+# - Запросы к провайдеру идут параллельно (GEOCODE_CONCURRENCY), но не чаще
+#   GEOCODE_RATE в секунду, с повторами и backoff на 429/5xx/таймауты.
+#
+# ВАЖНО: ключ Яндекса по умолчанию whitelisted по домену, и серверные запросы без
+# Referer получают 403. Для задачи нужен ключ без referer-ограничений
+# (YANDEX_GEOCODER_API_KEY) или IP allowlist; иначе геокодинг делается в админке.
+import os
+import json
+import random
+import asyncio
+import datetime
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from sqlalchemy import select, update, or_, and_, func, bindparam
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from models import Club, Address, GeocodeCache
+from club_fields import _to_float
+import notify
+import catalog_snapshot
+import catalog
+
+YANDEX_MAPS_API_KEY = os.getenv("YANDEX_GEOCODER_API_KEY", "58c38b72-57f7-4946-bc13-a256d341281a")
+
+GEOCODE_CONCURRENCY = int(os.getenv("GEOCODE_CONCURRENCY", "4"))
+GEOCODE_RATE = float(os.getenv("GEOCODE_RATE", "5"))  # запросов в секунду, 0 — без ограничения
+GEOCODE_RETRIES = int(os.getenv("GEOCODE_RETRIES", "3"))
+GEOCODE_BATCH = int(os.getenv("GEOCODE_BATCH", "200"))  # уникальных адресов на транзакцию
+# "не найдено" перепроверяем не раньше, чем через N дней
+GEOCODE_NEGATIVE_TTL_DAYS = int(os.getenv("GEOCODE_NEGATIVE_TTL_DAYS", "30"))
+
+
+def _norm_addr(addr: str) -> str:
+    return " ".join(str(addr or "").strip().lower().split())
+
+
+class GeocodeTransientError(Exception):
+    """Временная ошибка провайдера (429/5xx/таймаут) — запрос стоит повторить."""
+
+
+class YandexGeocoder:
+    name = "yandex"
+
+    def __init__(self, api_key: str = YANDEX_MAPS_API_KEY, timeout: float = 8):
+        self.api_key = api_key
+        self.timeout = timeout
+
+    def _fetch(self, url: str) -> str:
+        req = urllib.request.Request(url, headers={"User-Agent": "mapka-backend/1.0"})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                return resp.read().decode("utf-8", errors="ignore")
+        except urllib.error.HTTPError as e:
+            if e.code == 429 or e.code >= 500:
+                raise GeocodeTransientError(f"HTTP {e.code}")
+            raise
+        except (urllib.error.URLError, TimeoutError) as e:
+            raise GeocodeTransientError(str(e))
+
+    async def geocode(self, address: str):
+        """-> (lat, lon) или None, если адрес не найден."""
+        params = {
+            "format": "json",
+            "apikey": self.api_key,
+            "geocode": address,
+            "results": "1",
+        }
+        url = "https://geocode-maps.yandex.ru/1.x/?" + urllib.parse.urlencode(params)
+        raw = await asyncio.to_thread(self._fetch, url)
+        data = json.loads(raw)
+        members = data.get("response", {}).get("GeoObjectCollection", {}).get("featureMember") or []
+        pos = members[0].get("GeoObject", {}).get("Point", {}).get("pos") if members else None
+        if not pos:
+            return None
+        # pos: "lon lat"
+        lon_s, lat_s = pos.split()[:2]
+        lat, lon = _to_float(lat_s), _to_float(lon_s)
+        if lat is None or lon is None:
+            return None
+        return (lat, lon)
+
+
+class StubGeocoder:
+    """Ответы из словаря {адрес: [lat, lon]} (ключи нормализуются). Без сети."""
+    name = "stub"
+
+    def __init__(self, answers: dict | None = None):
+        self.answers = {_norm_addr(k): tuple(v) for k, v in (answers or {}).items() if v}
+
+    @classmethod
+    def from_file(cls, path: str):
+        if not path or not os.path.exists(path):
+            return cls()
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    async def geocode(self, address: str):
+        return self.answers.get(_norm_addr(address))
+
+
+_provider = None
+
+
+def get_provider():
+    global _provider
+    if _provider is None:
+        name = os.getenv("GEOCODER_PROVIDER", "yandex").strip().lower()
+        if name == "stub":
+            _provider = StubGeocoder.from_file(os.getenv("GEOCODER_STUB_FILE", ""))
+        else:
+            _provider = YandexGeocoder()
+    return _provider
+
+
+def set_provider(provider) -> None:
+    """Подменить провайдера (тесты, другой геокодер): объект с .name и async .geocode(addr)."""
+    global _provider
+    _provider = provider
+
+
+class RateLimiter:
+    """Не чаще rate запросов в секунду на процесс (равномерно, без всплесков)."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            if self._next > now:
+                await asyncio.sleep(self._next - now)
+                now = self._next
+            self._next = now + self.interval
+
+
+async def _geocode_with_retries(provider, limiter, query: str):
+    """-> ("ok", (lat, lon)) | ("not_found", None) | ("failed", "ошибка")."""
+    for attempt in range(GEOCODE_RETRIES + 1):
+        await limiter.wait()
+        try:
+            coords = await provider.geocode(query)
+            return ("ok", coords) if coords else ("not_found", None)
+        except GeocodeTransientError as e:
+            if attempt >= GEOCODE_RETRIES:
+                return ("failed", str(e))
+            await asyncio.sleep(min(30.0, 0.5 * 2 ** attempt) * (1 + random.random()))
+        except Exception as e:
+            return ("failed", str(e))
+    return ("failed", "retries exhausted")
+
+
+def _location(street, city) -> str:
+    return ", ".join(p for p in ((street or "").strip(), (city or "").strip()) if p)
+
+
+async def cached_coords(session, address: str):
+    """Координаты из кэша без обращения к провайдеру (None, если адреса там нет)."""
+    norm = _norm_addr(address)
+    if not norm:
+        return None
+    r = await session.execute(
+        select(GeocodeCache.lat, GeocodeCache.lon).where(
+            GeocodeCache.addr_norm == norm, GeocodeCache.status == "ok"
+        )
+    )
+    row = r.first()
+    return (row.lat, row.lon) if row else None
+
+
+async def _load_cache(session, norms) -> dict:
+    out = {}
+    norms = list(norms)
+    for i in range(0, len(norms), 1000):
+        r = await session.execute(select(GeocodeCache).where(GeocodeCache.addr_norm.in_(norms[i:i + 1000])))
+        for row in r.scalars().all():
+            out[row.addr_norm] = row
+    return out
+
+
+async def _store_cache(session, rows) -> None:
+    if not rows:
+        return
+    stmt = pg_insert(GeocodeCache).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[GeocodeCache.addr_norm],
+        set_={
+            "query": stmt.excluded.query,
+            "status": stmt.excluded.status,
+            "lat": stmt.excluded.lat,
+            "lon": stmt.excluded.lon,
+            "provider": stmt.excluded.provider,
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+    await session.execute(stmt)
+
+
+def missing_coords_clause():
+    """WHERE для запроса clubs JOIN addresses: есть адрес, но нет координат у кружка или адреса.
+
+    Две половины — отдельные подзапросы, чтобы каждая шла по своему частичному
+    индексу (ix_clubs_missing_coords / ix_addresses_missing_coords), а не seq scan по OR.
+    """
+    club_ids = select(Club.id).where(or_(Club.lat.is_(None), Club.lon.is_(None)))
+    addr_club_ids = (
+        select(Club.id)
+        .join(Address, Club.address_id == Address.id)
+        .where(or_(Address.lat.is_(None), Address.lon.is_(None)))
+    )
+    has_location = or_(
+        func.coalesce(func.trim(Address.street), "") != "",
+        func.coalesce(func.trim(Address.city), "") != "",
+    )
+    return and_(or_(Club.id.in_(club_ids), Club.id.in_(addr_club_ids)), has_location)
+
+
+async def _missing_by_address(session, limit=None) -> dict:
+    """addr_norm -> {"query", "clubs": [club_id без координат], "addresses": {address_id}}."""
+    stmt = (
+        select(Club.id, Club.address_id, Club.lat, Club.lon, Address.street, Address.city)
+        .join(Address, Club.address_id == Address.id)
+        .where(missing_coords_clause())
+        .order_by(Club.id)
+    )
+    if limit:
+        stmt = stmt.limit(limit)
+    r = await session.execute(stmt)
+    groups = {}
+    for row in r.all():
+        loc = _location(row.street, row.city)
+        norm = _norm_addr(loc)
+        if not norm:
+            continue
+        g = groups.setdefault(norm, {"query": loc, "clubs": [], "addresses": set()})
+        # у кружка свои координаты (например, поставлены вручную) — дополняем только адрес
+        if row.lat is None or row.lon is None:
+            g["clubs"].append(row.id)
+        g["addresses"].add(row.address_id)
+    return groups
+
+
+async def _apply_coords(session, groups, resolved: dict) -> int:
+    """Одним executemany-UPDATE на таблицу: clubs и addresses по первичному ключу.
+
+    Кружку координаты ставятся, только если их всё ещё нет: ручные не перезаписываем,
+    даже если их успели поставить, пока шёл геокодинг. Возвращает число обновлённых кружков.
+    """
+    now = datetime.datetime.utcnow()
+    club_rows, addr_rows = [], []
+    for norm, (lat, lon) in resolved.items():
+        g = groups[norm]
+        club_rows.extend({"cid": cid, "lat": lat, "lon": lon} for cid in g["clubs"])
+        addr_rows.extend({"id": aid, "lat": lat, "lon": lon} for aid in g["addresses"])
+    updated = 0
+    if club_rows:
+        clubs = Club.__table__
+        r = await session.execute(
+            update(clubs)
+            .where(clubs.c.id == bindparam("cid"), or_(clubs.c.lat.is_(None), clubs.c.lon.is_(None)))
+            .values(lat=bindparam("lat"), lon=bindparam("lon"), updated_at=now),
+            club_rows,
+        )
+        updated = r.rowcount if r.rowcount is not None and r.rowcount >= 0 else len(club_rows)
+    if addr_rows:
+        await session.execute(update(Address), addr_rows)
+    return updated
+
+
+async def geocode_missing(session_factory, limit=None, provider=None, progress=None) -> dict:
+    """Проставляет координаты всем кружкам без них. Возвращает отчёт."""
+    provider = provider or get_provider()
+    limiter = RateLimiter(GEOCODE_RATE)
+    sem = asyncio.Semaphore(max(1, GEOCODE_CONCURRENCY))
+    report = {
+        "addresses": 0, "cache_hits": 0, "geocoded": 0, "not_found": 0,
+        "failed": 0, "updated_clubs": 0, "errors": [], "provider": getattr(provider, "name", "?"),
+    }
+
+    async with session_factory() as session:
+        groups = await _missing_by_address(session, limit)
+    report["addresses"] = len(groups)
+    norms = list(groups)
+    negative_since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=GEOCODE_NEGATIVE_TTL_DAYS)
+
+    async def one(norm):
+        async with sem:
+            return norm, await _geocode_with_retries(provider, limiter, groups[norm]["query"])
+
+    for i in range(0, len(norms), GEOCODE_BATCH):
+        chunk = norms[i:i + GEOCODE_BATCH]
+        async with session_factory() as session:
+            cache = await _load_cache(session, chunk)
+            resolved, to_fetch = {}, []
+            for norm in chunk:
+                hit = cache.get(norm)
+                if hit is not None and hit.status == "ok" and hit.lat is not None and hit.lon is not None:
+                    resolved[norm] = (hit.lat, hit.lon)
+                    report["cache_hits"] += 1
+                elif hit is not None and hit.status == "not_found" and hit.updated_at and hit.updated_at > negative_since:
+                    report["not_found"] += 1
+                else:
+                    to_fetch.append(norm)
+
+            now = datetime.datetime.utcnow()
+            cache_rows = []
+            for norm, (status, value) in await asyncio.gather(*(one(n) for n in to_fetch)):
+                if status == "failed":
+                    report["failed"] += 1
+                    if len(report["errors"]) < 100:
+                        report["errors"].append({"address": groups[norm]["query"], "error": value})
+                    continue
+                lat, lon = value if status == "ok" else (None, None)
+                cache_rows.append({
+                    "addr_norm": norm, "query": groups[norm]["query"], "status": status,
+                    "lat": lat, "lon": lon, "provider": report["provider"],
+                    "created_at": now, "updated_at": now,
+                })
+                if status == "ok":
+                    resolved[norm] = (lat, lon)
+                    report["geocoded"] += 1
+                else:
+                    report["not_found"] += 1
+
+            await _store_cache(session, cache_rows)
+            updated = await _apply_coords(session, groups, resolved)
+            report["updated_clubs"] += updated
+            if updated:
+                await notify.publish(session, "club")
+                await catalog_snapshot.enqueue_rebuild(session)
+            await session.commit()
+            if updated:
+                catalog.invalidate()
+        if progress:
+            progress(min(i + GEOCODE_BATCH, len(norms)), len(norms))
+
+    return report
+
+
+# ---- фоновая задача в процессе API (одна за раз) ----
+
+_job = {"state": "idle"}
+_job_task = None
+
+
+def job_status() -> dict:
+    return dict(_job)
+
+
+def start_missing_job(session_factory, limit=None) -> bool:
+    """False, если задача уже идёт."""
+    global _job_task
+    if _job.get("state") == "running":
+        return False
+
+    def _progress(done, total):
+        _job["progress"] = {"done": done, "total": total}
+
+    async def _run():
+        try:
+            _job["report"] = await geocode_missing(session_factory, limit=limit, progress=_progress)
+            _job["state"] = "finished"
+        except Exception as e:
+            print("[WARN] geocode job failed:", e)
+            _job["state"] = "failed"
+            _job["error"] = str(e)
+        finally:
+            _job["finished_at"] = datetime.datetime.utcnow().isoformat()
+
+    _job.clear()
+    _job.update({"state": "running", "started_at": datetime.datetime.utcnow().isoformat(), "limit": limit})
+    _job_task = asyncio.get_running_loop().create_task(_run())
+    return True
@@ -0,0 +1,158 @@
+# images.py
+# Генерация производных картинок (превью карточки, детальная, WebP/AVIF по ширинам).
+#
+# Оригиналы с телефона весят мегабайты, а карточке на главной нужно ~400px.
+# Производные считаются в отдельном пуле процессов (Pillow держит GIL на ресайзе),
+# поэтому загрузка в api_upload_image не ждёт их генерации.
+import os
+import json
+import time
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+
+import lazy
+
+# Pillow импортирует только дочерний процесс пула (generate_derivatives); API-воркеру
+# достаточно знать, установлен ли он. Без Pillow отдаём только оригиналы.
+HAVE_PILLOW = lazy.available("PIL")
+
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+
+# превью карточки на главной / детальная картинка на странице кружка
+THUMB_WIDTH = 400
+DETAIL_WIDTH = 1200
+# ширины для srcset
+SRCSET_WIDTHS = (320, 640, 960, 1280)
+
+VARIANTS_SUFFIX = ".variants.json"
+# сколько секунд помнить, что манифеста нет (не открывать файл на каждую карточку)
+VARIANTS_MISS_TTL = float(os.getenv("VARIANTS_MISS_TTL", "30"))
+
+_pool = None
+# url оригинала -> карта вариантов (заполняется по мере готовности манифестов)
+_variants_cache = {}
+# url оригинала -> monotonic-время, до которого считаем, что манифеста нет
+_variants_missing = {}
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=max(1, IMAGE_WORKERS))
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _resized(img, width, resample):
+    if img.width <= width:
+        return img.copy()
+    height = max(1, round(img.height * width / img.width))
+    return img.resize((width, height), resample)
+
+
+def generate_derivatives(src_path: str, media_dir: str, url_prefix: str = "/media") -> dict:
+    """Создаёт производные файлы рядом с оригиналом и пишет манифест.
+
+    Выполняется в дочернем процессе, поэтому принимает/возвращает только plain-данные.
+    Возвращает карту вариантов (тот же формат, что в манифесте).
+    """
+    PILImage = lazy.optional("PIL.Image")
+    if PILImage is None:
+        return {}
+    ImageOps = lazy.optional("PIL.ImageOps")
+    pil_features = lazy.optional("PIL.features")
+
+    stem = os.path.splitext(os.path.basename(src_path))[0]
+    out = {"thumb": None, "detail": None, "webp": {}, "avif": {}}
+
+    with PILImage.open(src_path) as raw:
+        # телефонные фото часто повернуты через EXIF
+        img = ImageOps.exif_transpose(raw)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+        rgb = img.convert("RGB") if img.mode != "RGB" else img
+
+        for key, width in (("thumb", THUMB_WIDTH), ("detail", DETAIL_WIDTH)):
+            fname = f"{stem}_{key}.jpg"
+            _resized(rgb, width, PILImage.LANCZOS).save(os.path.join(media_dir, fname), "JPEG", quality=82, optimize=True, progressive=True)
+            out[key] = f"{url_prefix}/{fname}"
+
+        has_avif = bool(pil_features and pil_features.check("avif"))
+        for width in SRCSET_WIDTHS:
+            # не раздуваем маленькие оригиналы
+            if width > img.width and width != SRCSET_WIDTHS[0]:
+                continue
+            resized = _resized(img, width, PILImage.LANCZOS)
+            fname = f"{stem}_w{width}.webp"
+            resized.save(os.path.join(media_dir, fname), "WEBP", quality=78, method=4)
+            out["webp"][str(resized.width)] = f"{url_prefix}/{fname}"
+            if has_avif:
+                fname = f"{stem}_w{width}.avif"
+                resized.save(os.path.join(media_dir, fname), "AVIF", quality=60)
+                out["avif"][str(resized.width)] = f"{url_prefix}/{fname}"
+
+    manifest = os.path.join(media_dir, stem + VARIANTS_SUFFIX)
+    tmp = manifest + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(out, f)
+    os.replace(tmp, manifest)
+    return out
+
+
+def enqueue_derivatives(src_path: str, media_dir: str, url: str):
+    """Ставит генерацию производных в пул процессов и не ждёт результата."""
+    if not HAVE_PILLOW:
+        return None
+
+    loop = asyncio.get_running_loop()
+    fut = loop.run_in_executor(_get_pool(), generate_derivatives, src_path, media_dir)
+
+    def _done(f):
+        try:
+            variants = f.result()
+            if variants:
+                _variants_cache[url] = variants
+                _variants_missing.pop(url, None)
+        except Exception as e:
+            print("[WARN] generate_derivatives failed:", src_path, e)
+
+    fut.add_done_callback(_done)
+    return fut
+
+
+def get_variants(url: str, media_dir: str, url_prefix: str = "/media"):
+    """Карта вариантов для картинки из /media (или None, если их ещё нет)."""
+    if not url or not url.startswith(url_prefix + "/"):
+        return None
+    cached = _variants_cache.get(url)
+    if cached is not None:
+        return cached
+    now = time.monotonic()
+    if _variants_missing.get(url, 0) > now:
+        return None
+
+    stem = os.path.splitext(os.path.basename(url))[0]
+    manifest = os.path.join(media_dir, stem + VARIANTS_SUFFIX)
+    try:
+        with open(manifest, "r", encoding="utf-8") as f:
+            variants = json.load(f)
+    except (OSError, ValueError):
+        # манифеста нет — производные ещё считаются (или картинка старая)
+        if VARIANTS_MISS_TTL > 0:
+            _variants_missing[url] = now + VARIANTS_MISS_TTL
+        return None
+    _variants_missing.pop(url, None)
+    _variants_cache[url] = variants
+    return variants
+
+
+def build_srcset(widths: dict, origin: str = "") -> str:
+    """{'320': '/media/x_w320.webp', ...} -> '<origin>/media/x_w320.webp 320w, ...'"""
+    items = sorted(((int(w), u) for w, u in (widths or {}).items()), key=lambda x: x[0])
+    return ", ".join(f"{origin}{u} {w}w" for w, u in items)
@@ -0,0 +1,299 @@
+# jobs.py
+# Очередь фоновых задач в Postgres (таблица jobs, выборка FOR UPDATE SKIP LOCKED).
+#
+# Запись в API ставит задачу той же транзакцией, что и сами данные (enqueue() до
+# commit), поэтому побочный эффект (статическая страница, производные картинок,
+# пререндер статьи) не теряется при падении процесса. Воркер — asyncio-цикл:
+# внутри процесса API (JOB_WORKER=inline, по умолчанию) или отдельно:
+#
+#   python jobs.py            # только воркер, без HTTP
+#
+# Повтор с экспоненциальной задержкой до max_attempts; "зависшие" running-задачи
+# (процесс умер посреди выполнения) возвращаются в очередь через JOB_LOCK_TIMEOUT.
+# dedup_key: пока в очереди есть queued-задача с тем же ключом, новая не создаётся.
+import os
+import sys
+import socket
+import asyncio
+import datetime
+
+from sqlalchemy import select, update, delete, func, text, and_, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import aliased
+
+from models import Job
+
+JOB_WORKER = os.getenv("JOB_WORKER", "inline").strip().lower()  # inline | off
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+JOB_BATCH = int(os.getenv("JOB_BATCH", "10"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_LOCK_TIMEOUT = int(os.getenv("JOB_LOCK_TIMEOUT", "300"))  # секунд
+JOB_KEEP_DONE_DAYS = int(os.getenv("JOB_KEEP_DONE_DAYS", "7"))
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# kind -> async handler(payload: dict)
+_handlers = {}
+
+_task = None
+_wakeup = None
+
+
+def register(kind: str, fn) -> None:
+    _handlers[kind] = fn
+
+
+def handler(kind: str):
+    def deco(fn):
+        register(kind, fn)
+        return fn
+    return deco
+
+
+async def enqueue(session, kind: str, payload: dict | None = None, dedup_key: str | None = None,
+                  delay: float = 0, max_attempts: int = JOB_MAX_ATTEMPTS) -> None:
+    """Ставит задачу в рамках транзакции session (коммитит вызывающий код)."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    stmt = pg_insert(Job).values(
+        kind=kind,
+        payload=payload or {},
+        dedup_key=dedup_key,
+        status="queued",
+        attempts=0,
+        max_attempts=max_attempts,
+        run_at=now + datetime.timedelta(seconds=delay),
+        created_at=now,
+        updated_at=now,
+    )
+    if dedup_key:
+        stmt = stmt.on_conflict_do_nothing(
+            index_elements=[Job.dedup_key],
+            index_where=text("status = 'queued' AND dedup_key IS NOT NULL"),
+        )
+    await session.execute(stmt)
+
+
+def wake() -> None:
+    """Разбудить воркер этого процесса (после commit, чтобы не ждать опроса)."""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+def _backoff(attempts: int) -> datetime.timedelta:
+    return datetime.timedelta(seconds=min(3600, 5 * 2 ** max(0, attempts - 1)))
+
+
+async def _claim(session, limit: int):
+    now = func.now()
+    picked = (
+        select(Job.id)
+        .where(Job.status == "queued", Job.run_at <= now)
+        .order_by(Job.run_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    r = await session.execute(
+        update(Job)
+        .where(Job.id.in_(picked))
+        .values(status="running", locked_at=now, locked_by=WORKER_ID, attempts=Job.attempts + 1, updated_at=now)
+        .returning(Job.id, Job.kind, Job.payload, Job.attempts, Job.max_attempts)
+    )
+    rows = r.all()
+    await session.commit()
+    return rows
+
+
+def _queued_duplicate():
+    """EXISTS: уже есть queued-задача с тем же dedup_key (тогда эту в очередь не возвращаем)."""
+    queued = aliased(Job)
+    return (
+        select(queued.id)
+        .where(queued.status == "queued", queued.dedup_key == Job.dedup_key, queued.id != Job.id)
+        .exists()
+    )
+
+
+def _newest_per_dedup(cond, *newest_first):
+    """id задач из cond: по одной (первой в порядке newest_first) на каждый dedup_key."""
+    return (
+        select(Job.id)
+        .where(cond, Job.dedup_key.is_not(None))
+        .distinct(Job.dedup_key)
+        .order_by(Job.dedup_key, *newest_first, Job.id.desc())
+    )
+
+
+async def _finish(session_factory, job_id, error: str | None, attempts: int, max_attempts: int):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    done = {"locked_at": None, "locked_by": None, "updated_at": now}
+    async with session_factory() as session:
+        if error is None:
+            stmt = update(Job).where(Job.id == job_id).values(status="done", last_error=None, **done)
+        elif attempts >= max_attempts:
+            stmt = update(Job).where(Job.id == job_id).values(status="failed", last_error=error, **done)
+        else:
+            # повтор, если за это время не поставили свежую задачу с тем же ключом
+            await session.execute(
+                update(Job).where(Job.id == job_id, _queued_duplicate())
+                .values(status="done", last_error="superseded: " + error, **done)
+            )
+            stmt = (
+                update(Job).where(Job.id == job_id, Job.status == "running")
+                .values(status="queued", last_error=error, run_at=now + _backoff(attempts), **done)
+            )
+        await session.execute(stmt)
+        await session.commit()
+
+
+async def _requeue_stale(session) -> None:
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=JOB_LOCK_TIMEOUT)
+    stale = and_(Job.status == "running", Job.locked_at < cutoff)
+    superseded = {"status": "done", "locked_at": None, "locked_by": None, "last_error": "superseded: lock timeout"}
+    await session.execute(update(Job).where(stale, _queued_duplicate()).values(**superseded))
+    # две running-задачи с одним ключом (новую поставили, пока шла старая): в очередь —
+    # только самую свежую, иначе второй UPDATE нарушит uq_jobs_queued_dedup
+    await session.execute(
+        update(Job)
+        .where(stale, Job.dedup_key.is_not(None), Job.id.not_in(_newest_per_dedup(stale, Job.created_at.desc())))
+        .values(**superseded)
+    )
+    await session.execute(
+        update(Job)
+        .where(stale)
+        .values(status="queued", locked_at=None, locked_by=None, last_error="lock timeout")
+    )
+    done_cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=JOB_KEEP_DONE_DAYS)
+    await session.execute(delete(Job).where(Job.status == "done", Job.updated_at < done_cutoff))
+    await session.commit()
+
+
+async def run_once(session_factory, limit: int = JOB_BATCH) -> int:
+    """Забрать и выполнить до limit задач. Возвращает число выполненных."""
+    async with session_factory() as session:
+        rows = await _claim(session, limit)
+    for row in rows:
+        fn = _handlers.get(row.kind)
+        error = None
+        if fn is None:
+            error = f"no handler for {row.kind}"
+        else:
+            try:
+                await fn(row.payload or {})
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                print(f"[WARN] job {row.kind} {row.id} failed (attempt {row.attempts}):", e)
+        await _finish(session_factory, row.id, error, row.attempts, row.max_attempts)
+    return len(rows)
+
+
+async def _loop(session_factory):
+    last_maintenance = 0.0
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            if loop.time() - last_maintenance > 60:
+                # и при ошибке: сбойное обслуживание не должно останавливать выполнение задач
+                last_maintenance = loop.time()
+                try:
+                    async with session_factory() as session:
+                        await _requeue_stale(session)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print("[WARN] job maintenance failed:", e)
+            if await run_once(session_factory):
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print("[WARN] job worker loop error:", e)
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=JOB_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+def start(session_factory) -> None:
+    global _task, _wakeup
+    if _task is None:
+        _wakeup = asyncio.Event()
+        _task = asyncio.get_running_loop().create_task(_loop(session_factory))
+
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+
+
+async def stats(session) -> dict:
+    r = await session.execute(select(Job.kind, Job.status, func.count()).group_by(Job.kind, Job.status))
+    out = {}
+    for kind, status, n in r.all():
+        out.setdefault(kind, {})[status] = n
+    return out
+
+
+async def recent_failures(session, limit: int = 20) -> list:
+    r = await session.execute(
+        select(Job.id, Job.kind, Job.payload, Job.attempts, Job.last_error, Job.updated_at)
+        .where(Job.status == "failed")
+        .order_by(Job.updated_at.desc())
+        .limit(limit)
+    )
+    return [
+        {
+            "id": str(x.id),
+            "kind": x.kind,
+            "payload": x.payload,
+            "attempts": x.attempts,
+            "error": x.last_error,
+            "updated_at": x.updated_at.isoformat() if x.updated_at else None,
+        }
+        for x in r.all()
+    ]
+
+
+async def retry_failed(session, kind: str | None = None) -> int:
+    """Вернуть failed-задачи в очередь. Из нескольких failed с одним dedup_key — только
+    последнюю (uq_jobs_queued_dedup), остальные остаются failed."""
+    failed = and_(Job.status == "failed", ~_queued_duplicate())
+    if kind:
+        failed = and_(failed, Job.kind == kind)
+    stmt = (
+        update(Job)
+        .where(failed, or_(Job.dedup_key.is_(None), Job.id.in_(_newest_per_dedup(failed, Job.updated_at.desc()))))
+        .values(status="queued", attempts=0, run_at=func.now(), updated_at=func.now())
+    )
+    r = await session.execute(stmt)
+    await session.commit()
+    return r.rowcount or 0
+
+
+async def _main():
+    # обработчики регистрируются в main.py — импортируем его ради register()
+    import main
+    from db import AsyncSessionLocal
+
+    main.ensure_dirs()
+
+    print(f"[INFO] job worker {WORKER_ID} started")
+    start(AsyncSessionLocal)
+    try:
+        await _task
+    finally:
+        await stop()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(_main())
+    except KeyboardInterrupt:
+        sys.exit(0)
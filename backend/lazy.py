@@ -0,0 +1,37 @@
+# lazy.py
+# Необязательные тяжёлые зависимости (NumPy, Pillow, openpyxl, pyarrow) — при первом
+# использовании, а не при импорте main.
+#
+# Раньше каждый модуль делал `try: import X except ImportError: X = None` на верхнем
+# уровне, и холодный старт воркера платил за все пакеты сразу, даже если этот
+# воркер ни разу не импортирует xlsx и не ресайзит картинки. Профиль импорта и
+# бюджет холодного старта — coldstart.py.
+import importlib
+import importlib.util
+
+# имя модуля -> модуль или None (пакет не установлен)
+_modules = {}
+
+
+def optional(name: str):
+    """Модуль name или None, если пакет не установлен; импорт — при первом вызове."""
+    try:
+        return _modules[name]
+    except KeyError:
+        pass
+    try:
+        mod = importlib.import_module(name)
+    except ImportError:
+        mod = None
+    _modules[name] = mod
+    return mod
+
+
+def available(name: str) -> bool:
+    """Установлен ли пакет — без его импорта (только поиск по sys.path)."""
+    if name in _modules:
+        return _modules[name] is not None
+    try:
+        return importlib.util.find_spec(name.partition(".")[0]) is not None
+    except (ImportError, ValueError):
+        return False
@@ -4,23 +4,36 @@ import uuid
 import datetime
 import asyncio
 import json
+import csv
+import base64
 import urllib.parse
-import urllib.request
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Request
+from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Depends, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, Response, PlainTextResponse
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, Response, PlainTextResponse, RedirectResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from xml.sax.saxutils import escape as xml_escape
-
-import aiofiles
-from sqlalchemy.exc import NoResultFound, IntegrityError
-from sqlalchemy.orm import selectinload
-from sqlalchemy import select, delete, or_, desc
-from datetime import time as dt_time
-
-from models import Club, Address, Schedule, BlogPost
-from db import AsyncSessionLocal
+from email.utils import format_datetime, parsedate_to_datetime
+
+from sqlalchemy.exc import NoResultFound, IntegrityError, DBAPIError
+from sqlalchemy.orm import selectinload, load_only
+from sqlalchemy import select, delete, or_, desc, func, cast, tuple_, case, Text
+from sqlalchemy.dialects.postgresql import array as pg_array, ARRAY as PG_ARRAY
+
+from models import Club, Address, Schedule, BlogPost, ClubTombstone
+from club_fields import (
+    _to_float,
+    _to_int,
+    _jsonable,
+    _normalize_club_pricing,
+    _split_location,
+    _parse_schedule_item,
+    _club_values_from_payload,
+    _club_patch_values,
+    _schedule_key,
+)
+from slugs import _slugify_basic, allocate_slug, record_slug_change, forget_slugs, slug_lookup_clause, live_first
+from db import engine, AsyncSessionLocal
 from crud import create_review_for_club
 from schemas import (
     ReviewSchema,
@@ -30,39 +43,43 @@ from schemas import (
     BlogPostUpdateSchema,
 )
 from auth import router as auth_router, admin_required
+from club_import import detect_format, iter_rows, import_clubs
+import club_export
+from distance import parse_near, distance_sql, SORTS as DISTANCE_SORTS
+from schedule_search import slot_conditions, slot_predicate, clubs_with_slots, matching_slots, _slot_out
+import geocode
+import jobs
+import notify
+import catalog_snapshot
+from catalog_snapshot import NAME_ORDER
+import catalog
+import ratings
+import reviews
+import review_intake
+import migrations
+from ratings import rating_out
+from geocode import _norm_addr, cached_coords
+from images import enqueue_derivatives, get_variants, build_srcset, shutdown_pool as shutdown_image_pool
+import related
+import blog_feed
+from blog_render import apply_render, needs_render, render_revision
+from blog_search import search_vector_expr, search_query, rank_expr, snippet_expr
+from media import ImmutableStaticFiles, content_fingerprint, remember_hash, versioned_url, html_file_response
 
 from fastapi.exception_handlers import RequestValidationError
 from fastapi.exceptions import HTTPException as FastAPIHTTPException
 from starlette.middleware.base import BaseHTTPMiddleware
 
-app = FastAPI(title="Mapka API")
-app.include_router(auth_router)
+# эндпоинты main.py; приложение собирает create_app() (внизу файла)
+router = APIRouter()
 
 # ==========================
-# Yandex Geocoder
+# Geocoder
 # ==========================
-# ВАЖНО: у тебя ключ настроен с whitelist домена.
-# Это почти всегда означает, что СЕРВЕРНЫЕ запросы к геокодеру будут получать 403,
-# потому что у них нет Referer, который проверяет Яндекс.
-# Поэтому геокодинг делаем на фронте (в админке) через JS API (ymaps.geocode),
-# а бэкенд только ПРИНИМАЕТ lat/lon и пишет их в БД.
-#
-# Ключ оставил тут только для совместимости/будущего (и чтобы не ломать импорт),
-# но по умолчанию в create/update геокодер НЕ вызывается.
-YANDEX_MAPS_API_KEY = "58c38b72-57f7-4946-bc13-a256d341281a"
-
-
-def _to_float(v):
-    try:
-        if v is None:
-            return None
-        if isinstance(v, str):
-            v = v.strip().replace(",", ".")
-            if v == "":
-                return None
-        return float(v)
-    except Exception:
-        return None
+# Ключ Яндекса whitelisted по домену, серверные запросы получают 403, поэтому
+# в create/update геокодер НЕ вызывается: координаты приходят из админки
+# (ymaps.geocode в браузере), а бэкенд берёт их из payload или из geocode_cache.
+# Пачечный серверный геокодинг (нужен ключ без referer-ограничений) — geocode.py.
 
 
 def _is_uuid(v: str) -> bool:
@@ -73,73 +90,6 @@ def _is_uuid(v: str) -> bool:
         return False
 
 
-def _to_int(v):
-    try:
-        if v is None:
-            return None
-        if isinstance(v, str):
-            vv = v.strip().replace(',', '.')
-            if vv == '' or vv.lower() in ('null', 'undefined'):
-                return None
-            v = vv
-        return int(float(v))
-    except Exception:
-        return None
-
-
-def _norm_addr(addr: str) -> str:
-    return " ".join(str(addr or "").strip().lower().split())
-
-
-async def _geocode_yandex_server_side(address: str):
-    """Серверный геокодер (по умолчанию НЕ используется).
-
-    Если очень захочешь вернуть серверный геокодинг —
-    добавь корректный ключ без referer-ограничений или используй IP allowlist.
-    """
-    addr = (address or "").strip()
-    if not addr:
-        return None
-
-    params = {
-        "format": "json",
-        "apikey": YANDEX_MAPS_API_KEY,
-        "geocode": addr,
-        "results": "1",
-    }
-    url = "https://geocode-maps.yandex.ru/1.x/?" + urllib.parse.urlencode(params)
-
-    def _fetch():
-        req = urllib.request.Request(url, headers={"User-Agent": "mapka-backend/1.0"})
-        with urllib.request.urlopen(req, timeout=8) as resp:
-            return resp.read().decode("utf-8", errors="ignore")
-
-    try:
-        raw = await asyncio.to_thread(_fetch)
-        data = json.loads(raw)
-        pos = (
-            data.get("response", {})
-            .get("GeoObjectCollection", {})
-            .get("featureMember", [{}])[0]
-            .get("GeoObject", {})
-            .get("Point", {})
-            .get("pos")
-        )
-        if not pos:
-            return None
-
-        # pos: "lon lat"
-        lon_s, lat_s = pos.split()[:2]
-        lat = _to_float(lat_s)
-        lon = _to_float(lon_s)
-        if lat is None or lon is None:
-            return None
-        return (lat, lon)
-    except Exception as e:
-        print("[WARN] _geocode_yandex_server_side failed:", e)
-        return None
-
-
 # Middleware для добавления CORS-заголовков даже к ошибкам
 class CORSMiddlewareAll(BaseHTTPMiddleware):
     async def dispatch(self, request, call_next):
@@ -160,29 +110,98 @@ class CORSMiddlewareAll(BaseHTTPMiddleware):
         return response
 
 
-app.add_middleware(CORSMiddlewareAll)
+MEDIA_DIR = os.getenv("MEDIA_DIR", "media")
+STATIC_CLUBS_DIR = os.getenv("STATIC_CLUBS_DIR", "static_clubs")
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
 
-MEDIA_DIR = os.getenv("MEDIA_DIR", "media")
-os.makedirs(MEDIA_DIR, exist_ok=True)
-app.mount("/media", StaticFiles(directory=MEDIA_DIR), name="media")
+def ensure_dirs():
+    """Каталоги для загрузок и статических страниц — из create_app() и воркера jobs.py."""
+    os.makedirs(MEDIA_DIR, exist_ok=True)
+    os.makedirs(STATIC_CLUBS_DIR, exist_ok=True)
 
-STATIC_CLUBS_DIR = os.getenv("STATIC_CLUBS_DIR", "static_clubs")
-os.makedirs(STATIC_CLUBS_DIR, exist_ok=True)
+# за доверенным прокси (nginx) IP клиента — первый адрес X-Forwarded-For
+REVIEW_TRUST_FORWARDED = os.getenv("REVIEW_TRUST_FORWARDED", "0") == "1"
+
+
+# ---- инвалидация локальных кэшей по NOTIFY из других воркеров (notify.py) ----
+
+def _on_club_change(club_id, version):
+    catalog.invalidate()
+    reviews.invalidate(club_id)
+    if club_id:
+        related.schedule_club_refresh(uuid.UUID(club_id))
+    else:
+        related.schedule_rebuild()
+
+
+def _on_rating_change(club_id, version):
+    # новый отзыв: карточка в каталоге и первая страница отзывов, без пересчёта "по теме"
+    catalog.reload_ratings([club_id] if club_id else None)
+    reviews.invalidate(club_id)
+
+
+def _on_blog_change(post_id, version):
+    if post_id:
+        related.schedule_post_refresh(uuid.UUID(post_id))
+    else:
+        related.schedule_rebuild()
+    blog_feed.invalidate()
+
+
+def _flush_local_caches():
+    related.schedule_rebuild()
+    blog_feed.invalidate()
+    # NOTIFY "rating" могли потерять, а по updated_at рейтинг не догнать
+    catalog.reload_ratings()
+
+
+notify.subscribe("club", _on_club_change)
+notify.subscribe("rating", _on_rating_change)
+notify.subscribe("blog", _on_blog_change)
+notify.subscribe("catalog", lambda _id, version: (catalog_snapshot.recheck(), catalog.wake()))
+notify.on_flush(_flush_local_caches)
+
+
+async def _startup():
+    # индекс "Читайте также" строится при первом обращении к статье (related.get)
+    notify.start()
+    if jobs.JOB_WORKER == "inline":
+        jobs.start(AsyncSessionLocal)
+    catalog.start(AsyncSessionLocal, _serialize_club)
+    review_intake.start(AsyncSessionLocal, _reviews_flushed)
+    try:
+        async with AsyncSessionLocal() as session:
+            if catalog_snapshot.CATALOG_SNAPSHOT and catalog_snapshot.current() is None:
+                # первого снимка ещё нет — его соберёт очередь (одна задача на все воркеры)
+                await catalog_snapshot.enqueue_rebuild(session)
+            # периодическая сверка рейтингов; уже стоит в очереди — dedup_key
+            await ratings.schedule_reconcile(session, delay=60)
+            await session.commit()
+        jobs.wake()
+    except Exception as e:
+        print("[WARN] startup jobs enqueue failed:", e)
+    try:
+        # только предупреждение: индексы строит `python migrations.py` / create_tables.py
+        await migrations.startup_check(engine)
+    except Exception as e:
+        print("[WARN] schema index check failed:", e)
+
+
+async def _shutdown():
+    # дописать отзывы из очереди, пока БД и NOTIFY ещё доступны
+    await review_intake.stop()
+    await jobs.stop()
+    await notify.stop()
+    await catalog.stop()
+    shutdown_image_pool()
+    await related.stop()
 
 
 def _sitemap_base(request: Request) -> str:
     return (os.getenv("SITEMAP_BASE_URL") or str(request.base_url)).rstrip("/")
 
 
-@app.get("/robots.txt", include_in_schema=False)
+@router.get("/robots.txt", include_in_schema=False)
 async def robots_txt(request: Request):
     base = _sitemap_base(request)
     txt = "\n".join([
@@ -199,7 +218,7 @@ async def robots_txt(request: Request):
     return PlainTextResponse(txt, headers={"Cache-Control": "no-store, max-age=0"})
 
 
-@app.get("/sitemap.xml", include_in_schema=False)
+@router.get("/sitemap.xml", include_in_schema=False)
 async def sitemap_xml(request: Request):
     base = _sitemap_base(request)
 
@@ -268,6 +287,41 @@ async def sitemap_xml(request: Request):
     )
 
 
+def _feed_response(request: Request, feed: dict, media_type: str):
+    headers = {
+        "ETag": feed["etag"],
+        "Last-Modified": format_datetime(feed["last_modified"], usegmt=True),
+        "Cache-Control": "public, max-age=300",
+    }
+    inm = request.headers.get("if-none-match")
+    if inm:
+        if feed["etag"] in [t.strip() for t in inm.split(",")]:
+            return Response(status_code=304, headers=headers)
+    else:
+        ims = request.headers.get("if-modified-since")
+        if ims:
+            try:
+                if parsedate_to_datetime(ims) >= feed["last_modified"]:
+                    return Response(status_code=304, headers=headers)
+            except (TypeError, ValueError):
+                pass
+    return Response(content=feed["body"], media_type=media_type, headers=headers)
+
+
+@router.get("/blog/feed.xml", include_in_schema=False)
+async def blog_feed_rss(request: Request):
+    async with AsyncSessionLocal() as session:
+        feed = await blog_feed.get_feed(session, "rss", _sitemap_base(request))
+    return _feed_response(request, feed, "application/rss+xml; charset=utf-8")
+
+
+@router.get("/blog/feed.json", include_in_schema=False)
+async def blog_feed_json(request: Request):
+    async with AsyncSessionLocal() as session:
+        feed = await blog_feed.get_feed(session, "json", _sitemap_base(request))
+    return _feed_response(request, feed, "application/feed+json; charset=utf-8")
+
+
 def _serialize_club(c, base_origin: str, payload_extra: dict = None):
     """Надёжная сериализация ORM -> plain dict для фронта."""
     try:
@@ -281,7 +335,23 @@ def _serialize_club(c, base_origin: str, payload_extra: dict = None):
                 image_path = getattr(first, "url", "") or ""
         image_url = ""
         if image_path:
-            image_url = base_origin.rstrip("/") + image_path if image_path.startswith("/") else image_path
+            # старые uuid-имена получают ?v=<hash>, чтобы /media отдавал их с immutable-кешем
+            versioned = versioned_url(image_path, MEDIA_DIR)
+            image_url = base_origin.rstrip("/") + versioned if versioned.startswith("/") else versioned
+
+        # производные (thumb/detail/webp) — только для загруженных в /media картинок
+        image_variants = None
+        image_srcset = ""
+        variants = get_variants(image_path, MEDIA_DIR) if image_path else None
+        if variants:
+            origin = base_origin.rstrip("/")
+            image_variants = {
+                "thumb": origin + variants["thumb"] if variants.get("thumb") else None,
+                "detail": origin + variants["detail"] if variants.get("detail") else None,
+                "webp": {w: origin + u for w, u in (variants.get("webp") or {}).items()},
+                "avif": {w: origin + u for w, u in (variants.get("avif") or {}).items()},
+            }
+            image_srcset = build_srcset(variants.get("webp"), origin)
 
         addr = getattr(c, "address", None)
         location = ""
@@ -359,6 +429,8 @@ def _serialize_club(c, base_origin: str, payload_extra: dict = None):
             "description": getattr(c, "description", "") or "",
             "meta_description": getattr(c, "meta_description", None),
             "image": image_url or "",
+            "imageVariants": image_variants,
+            "imageSrcset": image_srcset,
             "location": location,
             "lat": lat,
             "lon": lon,
@@ -375,6 +447,7 @@ def _serialize_club(c, base_origin: str, payload_extra: dict = None):
             "webSite": getattr(c, "webSite", "") or "",
             "socialLinks": social_links,
             "schedules": schedules_out,
+            **rating_out(c),
         }
         if payload_extra:
             out.update(payload_extra)
@@ -389,38 +462,14 @@ def _serialize_club(c, base_origin: str, payload_extra: dict = None):
         }
 
 
-def _slugify_basic(text: str) -> str:
-    """Очень простой slugify на случай, если фронт не прислал slug."""
-    s = (text or "").strip().lower()
-    out = []
-    prev_dash = False
-    for ch in s:
-        if ch.isalnum():
-            out.append(ch)
-            prev_dash = False
-        else:
-            if not prev_dash:
-                out.append("-")
-                prev_dash = True
-    slug = "".join(out).strip("-")
-    slug = "-".join([p for p in slug.split("-") if p])
-    return (slug or "post")[:80]
+async def _ensure_unique_blog_slug(session, desired_slug: str, exclude_id=None) -> str:
+    return await allocate_slug(session, "blog", _slugify_basic(desired_slug), exclude_id=exclude_id)
 
 
-async def _ensure_unique_blog_slug(session, desired_slug: str, exclude_id=None) -> str:
-    base = _slugify_basic(desired_slug)
-    slug = base
-    for i in range(1, 51):
-        q = select(BlogPost.id).where(BlogPost.slug == slug)
-        if exclude_id is not None:
-            q = q.where(BlogPost.id != exclude_id)
-        r = await session.execute(q)
-        exists = r.scalar_one_or_none()
-        if not exists:
-            return slug
-        slug = f"{base}-{i+1}"
-    # fallback
-    return f"{base}-{uuid.uuid4().hex[:6]}"
+def _slug_redirect(request: Request, prefix: str, slug: str):
+    """301 со старого slug на актуальный (query-строку сохраняем)."""
+    url = request.url.replace(path=f"{prefix}/{urllib.parse.quote(slug)}")
+    return RedirectResponse(str(url), status_code=301)
 
 
 def _serialize_blog_post(p: BlogPost):
@@ -445,43 +494,20 @@ def _serialize_blog_post(p: BlogPost):
     }
 
 
+def _serialize_blog_post_public(p: BlogPost):
+    """Публичная статья: + готовый HTML, оглавление, время чтения, FAQPage JSON-LD и похожие."""
+    out = _serialize_blog_post(p)
+    out.update({
+        "html": getattr(p, "rendered_html", None) or "",
+        "toc": getattr(p, "rendered_toc", None) or [],
+        "reading_time": getattr(p, "reading_time_min", None),
+        "faq_jsonld": getattr(p, "faq_jsonld", None),
+        # "Читайте также" / "Кружки по теме" из фонового индекса (related.py)
+        "related": related.get(getattr(p, "slug", "")),
+    })
+    return out
 
 
-def _jsonable(obj):
-    """Convert Pydantic models (and nested structures) into plain JSON-serializable objects."""
-    if obj is None:
-        return None
-
-    # pydantic v2
-    md = getattr(obj, "model_dump", None)
-    if callable(md):
-        try:
-            return _jsonable(md())
-        except Exception:
-            pass
-
-    # pydantic v1
-    dct = getattr(obj, "dict", None)
-    if callable(dct):
-        try:
-            return _jsonable(dct())
-        except Exception:
-            pass
-
-    if isinstance(obj, (str, int, float, bool)):
-        return obj
-
-    if isinstance(obj, (list, tuple)):
-        return [_jsonable(x) for x in obj]
-
-    if isinstance(obj, dict):
-        return {k: _jsonable(v) for k, v in obj.items()}
-
-    # last resort
-    try:
-        return str(obj)
-    except Exception:
-        return None
 
 
 def _normalize_blog_faq(faq):
@@ -514,86 +540,6 @@ def _normalize_blog_faq(faq):
     return out
 
 
-def _normalize_club_pricing(pricing):
-    """Normalize pricing payload for JSONB: list of cards.
-
-    Accepts list of dicts (or Pydantic models). Filters out fully empty cards.
-    """
-    if pricing is None:
-        return None
-
-    out = []
-    for item in (pricing or []):
-        if item is None:
-            continue
-        d = _jsonable(item)
-        if not isinstance(d, dict):
-            continue
-
-        title = str(d.get('title') or '').strip()
-        # UI (админка) может присылать short description как subtitle ИЛИ desc
-        subtitle = str(d.get('subtitle') or d.get('desc') or d.get('description') or '').strip()
-        badge = str(d.get('badge') or '').strip()
-        unit = str(d.get('unit') or '').strip()
-        cta_text = str(d.get('cta_text') or d.get('ctaText') or '').strip()
-        # UI может прислать group или kind/type (single/subscription/...)
-        group = str(d.get('group') or d.get('kind') or d.get('type') or '').strip()
-
-        price_text = d.get('price_text')
-        if price_text is None:
-            price_text = d.get('priceText')
-        price_text = str(price_text).strip() if isinstance(price_text, str) else (str(price_text).strip() if price_text is not None else '')
-
-        price_rub = d.get('price_rub')
-        if price_rub is None:
-            price_rub = d.get('priceRub')
-        if price_rub is not None and str(price_rub).strip() != '':
-            try:
-                price_rub = float(str(price_rub).replace(',', '.'))
-            except Exception:
-                price_rub = None
-        else:
-            price_rub = None
-
-        details_list = []
-        details_text = d.get('detailsText')
-        if details_text is None:
-            details_text = d.get('details_text')
-        # старый формат админки: details как строка
-        if details_text is None and isinstance(d.get('details'), str):
-            details_text = d.get('details')
-        if isinstance(details_text, str) and details_text.strip():
-            for line in details_text.splitlines():
-                s = line.strip()
-                if s:
-                    details_list.append(s)
-        raw_details = d.get('details')
-        if isinstance(raw_details, list):
-            for x in raw_details:
-                s = str(x).strip()
-                if s and s not in details_list:
-                    details_list.append(s)
-
-        if not any([title, subtitle, badge, unit, price_text, price_rub, details_list]):
-            continue
-
-        out.append({
-            'id': str(d.get('id') or '').strip() or None,
-            'group': group or None,
-            'title': title or None,
-            'subtitle': subtitle or None,
-            'badge': badge or None,
-            'unit': unit or None,
-            'price_rub': price_rub,
-            'price_text': price_text or None,
-            'cta_text': cta_text or None,
-            'details': details_list,
-            'detailsText': details_text if isinstance(details_text, str) else None,
-        })
-
-    # allow clearing by sending []
-    return out
-
 def _render_club_html_simple(obj):
     title = obj.get("name", "Кружок")
     desc = obj.get("description", "")
@@ -625,6 +571,7 @@ def write_static_club_file(slug, payload):
     try:
         with open(fname, "w", encoding="utf-8") as f:
             f.write(html)
+        remember_hash(fname, html.encode("utf-8"))
         return fname
     except Exception as e:
         print("[WARN] write_static_club_file failed:", e)
@@ -643,16 +590,7 @@ def remove_static_club_file(slug):
         pass
 
 
-def _split_location(loc_str: str):
-    if not loc_str:
-        return None, None
-    parts = [p.strip() for p in loc_str.split(",", 1)]
-    if len(parts) == 2 and parts[1]:
-        return parts[0], parts[1]
-    return loc_str.strip(), None
-
-
-@app.post("/api/clubs")
+@router.post("/api/clubs")
 async def api_create_club(request: Request, payload: dict, user=Depends(admin_required)):
     name = payload.get("name")
     if not name:
@@ -669,127 +607,36 @@ async def api_create_club(request: Request, payload: dict, user=Depends(admin_re
                 await session.flush()
 
         # coords: ТОЛЬКО из payload (геокодинг делается в админке на клиенте)
-        lat = _to_float(payload.get("lat"))
-        lon = _to_float(payload.get("lon"))
+        values = _club_values_from_payload(payload)
+        if loc and (values["lat"] is None or values["lon"] is None):
+            cached = await cached_coords(session, loc)
+            if cached:
+                values["lat"], values["lon"] = cached
+        lat, lon = values["lat"], values["lon"]
         if addr_obj is not None and lat is not None and lon is not None:
             addr_obj.lat = lat
             addr_obj.lon = lon
 
-        # price
-        price_cents = None
-        if payload.get("price_rub") is not None:
-            try:
-                price_rub = float(payload.get("price_rub") or 0)
-                price_cents = int(round(price_rub * 100))
-            except Exception:
-                price_cents = None
-        elif payload.get("price_cents") is not None:
-            try:
-                price_cents = int(payload.get("price_cents"))
-            except Exception:
-                price_cents = None
-
-        phone = payload.get("phone") or ""
-        webSite = payload.get("webSite") or payload.get("website") or ""
-        social_links = payload.get("socialLinks") or payload.get("social_links") or {}
-        if not isinstance(social_links, dict):
-            social_links = {}
-        tags = payload.get("tags") or []
-        if not isinstance(tags, (list, tuple)):
-            tags = []
-        pricing_in = None
-        if "pricing" in payload:
-            pricing_in = payload.get("pricing")
-        elif "pricingItems" in payload:
-            pricing_in = payload.get("pricingItems")
-        elif "pricing_items" in payload:
-            pricing_in = payload.get("pricing_items")
-        pricing_norm = _normalize_club_pricing(pricing_in) if pricing_in is not None else None
-
-
-        club = Club(
-            name=name,
-            slug=payload.get("slug") or str(uuid.uuid4())[:8],
-            description=payload.get("description") or "",
-            meta_description=((payload.get("meta_description") if "meta_description" in payload else None) or (payload.get("metaDescription") if "metaDescription" in payload else None) or None),
-            pricing=pricing_norm,
-            main_image_url=payload.get("image") or None,
-            price_cents=price_cents,
-            address_id=getattr(addr_obj, "id", None),
-            tags=list(tags),
-            category=(payload.get("category") or "").strip() or None,
-            min_age=_to_int(payload.get("minAge") or payload.get("min_age")),
-            max_age=_to_int(payload.get("maxAge") or payload.get("max_age")),
-            price_notes=(payload.get("priceNotes") or payload.get("price_notes") or "").strip() or None,
-            phone=phone,
-            webSite=webSite,
-            social_links=dict(social_links),
-            group_size=payload.get("group_size") or None,
-            teacher_id=payload.get("teacher_id") or None,
-            lat=lat,
-            lon=lon,
-        )
+        slug = await allocate_slug(session, "club", _slugify_basic(payload.get("slug") or name, fallback="club"))
+
+        club = Club(slug=slug, address_id=getattr(addr_obj, "id", None), **values)
         session.add(club)
         await session.flush()
 
         # schedules
-        schedules_payload = payload.get("schedules") or []
-        weekday_map = {
-            "понедельник": 0, "вторник": 1, "среда": 2,
-            "четверг": 3, "пятница": 4, "суббота": 5, "воскресенье": 6
-        }
-        for s in schedules_payload:
-            if not isinstance(s, dict):
-                continue
-            raw_day = (s.get("day") or "").strip()
-            raw_time = (s.get("time") or "").strip()
-
-            if (not raw_time) and any(ch.isdigit() for ch in raw_day):
-                raw_time = raw_day
-                raw_day = ""
-
-            if not raw_day and not raw_time:
-                continue
-
-            weekday_val = None
-            if raw_day:
-                try:
-                    weekday_val = int(raw_day)
-                except Exception:
-                    weekday_val = weekday_map.get(raw_day.lower(), None)
-
-            start_time_obj = None
-            end_time_obj = None
-            note = None
-            if raw_time:
-                t = raw_time.replace("–", "-").replace("—", "-")
-                parts = [p.strip() for p in t.split("-", 1)]
-                if len(parts) == 2 and parts[0] and parts[1]:
-                    try:
-                        hh, mm = [int(x) for x in parts[0].split(":")]
-                        start_time_obj = dt_time(hh, mm)
-                    except Exception:
-                        start_time_obj = None
-                    try:
-                        hh, mm = [int(x) for x in parts[1].split(":")]
-                        end_time_obj = dt_time(hh, mm)
-                    except Exception:
-                        end_time_obj = None
-                    if start_time_obj is None and end_time_obj is None:
-                        note = raw_time
-                else:
-                    note = raw_time
-
-            if weekday_val is None and not start_time_obj and not end_time_obj and not note:
-                continue
+        for s in payload.get("schedules") or []:
+            item = _parse_schedule_item(s)
+            if item is not None:
+                session.add(Schedule(club_id=club.id, **item))
 
-            session.add(Schedule(
-                club_id=club.id,
-                weekday=weekday_val,
-                start_time=start_time_obj,
-                end_time=end_time_obj,
-                note=note
-            ))
+        base_origin = str(request.base_url).rstrip("/")
+        # статическая страница — фоновой задачей в той же транзакции
+        await jobs.enqueue(
+            session, "club.static", {"club_id": str(club.id), "base_origin": base_origin},
+            dedup_key=f"club.static:{club.id}",
+        )
+        await notify.publish(session, "club", club.id, club.updated_at)
+        await catalog_snapshot.enqueue_rebuild(session)
 
         try:
             await session.commit()
@@ -809,22 +656,35 @@ async def api_create_club(request: Request, payload: dict, user=Depends(admin_re
         )
         club_full = q2.scalar_one_or_none() or club
 
-        base_origin = str(request.base_url).rstrip("/")
         extra = {"tags": list(club_full.tags or []), "isFavorite": payload.get("isFavorite", False)}
         out = _serialize_club(club_full, base_origin, extra)
 
-        try:
-            write_static_club_file(out["slug"], out)
-        except Exception as e:
-            print("[WARN] write_static_club_file failed (create):", e)
-
+        jobs.wake()
+        catalog.invalidate()
+        related.schedule_club_refresh(club_full.id)
         return out
 
 
-@app.put("/api/clubs/{club_id}")
-async def api_update_club(club_id: str, request: Request, payload: dict, user=Depends(admin_required)):
-    from sqlalchemy.orm.attributes import flag_modified
+_CLUB_FULL_LOAD = (
+    selectinload(Club.address),
+    selectinload(Club.images),
+    selectinload(Club.schedules),
+    selectinload(Club.teacher),
+)
+
 
+def _static_club_file_exists(slug) -> bool:
+    safe = str(slug or "").replace("/", "_")
+    return bool(safe) and os.path.exists(os.path.join(STATIC_CLUBS_DIR, f"{safe}.html"))
+
+
+async def _update_club(club_id: str, request: Request, payload: dict, merge: bool):
+    """Общая часть PUT/PATCH: пишем только изменившиеся поля, расписание — диффом.
+
+    Кружок грузится один раз со всеми связями; ответ собирается из тех же
+    объектов без повторного SELECT. Если ничего не поменялось — без COMMIT
+    и без перезаписи статической страницы.
+    """
     async with AsyncSessionLocal() as session:
         where_clause = None
         try:
@@ -833,209 +693,117 @@ async def api_update_club(club_id: str, request: Request, payload: dict, user=De
         except Exception:
             where_clause = (Club.slug == club_id)
 
-        q = await session.execute(select(Club).where(where_clause))
+        q = await session.execute(select(Club).where(where_clause).options(*_CLUB_FULL_LOAD))
         club = q.scalar_one_or_none()
         if not club:
             print(f"[WARN] Update requested but club not found for club_id={club_id}")
             raise HTTPException(status_code=404, detail="Club not found")
 
-        print(f"[DEBUG] Update club {club_id} payload: {payload}")
-
-        if "name" in payload:
-            club.name = payload.get("name")
-        if "slug" in payload:
-            club.slug = payload.get("slug")
-        if "description" in payload:
-            club.description = payload.get("description")
-
-        if "meta_description" in payload or "metaDescription" in payload:
-            v = payload.get("meta_description") if "meta_description" in payload else payload.get("metaDescription")
-            club.meta_description = (str(v).strip() if v is not None else None) or None
-
-        if "image" in payload:
-            club.main_image_url = payload.get("image")
-
-        if "price_rub" in payload:
-            try:
-                price_rub = float(payload.get("price_rub") or 0)
-                club.price_cents = int(round(price_rub * 100))
-            except Exception:
-                club.price_cents = None
-        elif "price_cents" in payload:
-            try:
-                club.price_cents = int(payload.get("price_cents"))
-            except Exception:
-                club.price_cents = None
-
-        if "phone" in payload:
-            club.phone = payload.get("phone") or ""
-        if "webSite" in payload or "website" in payload:
-            club.webSite = payload.get("webSite") or payload.get("website") or ""
-
-        # ✅ new fields: category / age / price notes
-        if "category" in payload:
-            v = payload.get("category")
-            club.category = (str(v).strip() if v is not None else None) or None
-
-        if "minAge" in payload or "min_age" in payload:
-            club.min_age = _to_int(payload.get("minAge") if "minAge" in payload else payload.get("min_age"))
-
-        if "maxAge" in payload or "max_age" in payload:
-            club.max_age = _to_int(payload.get("maxAge") if "maxAge" in payload else payload.get("max_age"))
-
-        if "priceNotes" in payload or "price_notes" in payload:
-            v = payload.get("priceNotes") if "priceNotes" in payload else payload.get("price_notes")
-            club.price_notes = (str(v).strip() if v is not None else None) or None
-
-        if ("pricing" in payload) or ("pricingItems" in payload) or ("pricing_items" in payload):
-            pricing_in = payload.get("pricing")
-            if pricing_in is None and "pricingItems" in payload:
-                pricing_in = payload.get("pricingItems")
-            if pricing_in is None and "pricing_items" in payload:
-                pricing_in = payload.get("pricing_items")
-            club.pricing = _normalize_club_pricing(pricing_in)
-            try:
-                flag_modified(club, "pricing")
-            except Exception:
-                pass
-
-
-        if "tags" in payload:
-            tags = payload.get("tags") or []
-            if not isinstance(tags, (list, tuple)):
-                tags = []
-            club.tags = list(tags)
-            try:
-                flag_modified(club, "tags")
-            except Exception:
-                pass
-
-        if "socialLinks" in payload or "social_links" in payload:
-            social = payload.get("socialLinks") or payload.get("social_links") or {}
-            if not isinstance(social, dict):
-                social = {}
-            club.social_links = dict(social)
-            try:
-                flag_modified(club, "social_links")
-            except Exception:
-                pass
+        base_origin = str(request.base_url).rstrip("/")
+        before_html = _render_club_html_simple(_serialize_club(club, base_origin))
+        changed = set()
+
+        for col, value in _club_patch_values(payload, club.social_links, merge=merge).items():
+            if getattr(club, col) != value:
+                setattr(club, col, value)
+                changed.add(col)
+
+        old_slug = club.slug
+        if "slug" in payload and payload.get("slug") != club.slug:
+            desired = _slugify_basic(payload.get("slug") or club.name, fallback="club")
+            if desired != club.slug:
+                club.slug = await allocate_slug(session, "club", desired, exclude_id=club.id)
+                await record_slug_change(session, "club", club.id, old_slug, club.slug)
+                changed.add("slug")
 
         # address
+        addr = club.address
         old_loc_norm = ""
-        addr = None
-        if club.address_id:
-            addr_q = await session.execute(select(Address).where(Address.id == club.address_id))
-            addr = addr_q.scalar_one_or_none()
-            if addr:
-                old_loc_norm = _norm_addr(", ".join([x for x in [(addr.street or "").strip(), (addr.city or "").strip()] if x]))
+        if addr:
+            old_loc_norm = _norm_addr(", ".join([x for x in [(addr.street or "").strip(), (addr.city or "").strip()] if x]))
 
         loc = (payload.get("location") or "").strip() if "location" in payload else ""
         if "location" in payload:
             street_val, city_val = _split_location(loc)
-
-            if club.address_id and addr:
-                addr.street = street_val
-                addr.city = city_val
-                session.add(addr)
-                await session.flush()
+            if addr:
+                if (addr.street, addr.city) != (street_val, city_val):
+                    addr.street = street_val
+                    addr.city = city_val
+                    changed.add("location")
             elif street_val or city_val:
-                new_addr = Address(street=street_val, city=city_val)
-                session.add(new_addr)
-                await session.flush()
-                club.address_id = new_addr.id
-                addr = new_addr
+                addr = Address(street=street_val, city=city_val)
+                club.address = addr
+                changed.add("location")
 
         new_loc_norm = _norm_addr(loc) if loc else ""
         loc_changed = bool(loc) and (old_loc_norm != new_loc_norm)
 
         # coords:
         # 1) если пришли lat/lon — используем их
-        has_lat = "lat" in payload
-        has_lon = "lon" in payload
-        payload_lat = _to_float(payload.get("lat")) if has_lat else None
-        payload_lon = _to_float(payload.get("lon")) if has_lon else None
-
+        # 2) если адрес изменили, но координаты не прислали — сбрасываем,
+        #    чтобы не оставлять «старые» координаты на новый адрес.
+        payload_lat = _to_float(payload.get("lat")) if "lat" in payload else None
+        payload_lon = _to_float(payload.get("lon")) if "lon" in payload else None
+        new_coords = None
         if payload_lat is not None and payload_lon is not None:
-            club.lat = payload_lat
-            club.lon = payload_lon
-            if addr:
-                addr.lat = payload_lat
-                addr.lon = payload_lon
-        else:
-            # 2) если адрес изменили, но координаты не прислали — сбрасываем,
-            # чтобы не оставлять «старые» координаты на новый адрес.
-            if loc_changed:
-                club.lat = None
-                club.lon = None
-                if addr:
-                    addr.lat = None
-                    addr.lon = None
-
-        # schedules replacement
+            new_coords = (payload_lat, payload_lon)
+        elif loc_changed:
+            # новый адрес без координат: из geocode_cache, если он там есть, иначе сброс
+            new_coords = await cached_coords(session, loc) or (None, None)
+        elif merge and "lat" in payload and "lon" in payload:
+            new_coords = (None, None)
+        if new_coords is not None:
+            if (club.lat, club.lon) != new_coords:
+                club.lat, club.lon = new_coords
+                changed.add("coords")
+            if addr and (addr.lat, addr.lon) != new_coords:
+                addr.lat, addr.lon = new_coords
+                changed.add("coords")
+
+        # schedules: совпадающие по содержимому строки не трогаем,
+        # лишние удаляются (delete-orphan), недостающие добавляются
         if "schedules" in payload:
-            try:
-                await session.execute(delete(Schedule).where(Schedule.club_id == club.id))
-            except Exception:
-                pass
-
-            schedules_payload = payload.get("schedules") or []
-            weekday_map = {
-                "понедельник": 0, "вторник": 1, "среда": 2,
-                "четверг": 3, "пятница": 4, "суббота": 5, "воскресенье": 6
-            }
-            for s in schedules_payload:
-                if not isinstance(s, dict):
-                    continue
-                raw_day = (s.get("day") or "").strip()
-                raw_time = (s.get("time") or "").strip()
-                if (not raw_time) and any(ch.isdigit() for ch in raw_day):
-                    raw_time = raw_day
-                    raw_day = ""
-                if not raw_day and not raw_time:
-                    continue
-
-                weekday_val = None
-                if raw_day:
-                    try:
-                        weekday_val = int(raw_day)
-                    except Exception:
-                        weekday_val = weekday_map.get(raw_day.lower(), None)
-
-                start_time_obj = None
-                end_time_obj = None
-                note = None
-                if raw_time:
-                    t = raw_time.replace("–", "-").replace("—", "-")
-                    parts = [p.strip() for p in t.split("-", 1)]
-                    if len(parts) == 2 and parts[0] and parts[1]:
-                        try:
-                            hh, mm = [int(x) for x in parts[0].split(":")]
-                            start_time_obj = dt_time(hh, mm)
-                        except Exception:
-                            start_time_obj = None
-                        try:
-                            hh, mm = [int(x) for x in parts[1].split(":")]
-                            end_time_obj = dt_time(hh, mm)
-                        except Exception:
-                            end_time_obj = None
-                        if start_time_obj is None and end_time_obj is None:
-                            note = raw_time
-                    else:
-                        note = raw_time
-
-                if weekday_val is None and not start_time_obj and not end_time_obj and not note:
+            existing = {}
+            for sch in club.schedules:
+                existing.setdefault(_schedule_key(sch), []).append(sch)
+            ordered, added = [], 0
+            for raw in payload.get("schedules") or []:
+                item = _parse_schedule_item(raw)
+                if item is None:
                     continue
+                bucket = existing.get(_schedule_key(item))
+                if bucket:
+                    ordered.append(bucket.pop(0))
+                else:
+                    ordered.append(Schedule(**item))
+                    added += 1
+            removed = sum(len(b) for b in existing.values())
+            if added or removed:
+                club.schedules = ordered
+                changed.add("schedules")
+
+        if not changed:
+            # ответ — до rollback: он expire'ит загруженные атрибуты (в async — MissingGreenlet)
+            extra = {"tags": club.tags or [], "isFavorite": payload.get("isFavorite", False)}
+            out = _serialize_club(club, base_origin, extra)
+            await session.rollback()
+            return out
 
-                session.add(Schedule(
-                    club_id=club.id,
-                    weekday=weekday_val,
-                    start_time=start_time_obj,
-                    end_time=end_time_obj,
-                    note=note
-                ))
-
-        session.add(club)
+        club.updated_at = datetime.datetime.utcnow()
         try:
+            await session.flush()
+            extra = {"tags": club.tags or [], "isFavorite": payload.get("isFavorite", False)}
+            out = _serialize_club(club, base_origin, extra)
+            # статическую страницу перепишет фоновая задача, и только если она изменилась
+            if out["slug"] != old_slug or _render_club_html_simple(out) != before_html or not _static_club_file_exists(out["slug"]):
+                # при смене slug без дедупликации: old_slug каждой задачи должен дойти до воркера
+                await jobs.enqueue(
+                    session, "club.static",
+                    {"club_id": str(club.id), "base_origin": base_origin, "old_slug": old_slug},
+                    dedup_key=None if out["slug"] != old_slug else f"club.static:{club.id}",
+                )
+            await notify.publish(session, "club", club.id, club.updated_at)
+            await catalog_snapshot.enqueue_rebuild(session)
             await session.commit()
         except IntegrityError as e:
             await session.rollback()
@@ -1044,31 +812,25 @@ async def api_update_club(club_id: str, request: Request, payload: dict, user=De
             await session.rollback()
             raise HTTPException(status_code=500, detail=f"Commit failed: {e}")
 
-        q2 = await session.execute(
-            select(Club)
-            .where(Club.id == club.id)
-            .options(
-                selectinload(Club.address),
-                selectinload(Club.images),
-                selectinload(Club.schedules),
-                selectinload(Club.teacher),
-            )
-        )
-        club_full = q2.scalar_one_or_none() or club
+        jobs.wake()
+        catalog.invalidate()
+        related.schedule_club_refresh(club.id)
+        return out
 
-        base_origin = str(request.base_url).rstrip("/")
-        extra = {"tags": club_full.tags or [], "isFavorite": payload.get("isFavorite", False)}
-        out = _serialize_club(club_full, base_origin, extra)
 
-        try:
-            write_static_club_file(out["slug"], out)
-        except Exception as e:
-            print("[WARN] write_static_club_file failed (update):", e)
+@router.put("/api/clubs/{club_id}")
+async def api_update_club(club_id: str, request: Request, payload: dict, user=Depends(admin_required)):
+    print(f"[DEBUG] Update club {club_id} payload: {payload}")
+    return await _update_club(club_id, request, payload, merge=False)
 
-        return out
 
+@router.patch("/api/clubs/{club_id}")
+async def api_patch_club(club_id: str, request: Request, payload: dict, user=Depends(admin_required)):
+    """JSON Merge Patch: только присланные поля, null — очистить."""
+    return await _update_club(club_id, request, payload, merge=True)
 
-@app.delete("/api/clubs/{club_id}")
+
+@router.delete("/api/clubs/{club_id}")
 async def api_delete_club(club_id: str, user=Depends(admin_required)):
     async with AsyncSessionLocal() as session:
         where_clause = None
@@ -1083,53 +845,435 @@ async def api_delete_club(club_id: str, user=Depends(admin_required)):
         if not club:
             raise HTTPException(404, "Club not found")
         slug = getattr(club, "slug", None)
+        await forget_slugs(session, "club", club.id)
         await session.delete(club)
-        await session.commit()
         if slug:
-            try:
-                remove_static_club_file(slug)
-            except Exception:
-                pass
+            await jobs.enqueue(session, "club.static.remove", {"slug": slug}, dedup_key=f"club.static.remove:{slug}")
+        session.add(ClubTombstone(club_id=club.id, slug=slug or None))
+        await notify.publish(session, "club", club.id)
+        await catalog_snapshot.enqueue_rebuild(session)
+        await session.commit()
+        jobs.wake()
+        catalog.invalidate()
+        related.schedule_club_refresh(club.id)
         return {"ok": True}
 
 
-@app.post("/api/clubs/{club_id}/reviews", response_model=ReviewSchema)
-async def api_post_review(club_id: str, payload: ReviewCreateSchema):
+async def _resolve_club_uuid(club_id: str):
+    """id или slug -> UUID кружка (None — такого нет). Сначала каталог в памяти, потом БД."""
+    cat = catalog.fresh()
+    pos = cat.find(club_id) if cat is not None else None
+    if pos is not None:
+        return uuid.UUID(cat.rows[pos].id)
+    clause = Club.id == uuid.UUID(club_id) if _is_uuid(club_id) else Club.slug == club_id
+    async with AsyncSessionLocal() as session:
+        return (await session.execute(select(Club.id).where(clause))).scalar_one_or_none()
+
+
+def _client_ip(request: Request) -> str | None:
+    if REVIEW_TRUST_FORWARDED:
+        fwd = request.headers.get("x-forwarded-for")
+        if fwd:
+            return fwd.split(",")[0].strip()
+    return request.client.host if request.client else None
+
+
+def _reviews_flushed(club_ids) -> None:
+    catalog.reload_ratings(club_ids)
+    for cid in club_ids:
+        reviews.invalidate(cid)
+
+
+@router.post("/api/clubs/{club_id}/reviews", response_model=ReviewSchema)
+async def api_post_review(club_id: str, payload: ReviewCreateSchema, request: Request, response: Response):
+    """Проверка и лимит сразу; запись — пачкой в фоне (review_intake.py), ответ 202."""
+    try:
+        fields = review_intake.validate(payload)
+        cid = await _resolve_club_uuid(club_id)
+        if cid is None:
+            raise HTTPException(status_code=404, detail="Club not found")
+        review_intake.throttle(_client_ip(request), cid)
+        if review_intake.enabled():
+            response.status_code = 202
+            return review_intake.submit(cid, fields)
+    except review_intake.Rejected as e:
+        headers = {"Retry-After": str(max(1, int(min(e.retry_after, 3600) + 0.999)))} if e.retry_after else None
+        raise HTTPException(status_code=e.status, detail=e.detail, headers=headers)
+
+    # REVIEW_WRITE_BEHIND=0: синхронная запись
     try:
-        review = await create_review_for_club(club_id, payload)
+        review = await create_review_for_club(cid, payload.model_copy(update=fields))
     except NoResultFound:
         raise HTTPException(status_code=404, detail="Club not found")
+    _reviews_flushed([cid])
     return review
 
 
-@app.post("/api/clubs/{club_id}/images")
+@router.get("/api/clubs/{club_id}/reviews")
+async def api_club_reviews(club_id: str, response: Response, cursor: str | None = None, limit: int | None = None):
+    """Отзывы кружка, новые сверху. Следующая страница — ?cursor= из заголовка X-Next-Cursor."""
+    limit = max(1, min(int(limit or reviews.REVIEWS_PAGE_SIZE), reviews.REVIEWS_MAX_PAGE_SIZE))
+    after = _decode_cursor(cursor, [datetime.datetime.fromisoformat, uuid.UUID]) if cursor else None
+    first_page = after is None and limit == reviews.REVIEWS_PAGE_SIZE
+
+    cid = await _resolve_club_uuid(club_id)
+    if cid is None:
+        raise HTTPException(status_code=404, detail="Club not found")
+
+    hit = reviews.cached_first_page(cid) if first_page else None
+    if hit is not None:
+        items, next_key = hit
+    else:
+        gen = reviews.generation()
+        async with AsyncSessionLocal() as session:
+            items, next_key = await reviews.page(session, cid, after, limit)
+        if first_page:
+            reviews.store_first_page(cid, items, next_key, gen)
+
+    if next_key is not None:
+        response.headers["X-Next-Cursor"] = _encode_cursor(list(next_key))
+    return items
+
+
+@router.post("/api/clubs/{club_id}/images")
 async def api_upload_image(club_id: str, file: UploadFile = File(...), user=Depends(admin_required)):
-    ext = os.path.splitext(file.filename)[1]
-    fname = f"{uuid.uuid4().hex}{ext or '.jpg'}"
+    ext = (os.path.splitext(file.filename)[1] or ".jpg").lower()
+    content = await file.read()
+    # имя = хеш содержимого: URL неизменяемый, /media отдаёт его с immutable-кешем,
+    # повторная загрузка того же файла не создаёт дубликат
+    fname = f"{content_fingerprint(content)}{ext}"
     dest_path = os.path.join(MEDIA_DIR, fname)
-    async with aiofiles.open(dest_path, "wb") as out:
-        content = await file.read()
-        await out.write(content)
     url = f"/media/{fname}"
+    if not os.path.exists(dest_path):
+        import aiofiles  # загрузки — редкая админская операция, не платим за импорт на старте
+
+        async with aiofiles.open(dest_path, "wb") as out:
+            await out.write(content)
+        remember_hash(dest_path, content)
+    # thumb/detail/webp считает фоновая задача (пул процессов), ответ не ждёт
+    if get_variants(url, MEDIA_DIR) is None:
+        async with AsyncSessionLocal() as session:
+            await jobs.enqueue(
+                session, "image.derivatives", {"path": dest_path, "url": url},
+                dedup_key=f"image.derivatives:{fname}",
+            )
+            await session.commit()
+        jobs.wake()
     return {"url": url}
 
 
-@app.get("/api/clubs")
-async def api_get_clubs(request: Request, limit: int = 100, offset: int = 0):
+async def _regenerate_static_pages(club_ids, base_origin: str = None, chunk: int = 500):
+    """Статические страницы для пачки кружков (задача club.static) — чанками, без N+1."""
+    base_origin = (base_origin or os.getenv("SITEMAP_BASE_URL") or "").rstrip("/")
+    ids = [uuid.UUID(str(i)) for i in club_ids]
+    written = failed = 0
     async with AsyncSessionLocal() as session:
-        try:
+        for i in range(0, len(ids), chunk):
             q = await session.execute(
                 select(Club)
+                .where(Club.id.in_(ids[i:i + chunk]))
                 .options(
                     selectinload(Club.address),
                     selectinload(Club.images),
                     selectinload(Club.schedules),
                     selectinload(Club.teacher),
                 )
-                .limit(limit)
-                .offset(offset)
             )
-            clubs = q.scalars().all()
+            for c in q.scalars().all():
+                try:
+                    out = _serialize_club(c, base_origin)
+                    if write_static_club_file(out["slug"], out):
+                        written += 1
+                    else:
+                        failed += 1
+                except Exception as e:
+                    failed += 1
+                    print(f"[WARN] static page for club {c.id} failed: {e}")
+    if failed:
+        # задача очереди уйдёт на повтор
+        raise RuntimeError(f"{failed} static club pages failed")
+    return written
+
+
+# ---- фоновые задачи (jobs.py) ----
+
+@jobs.handler("club.static")
+async def _job_club_static(payload: dict):
+    ids = payload.get("club_ids") or [payload["club_id"]]
+    await _regenerate_static_pages(ids, payload.get("base_origin"))
+    old_slug = payload.get("old_slug")
+    if old_slug:
+        async with AsyncSessionLocal() as session:
+            live = (await session.execute(select(Club.id).where(Club.slug == old_slug))).first()
+        if live is None:
+            remove_static_club_file(old_slug)
+
+
+@jobs.handler("club.static.remove")
+async def _job_club_static_remove(payload: dict):
+    slug = payload.get("slug")
+    async with AsyncSessionLocal() as session:
+        live = (await session.execute(select(Club.id).where(Club.slug == slug))).first()
+    if slug and live is None:
+        remove_static_club_file(slug)
+
+
+@jobs.handler("image.derivatives")
+async def _job_image_derivatives(payload: dict):
+    if not os.path.exists(payload["path"]):
+        return
+    fut = enqueue_derivatives(payload["path"], MEDIA_DIR, payload["url"])
+    if fut is not None:
+        await fut
+        # imageVariants/srcset входят в карточки снимка каталога
+        async with AsyncSessionLocal() as session:
+            await catalog_snapshot.enqueue_rebuild(session)
+            await session.commit()
+
+
+@jobs.handler("ratings.reconcile")
+async def _job_ratings_reconcile(payload: dict):
+    async with AsyncSessionLocal() as session:
+        fixed = await ratings.reconcile(session)
+        if fixed:
+            await ratings.publish(session)
+            await catalog_snapshot.enqueue_rebuild(session)
+        # следующая сверка — через RATING_RECONCILE_HOURS
+        await ratings.schedule_reconcile(session, delay=ratings.RATING_RECONCILE_HOURS * 3600)
+        await session.commit()
+    if fixed:
+        catalog.reload_ratings()
+        reviews.invalidate()
+
+
+@jobs.handler("catalog.snapshot")
+async def _job_catalog_snapshot(payload: dict):
+    version = await catalog_snapshot.build(AsyncSessionLocal, _serialize_club)
+    async with AsyncSessionLocal() as session:
+        await catalog.prune_tombstones(session)
+        await notify.publish(session, "catalog", None, version)
+        await session.commit()
+    catalog.wake()
+
+
+@jobs.handler("blog.render")
+async def _job_blog_render(payload: dict):
+    async with AsyncSessionLocal() as session:
+        post = (await session.execute(select(BlogPost).where(BlogPost.id == uuid.UUID(payload["post_id"])))).scalar_one_or_none()
+        if post is None or not (needs_render(post) or post.render_revision != render_revision(post)):
+            return
+        apply_render(post)
+        await notify.publish(session, "blog", post.id, post.render_revision)
+        await session.commit()
+    blog_feed.invalidate()
+
+
+@router.get("/api/admin/jobs")
+async def api_admin_jobs(user=Depends(admin_required)):
+    async with AsyncSessionLocal() as session:
+        return {
+            "worker": jobs.JOB_WORKER,
+            "worker_id": jobs.WORKER_ID,
+            "stats": await jobs.stats(session),
+            "failed": await jobs.recent_failures(session),
+            "catalog": {"snapshot": catalog_snapshot.status(), "memory": catalog.status()},
+            "review_intake": review_intake.status(),
+        }
+
+
+@router.post("/api/admin/ratings/reconcile")
+async def api_admin_ratings_reconcile(user=Depends(admin_required)):
+    async with AsyncSessionLocal() as session:
+        fixed = await ratings.reconcile(session)
+        if fixed:
+            await ratings.publish(session)
+            await catalog_snapshot.enqueue_rebuild(session)
+        await session.commit()
+    if fixed:
+        jobs.wake()
+        catalog.reload_ratings()
+        reviews.invalidate()
+    return {"fixed": fixed}
+
+
+@router.post("/api/admin/jobs/retry")
+async def api_admin_jobs_retry(kind: str | None = None, user=Depends(admin_required)):
+    async with AsyncSessionLocal() as session:
+        n = await jobs.retry_failed(session, kind)
+    jobs.wake()
+    return {"requeued": n}
+
+
+@router.post("/api/admin/clubs/import")
+async def api_admin_import_clubs(
+    request: Request,
+    file: UploadFile = File(...),
+    format: str | None = None,
+    dry_run: bool = False,
+    user=Depends(admin_required),
+):
+    try:
+        fmt = detect_format(file.filename, format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async with AsyncSessionLocal() as session:
+        try:
+            # UploadFile уже лежит во временном файле — читаем его потоково, пачками
+            report = await import_clubs(session, iter_rows(file.file, fmt), dry_run=dry_run)
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            await session.rollback()
+            raise HTTPException(status_code=400, detail=f"cannot parse {fmt}: {e}")
+        except DBAPIError as e:
+            await session.rollback()
+            raise HTTPException(status_code=400, detail=f"DB error: {str(e.orig) if getattr(e,'orig',None) else str(e)}")
+        ids = report.pop("ids")
+        if dry_run:
+            await session.rollback()
+        else:
+            if ids:
+                # статические страницы — одной фоновой задачей на весь импорт
+                await jobs.enqueue(
+                    session, "club.static",
+                    {"club_ids": ids, "base_origin": str(request.base_url).rstrip("/")},
+                )
+                await notify.publish(session, "club")
+                await catalog_snapshot.enqueue_rebuild(session)
+            await session.commit()
+
+    if ids and not dry_run:
+        jobs.wake()
+        catalog.invalidate()
+        related.schedule_rebuild()
+    return report
+
+
+@router.get("/api/admin/clubs/export")
+async def api_admin_export_clubs(format: str = "csv", user=Depends(admin_required)):
+    fmt = (format or "csv").strip().lower()
+    if fmt not in club_export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(club_export.FORMATS)}")
+    stamp = datetime.datetime.utcnow().strftime("%Y%m%d")
+    filename = f"clubs-{stamp}.{fmt}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"', "Cache-Control": "no-store"}
+
+    if fmt == "parquet":
+        # колоночный файл собирается во временный файл (сжатие в потоке), затем отдаётся и удаляется
+        path = club_export.temp_parquet_path()
+        try:
+            await club_export.write_parquet(AsyncSessionLocal, path)
+        except ValueError as e:
+            os.remove(path)
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception:
+            os.remove(path)
+            raise
+        return FileResponse(
+            path,
+            media_type=club_export.MEDIA_TYPES[fmt],
+            headers=headers,
+            background=BackgroundTask(os.remove, path),
+        )
+
+    # CSV/NDJSON — пачками прямо из серверного курсора
+    return StreamingResponse(
+        club_export.stream_text(AsyncSessionLocal, fmt),
+        media_type=club_export.MEDIA_TYPES[fmt],
+        headers=headers,
+    )
+
+
+@router.get("/api/clubs")
+async def api_get_clubs(
+    request: Request,
+    limit: int = 100,
+    offset: int = 0,
+    days: str | None = None,
+    time_from: str | None = None,
+    time_to: str | None = None,
+    time_mode: str = "overlap",
+    near: str | None = None,
+    radius_km: float | None = None,
+    sort: str = "name",
+    category: str | None = None,
+    age: int | None = None,
+):
+    # фильтр по расписанию: days=сб,вс / будни, окно time_from..time_to,
+    # time_mode=overlap (слот пересекает окно) | within (слот целиком внутри окна)
+    # near=lat,lon — distance_km в ответе; radius_km — только ближе; sort=distance — по близости
+    try:
+        slot_conds = slot_conditions(days, time_from, time_to, time_mode)
+        point = parse_near(near) if near else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if sort not in DISTANCE_SORTS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(DISTANCE_SORTS)}")
+    if point is None and (radius_km is not None or sort == "distance"):
+        raise HTTPException(status_code=400, detail="radius_km and sort=distance require near=lat,lon")
+    if radius_km is not None and radius_km < 0:
+        raise HTTPException(status_code=400, detail="radius_km must be >= 0")
+
+    # каталог в памяти (catalog.py) — без БД; если он отстал от записей, идём в БД
+    cat = catalog.fresh()
+    if cat is not None:
+        positions, matched, distances = cat.page(
+            max(0, offset), max(0, limit), slot_predicate(days, time_from, time_to, time_mode),
+            near=point, radius_km=radius_km, sort=sort, category=category, age=age,
+        )
+        extra = {}
+        for p in positions:
+            e = {}
+            if matched is not None:
+                e["matchingSlots"] = [_slot_out(s) for s in matched[p]]
+            if distances is not None:
+                e["distance_km"] = distances[p]
+            if e:
+                extra[p] = e
+        body = cat.json_array(positions, str(request.base_url).rstrip("/"), extra)
+        return Response(content=body, media_type="application/json")
+
+    async with AsyncSessionLocal() as session:
+        try:
+            stmt = select(Club).options(
+                selectinload(Club.address),
+                selectinload(Club.images),
+                selectinload(Club.schedules),
+                selectinload(Club.teacher),
+            )
+            if slot_conds:
+                stmt = stmt.where(Club.id.in_(clubs_with_slots(slot_conds)))
+            if category is not None:
+                stmt = stmt.where(Club.category == category)
+            if age is not None:
+                stmt = stmt.where(
+                    or_(Club.min_age.is_(None), Club.min_age <= age),
+                    or_(Club.max_age.is_(None), Club.max_age >= age),
+                )
+            dist = None
+            if point is not None:
+                # координаты как в _serialize_club: кружка, иначе адреса
+                no_coords = or_(Club.lat.is_(None), Club.lon.is_(None))
+                dist = distance_sql(
+                    case((no_coords, Address.lat), else_=Club.lat),
+                    case((no_coords, Address.lon), else_=Club.lon),
+                    *point,
+                ).label("distance_km")
+                stmt = stmt.outerjoin(Address, Club.address_id == Address.id).add_columns(dist)
+                if radius_km is not None:
+                    stmt = stmt.where(dist <= radius_km)
+            if sort == "distance":
+                stmt = stmt.order_by(dist.asc().nulls_last(), *NAME_ORDER)
+            else:
+                stmt = stmt.order_by(*NAME_ORDER)
+            q = await session.execute(stmt.limit(limit).offset(offset))
+            if point is not None:
+                rows = q.all()
+                clubs = [r[0] for r in rows]
+                distances = {r[0].id: r[1] for r in rows}
+            else:
+                clubs = q.scalars().all()
+                distances = None
+            slots = await matching_slots(session, [c.id for c in clubs], slot_conds)
         except Exception as e:
             print("[ERROR] get_clubs failed:", repr(e))
             raise HTTPException(status_code=500, detail=f"DB read failed: {e}")
@@ -1138,26 +1282,40 @@ async def api_get_clubs(request: Request, limit: int = 100, offset: int = 0):
         out = []
         for idx, c in enumerate(clubs):
             try:
-                out.append(_serialize_club(c, base_origin))
+                extra = {}
+                if slot_conds:
+                    extra["matchingSlots"] = slots.get(c.id, [])
+                if distances is not None:
+                    d = distances.get(c.id)
+                    extra["distance_km"] = round(float(d), 3) if d is not None else None
+                out.append(_serialize_club(c, base_origin, extra or None))
             except Exception as e:
                 print(f"[WARN] serialize club idx={idx} id={getattr(c,'id',None)} failed: {e}")
         return out
 
 
-@app.get("/api/clubs/{club_id}")
+@router.get("/api/clubs/{club_id}")
 async def api_get_club(request: Request, club_id: str):
+    cat = catalog.fresh()
+    if cat is not None:
+        # старые slug'и (редирект) — через БД ниже
+        pos = cat.find(str(uuid.UUID(club_id)) if _is_uuid(club_id) else club_id)
+        if pos is not None:
+            body = cat.json_one(pos, str(request.base_url).rstrip("/"))
+            return Response(content=body, media_type="application/json")
+
     async with AsyncSessionLocal() as session:
-        where_clause = None
+        by_slug = False
         try:
             parsed_uuid = uuid.UUID(str(club_id))
-            where_clause = (Club.id == parsed_uuid)
+            stmt = select(Club).where(Club.id == parsed_uuid)
         except Exception:
-            where_clause = (Club.slug == club_id)
+            # текущий slug или старый (из slug_history) — одним запросом
+            by_slug = True
+            stmt = select(Club).where(slug_lookup_clause("club", club_id)).order_by(live_first("club", club_id)).limit(1)
 
         q = await session.execute(
-            select(Club)
-            .where(where_clause)
-            .options(
+            stmt.options(
                 selectinload(Club.address),
                 selectinload(Club.images),
                 selectinload(Club.schedules),
@@ -1167,6 +1325,8 @@ async def api_get_club(request: Request, club_id: str):
         c = q.scalar_one_or_none()
         if not c:
             raise HTTPException(status_code=404, detail="Club not found")
+        if by_slug and c.slug != club_id:
+            return _slug_redirect(request, "/api/clubs", c.slug)
         base_origin = str(request.base_url).rstrip("/")
         return _serialize_club(c, base_origin)
 
@@ -1176,51 +1336,100 @@ async def api_get_club(request: Request, club_id: str):
 # ==========================
 
 
-@app.get("/api/blog/public/posts")
+def _parse_tags_param(tag: str | None, tags: list[str] | None) -> list[str]:
+    """?tag=a, ?tags=a,b и ?tags=a&tags=b -> ['a', 'b'] (без дублей, порядок сохраняем)."""
+    out = []
+    raw = [tag] if tag else []
+    raw.extend(tags or [])
+    for chunk in raw:
+        for t in str(chunk or "").split(","):
+            t = t.strip()
+            if t and t not in out:
+                out.append(t)
+    return out
+
+
+@router.get("/api/blog/public/posts")
 async def api_public_blog_posts(
+    response: Response,
     limit: int = 20,
     offset: int = 0,
     q: str | None = None,
     tag: str | None = None,
+    tags: list[str] | None = Query(None),
+    tag_mode: str = "all",
     category: str | None = None,
 ):
-    """Публичный список статей (только published)."""
+    """Публичный список статей (только published).
+
+    Фильтр по тегам выполняется в SQL (jsonb @> / ?| по GIN-индексу):
+    tag_mode=all — статья содержит все теги, tag_mode=any — хотя бы один.
+    q — полнотекстовый поиск (search_vector), результаты по релевантности + snippet.
+    Общее число подходящих статей — в заголовке X-Total-Count.
+    """
     limit = max(1, min(int(limit or 20), 200))
     offset = max(0, int(offset or 0))
     q_txt = (q or "").strip()
-    tag_txt = (tag or "").strip()
+    tag_list = _parse_tags_param(tag, tags)
     cat_txt = (category or "").strip()
+    mode = (tag_mode or "all").strip().lower()
+    if mode not in ("all", "any"):
+        raise HTTPException(status_code=400, detail="tag_mode must be all|any")
+
+    conditions = [BlogPost.status == "published"]
+    if cat_txt:
+        conditions.append(BlogPost.category == cat_txt)
+    tsq = None
+    if q_txt:
+        tsq = search_query(q_txt)
+        conditions.append(BlogPost.search_vector.op("@@")(tsq))
+    if tag_list:
+        if mode == "all" or len(tag_list) == 1:
+            conditions.append(BlogPost.tags.contains(tag_list))
+        else:
+            conditions.append(BlogPost.tags.has_any(cast(pg_array(tag_list), PG_ARRAY(Text))))
 
     async with AsyncSessionLocal() as session:
-        stmt = (
-            select(BlogPost)
-            .where(BlogPost.status == "published")
-            .order_by(desc(BlogPost.published_at), desc(BlogPost.updated_at))
-            .limit(limit)
-            .offset(offset)
-        )
-        if cat_txt:
-            stmt = stmt.where(BlogPost.category == cat_txt)
-        if q_txt:
-            like = f"%{q_txt}%"
-            stmt = stmt.where(or_(BlogPost.title.ilike(like), BlogPost.excerpt.ilike(like)))
-
-        r = await session.execute(stmt)
-        posts = r.scalars().all()
+        # total считается окном в том же запросе — без отдельного COUNT(*)
+        if tsq is not None:
+            rank = rank_expr(tsq)
+            stmt = (
+                select(BlogPost, func.count().over().label("total"), rank.label("rank"), snippet_expr(tsq).label("snippet"))
+                .where(*conditions)
+                .order_by(desc(rank), desc(BlogPost.published_at))
+            )
+        else:
+            stmt = (
+                select(BlogPost, func.count().over().label("total"))
+                .where(*conditions)
+                .order_by(desc(BlogPost.published_at), desc(BlogPost.updated_at))
+            )
+        r = await session.execute(stmt.limit(limit).offset(offset))
+        rows = r.all()
+
+        if rows:
+            total = int(rows[0].total)
+        elif offset:
+            # страница за пределами выборки — окно пустое, досчитываем отдельно
+            rc = await session.execute(select(func.count()).select_from(BlogPost).where(*conditions))
+            total = int(rc.scalar() or 0)
+        else:
+            total = 0
 
+        response.headers["X-Total-Count"] = str(total)
         out = []
-        for p in posts:
-            if tag_txt:
-                tags = list(getattr(p, "tags", None) or [])
-                if tag_txt not in tags:
-                    continue
-            out.append(_serialize_blog_post(p))
+        for row in rows:
+            item = _serialize_blog_post(row[0])
+            if tsq is not None:
+                item["rank"] = float(row.rank or 0)
+                item["snippet"] = row.snippet or ""
+            out.append(item)
         return out
 
 
-@app.get("/api/blog/public/posts/{slug}")
-async def api_public_blog_post(slug: str):
-    """Публичная статья по slug (только published)."""
+@router.get("/api/blog/public/posts/{slug}")
+async def api_public_blog_post(slug: str, request: Request):
+    """Публичная статья по slug (только published). Старый slug -> 301 на новый."""
     s = (slug or "").strip()
     if not s:
         raise HTTPException(status_code=404, detail="Not found")
@@ -1228,38 +1437,170 @@ async def api_public_blog_post(slug: str):
     async with AsyncSessionLocal() as session:
         r = await session.execute(
             select(BlogPost)
-            .where(BlogPost.slug == s)
+            .where(slug_lookup_clause("blog", s))
             .where(BlogPost.status == "published")
+            .order_by(live_first("blog", s))
             .limit(1)
         )
         post = r.scalar_one_or_none()
         if not post:
             raise HTTPException(status_code=404, detail="Not found")
-        return _serialize_blog_post(post)
+        if post.slug != s:
+            return _slug_redirect(request, "/api/blog/public/posts", post.slug)
+
+        # статьи, сохранённые до появления пререндера (или старой версией рендера)
+        if needs_render(post):
+            apply_render(post)
+            out = _serialize_blog_post_public(post)
+            try:
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                print("[WARN] blog render persist failed:", e)
+            return out
+        return _serialize_blog_post_public(post)
+
+
+# колонки, которые нужны таблице статей в админке (тяжёлые content/content_blocks/faq/rendered_* не грузим)
+_BLOG_SUMMARY_COLUMNS = (
+    BlogPost.id, BlogPost.title, BlogPost.slug, BlogPost.status, BlogPost.excerpt,
+    BlogPost.cover_image, BlogPost.category, BlogPost.tags, BlogPost.author_name,
+    BlogPost.published_at, BlogPost.created_at, BlogPost.updated_at,
+)
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+# sort -> (SQL-выражение, парсер значения из курсора)
+_BLOG_ADMIN_SORTS = {
+    "updated_at": (func.coalesce(BlogPost.updated_at, _EPOCH), datetime.datetime.fromisoformat),
+    "created_at": (func.coalesce(BlogPost.created_at, _EPOCH), datetime.datetime.fromisoformat),
+    "published_at": (func.coalesce(BlogPost.published_at, _EPOCH), datetime.datetime.fromisoformat),
+    "title": (BlogPost.title, str),
+}
+
+
+def _encode_cursor(values) -> str:
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime.datetime) else str(v) for v in values])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str, parsers):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(parsers):
+            raise ValueError("bad cursor")
+        return [parse(v) for parse, v in zip(parsers, values)]
+    except Exception:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+
+
+def _serialize_blog_post_summary(p: BlogPost):
+    return {
+        "id": str(getattr(p, "id", "")),
+        "title": getattr(p, "title", "") or "",
+        "slug": getattr(p, "slug", "") or "",
+        "status": getattr(p, "status", "draft") or "draft",
+        "excerpt": getattr(p, "excerpt", None),
+        "cover_image": getattr(p, "cover_image", None),
+        "category": getattr(p, "category", None),
+        "tags": list(getattr(p, "tags", None) or []),
+        "author_name": getattr(p, "author_name", None),
+        "published_at": getattr(p, "published_at", None),
+        "created_at": getattr(p, "created_at", None),
+        "updated_at": getattr(p, "updated_at", None),
+    }
 
 
-@app.get("/api/blog/posts")
+@router.get("/api/blog/posts")
 async def api_admin_blog_posts(
-    limit: int = 5000,
+    response: Response,
+    limit: int = 100,
     offset: int = 0,
     include_drafts: bool = True,
+    view: str = "summary",
+    status: str | None = None,
+    category: str | None = None,
+    sort: str = "updated_at",
+    order: str = "desc",
+    cursor: str | None = None,
     user=Depends(admin_required),
 ):
-    """Админский список статей (draft+published по умолчанию)."""
-    limit = max(1, min(int(limit or 5000), 5000))
+    """Админский список статей (draft+published по умолчанию).
+
+    view=summary (по умолчанию) — только колонки для таблицы, без тел статей;
+    полная статья — GET /api/blog/posts/{id}. view=full — старый формат.
+    Пагинация keyset: следующий курсор в заголовке X-Next-Cursor (передать как ?cursor=).
+    """
+    limit = max(1, min(int(limit or 100), 5000))
     offset = max(0, int(offset or 0))
+    if view not in ("summary", "full"):
+        raise HTTPException(status_code=400, detail="view must be summary|full")
+    if sort not in _BLOG_ADMIN_SORTS:
+        raise HTTPException(status_code=400, detail="sort must be " + "|".join(_BLOG_ADMIN_SORTS))
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order must be asc|desc")
+
+    sort_expr, sort_parse = _BLOG_ADMIN_SORTS[sort]
+    key = tuple_(sort_expr, BlogPost.id)
+
+    conditions = []
+    if not include_drafts:
+        conditions.append(BlogPost.status == "published")
+    if status:
+        conditions.append(BlogPost.status == status.strip())
+    if category:
+        conditions.append(BlogPost.category == category.strip())
+
+    async with AsyncSessionLocal() as session:
+        stmt = select(BlogPost, func.count().over().label("total")) if not cursor else select(BlogPost)
+        if view == "summary":
+            stmt = stmt.options(load_only(*_BLOG_SUMMARY_COLUMNS))
+        if conditions:
+            stmt = stmt.where(*conditions)
+        if cursor:
+            after = tuple_(*_decode_cursor(cursor, [sort_parse, uuid.UUID]))
+            stmt = stmt.where(key < after if order == "desc" else key > after)
+        elif offset:
+            stmt = stmt.offset(offset)
+        if order == "desc":
+            stmt = stmt.order_by(desc(sort_expr), desc(BlogPost.id))
+        else:
+            stmt = stmt.order_by(sort_expr, BlogPost.id)
+        # +1 строка, чтобы понять, есть ли следующая страница
+        r = await session.execute(stmt.limit(limit + 1))
+        rows = r.all()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if rows and not cursor:
+            response.headers["X-Total-Count"] = str(int(rows[0].total))
+        if has_more:
+            last = rows[-1][0]
+            last_val = getattr(last, sort) if sort == "title" else (getattr(last, sort) or _EPOCH)
+            response.headers["X-Next-Cursor"] = _encode_cursor([last_val, last.id])
+
+        serialize = _serialize_blog_post_summary if view == "summary" else _serialize_blog_post
+        return [serialize(row[0]) for row in rows]
+
+
+@router.get("/api/blog/posts/{post_id}")
+async def api_admin_blog_post(post_id: str, user=Depends(admin_required)):
+    """Полная статья для редактора (в списке тела не отдаются)."""
+    try:
+        pid = uuid.UUID(str(post_id))
+    except Exception:
+        raise HTTPException(status_code=400, detail="post_id must be UUID")
 
     async with AsyncSessionLocal() as session:
-        stmt = select(BlogPost)
-        if not include_drafts:
-            stmt = stmt.where(BlogPost.status == "published")
-        stmt = stmt.order_by(desc(BlogPost.updated_at), desc(BlogPost.created_at)).limit(limit).offset(offset)
-        r = await session.execute(stmt)
-        posts = r.scalars().all()
-        return [_serialize_blog_post(p) for p in posts]
+        r = await session.execute(select(BlogPost).where(BlogPost.id == pid))
+        post = r.scalar_one_or_none()
+        if not post:
+            raise HTTPException(status_code=404, detail="Not found")
+        return _serialize_blog_post(post)
 
 
-@app.post("/api/blog/posts")
+@router.post("/api/blog/posts")
 async def api_admin_blog_create(payload: BlogPostCreateSchema, user=Depends(admin_required)):
     now = datetime.datetime.utcnow()
     title = (payload.title or "").strip()
@@ -1295,18 +1636,26 @@ async def api_admin_blog_create(payload: BlogPostCreateSchema, user=Depends(admi
             created_at=now,
             updated_at=now,
         )
+        post.search_vector = search_vector_expr(post)
         session.add(post)
         try:
+            await session.flush()
+            # HTML статьи рендерит фоновая задача; до неё публичный эндпоинт рендерит сам
+            await jobs.enqueue(session, "blog.render", {"post_id": str(post.id)}, dedup_key=f"blog.render:{post.id}")
+            await notify.publish(session, "blog", post.id, post.updated_at)
             await session.commit()
         except IntegrityError as e:
             await session.rollback()
             raise HTTPException(status_code=400, detail=f"DB error: {str(e.orig) if getattr(e,'orig',None) else str(e)}")
 
         await session.refresh(post)
+        jobs.wake()
+        related.schedule_post_refresh(post.id)
+        blog_feed.invalidate()
         return _serialize_blog_post(post)
 
 
-@app.put("/api/blog/posts/{post_id}")
+@router.put("/api/blog/posts/{post_id}")
 async def api_admin_blog_update(post_id: str, payload: BlogPostUpdateSchema, user=Depends(admin_required)):
     now = datetime.datetime.utcnow()
 
@@ -1329,7 +1678,9 @@ async def api_admin_blog_update(post_id: str, payload: BlogPostUpdateSchema, use
 
         if payload.slug is not None:
             desired = (payload.slug or "").strip() or _slugify_basic(post.title)
+            old_slug = post.slug
             post.slug = await _ensure_unique_blog_slug(session, desired, exclude_id=post.id)
+            await record_slug_change(session, "blog", post.id, old_slug, post.slug)
 
         if payload.excerpt is not None:
             post.excerpt = (payload.excerpt or "").strip() or None
@@ -1375,18 +1726,30 @@ async def api_admin_blog_update(post_id: str, payload: BlogPostUpdateSchema, use
             post.published_at = None
 
         post.updated_at = now
+        post.search_vector = search_vector_expr(post)
+        # HTML пересчитываем, только если поменялись content/content_blocks/faq:
+        # старый пререндер помечаем устаревшим, новый считает фоновая задача
+        rerender = needs_render(post) or post.render_revision != render_revision(post)
+        if rerender:
+            post.render_revision = None
         session.add(post)
         try:
+            if rerender:
+                await jobs.enqueue(session, "blog.render", {"post_id": str(post.id)}, dedup_key=f"blog.render:{post.id}")
+            await notify.publish(session, "blog", post.id, post.updated_at)
             await session.commit()
         except IntegrityError as e:
             await session.rollback()
             raise HTTPException(status_code=400, detail=f"DB error: {str(e.orig) if getattr(e,'orig',None) else str(e)}")
 
         await session.refresh(post)
+        jobs.wake()
+        related.schedule_post_refresh(post.id)
+        blog_feed.invalidate()
         return _serialize_blog_post(post)
 
 
-@app.delete("/api/blog/posts/{post_id}")
+@router.delete("/api/blog/posts/{post_id}")
 async def api_admin_blog_delete(post_id: str, user=Depends(admin_required)):
     try:
         pid = uuid.UUID(str(post_id))
@@ -1398,102 +1761,160 @@ async def api_admin_blog_delete(post_id: str, user=Depends(admin_required)):
         post = r.scalar_one_or_none()
         if not post:
             raise HTTPException(status_code=404, detail="Not found")
+        await forget_slugs(session, "blog", post.id)
         await session.delete(post)
+        await notify.publish(session, "blog", post.id)
         await session.commit()
+        related.schedule_post_refresh(post.id)
+        blog_feed.invalidate()
         return {"ok": True}
 
 
-@app.post("/api/clubs/{club_id}")
+@router.post("/api/clubs/{club_id}")
 async def api_update_club_post(club_id: str, request: Request, user=Depends(admin_required)):
     payload = await request.json()
     print(f"[DEBUG] Update club {club_id} payload: {payload}")
     return await api_update_club(club_id, request, payload, user=user)
 
 
-@app.get("/club/{slug}")
-async def serve_club_page(slug: str):
+@router.get("/club/{slug}")
+async def serve_club_page(slug: str, request: Request):
     fname = os.path.join(STATIC_CLUBS_DIR, f"{slug}.html")
     if os.path.exists(fname):
-        return FileResponse(fname, media_type="text/html")
+        return html_file_response(request, fname)
 
     async with AsyncSessionLocal() as session:
         q = await session.execute(select(Club)\
-            .where(Club.slug == slug)\
+            .where(slug_lookup_clause("club", slug))\
+            .order_by(live_first("club", slug))\
+            .limit(1)\
             .options(selectinload(Club.address), selectinload(Club.images), selectinload(Club.schedules), selectinload(Club.teacher))
         )
         c = q.scalar_one_or_none()
         if not c:
             raise HTTPException(404, "Club not found")
+        if c.slug != slug:
+            return _slug_redirect(request, "/club", c.slug)
         serialized = _serialize_club(c, "")
         html = _render_club_html_simple(serialized)
         try:
             with open(fname, "w", encoding="utf-8") as f:
                 f.write(html)
+            remember_hash(fname, html.encode("utf-8"))
         except Exception:
             pass
         return HTMLResponse(html)
 
 
-@app.get("/api/admin/geocode-missing")
-@app.post("/api/admin/geocode-missing")
+@router.post("/api/admin/geocode-jobs")
+async def api_admin_start_geocode_job(limit: int | None = None, user=Depends(admin_required)):
+    """Фоновый геокодинг всех кружков без координат (через geocode_cache)."""
+    started = geocode.start_missing_job(AsyncSessionLocal, limit=limit)
+    return JSONResponse(geocode.job_status(), status_code=202 if started else 409)
+
+
+@router.get("/api/admin/geocode-jobs")
+async def api_admin_geocode_job_status(user=Depends(admin_required)):
+    return geocode.job_status()
+
+
+@router.get("/api/admin/geocode-missing")
+@router.post("/api/admin/geocode-missing")
 async def api_admin_geocode_missing(
     request: Request,
+    response: Response,
     limit: int = 50,
+    after: str | None = None,
     user=Depends(admin_required),
 ):
-    """Исторический эндпоинт.
+    """Кружки, у которых есть адрес, но нет координат (у кружка или у адреса).
 
-    Раньше он делал серверный геокодинг. Сейчас серверный геокодинг выключен,
-    потому что ключ у тебя whitelisted по домену, и сервер получает 403.
-
-    Эндпоинт возвращает список записей, где координаты отсутствуют.
-    Геокодинг и запись координат делай через админку (кнопки "Заполнить координаты").
+    Фильтр и пагинация — в SQL (частичные индексы по NULL lat/lon, keyset по id):
+    after=<id последнего кружка предыдущей страницы>, next_cursor — для следующей.
+    Геокодинг: кнопки админки (ymaps.geocode в браузере) или POST /api/admin/geocode-jobs.
     """
+    limit = max(0, min(int(limit or 0), 1000))
+    after_id = None
+    if after:
+        try:
+            after_id = uuid.UUID(str(after))
+        except Exception:
+            raise HTTPException(status_code=400, detail="bad cursor")
+
+    clause = geocode.missing_coords_clause()
     async with AsyncSessionLocal() as session:
-        q = await session.execute(
-            select(Club)
-            .options(selectinload(Club.address))
-            .limit(5000)
+        total = (await session.execute(
+            select(func.count()).select_from(Club).join(Address, Club.address_id == Address.id).where(clause)
+        )).scalar_one()
+
+        stmt = (
+            select(Club.id, Club.slug, Club.lat, Club.lon, Address.street, Address.city)
+            .join(Address, Club.address_id == Address.id)
+            .where(clause)
+            .order_by(Club.id)
+            .limit(limit)
         )
-        clubs = q.scalars().all()
+        if after_id is not None:
+            stmt = stmt.where(Club.id > after_id)
+        rows = (await session.execute(stmt)).all()
+
+    missing = [
+        {
+            "id": str(r.id),
+            "slug": r.slug or "",
+            "location": ", ".join(p for p in ((r.street or "").strip(), (r.city or "").strip()) if p),
+            "lat": r.lat,
+            "lon": r.lon,
+        }
+        for r in rows
+    ]
+    next_cursor = missing[-1]["id"] if len(missing) == limit and limit else None
+    response.headers["X-Total-Count"] = str(total)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
 
-        missing = []
-        for c in clubs:
-            addr = getattr(c, "address", None)
-            loc_parts = []
-            if addr:
-                st = (getattr(addr, "street", None) or "").strip()
-                ct = (getattr(addr, "city", None) or "").strip()
-                if st:
-                    loc_parts.append(st)
-                if ct:
-                    loc_parts.append(ct)
-            loc = ", ".join(loc_parts).strip()
-            if not loc:
-                continue
-
-            club_lat = getattr(c, "lat", None)
-            club_lon = getattr(c, "lon", None)
-            addr_lat = getattr(addr, "lat", None) if addr else None
-            addr_lon = getattr(addr, "lon", None) if addr else None
-
-            if club_lat is None or club_lon is None or (addr and (addr_lat is None or addr_lon is None)):
-                missing.append({
-                    "id": str(getattr(c, "id", "")),
-                    "slug": getattr(c, "slug", ""),
-                    "location": loc,
-                    "lat": club_lat,
-                    "lon": club_lon,
-                })
-
-        missing = missing[: max(0, int(limit or 0))]
+    return {
+        "processed": len(missing),
+        "updated": 0,
+        "total": total,
+        "next_cursor": next_cursor,
+        "failed": missing,
+        "note": "Server-side geocoding is not run here. Use AdminPanelClient.jsx buttons (ymaps.geocode in browser) or POST /api/admin/geocode-jobs.",
+    }
 
-        return {
-            "processed": len(missing),
-            "updated": 0,
-            "failed": missing,
-            "note": "Server-side geocoding disabled. Use AdminPanelClient.jsx buttons to geocode via browser (ymaps.geocode) and save lat/lon into DB.",
-        }
+
+def create_app() -> FastAPI:
+    """Сборка приложения. Импорт main ничего не создаёт на диске и не трогает БД;
+    тяжёлые подсистемы (NumPy, Pillow, индекс блога) подгружаются при первом использовании.
+    Время импорта и бюджет холодного старта — coldstart.py."""
+    ensure_dirs()
+
+    app = FastAPI(title="Mapka API")
+    app.include_router(auth_router)
+    app.mount("/media", ImmutableStaticFiles(directory=MEDIA_DIR), name="media")
+    app.include_router(router)
+
+    app.add_middleware(CORSMiddlewareAll)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["X-Total-Count", "X-Next-Cursor"],
+    )
+
+    app.on_event("startup")(_startup)
+    app.on_event("shutdown")(_shutdown)
+    return app
+
+
+def __getattr__(name):
+    # `uvicorn main:app` — приложение собирается при первом обращении к main.app
+    if name == "app":
+        app = globals()["app"] = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if __name__ == "__main__":
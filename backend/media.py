@@ -0,0 +1,176 @@
+# media.py
+# Раздача /media и сгенерированных страниц с долгим кешем.
+#
+# Новые загрузки называются по хешу содержимого (<sha256[:20]>.<ext>),
+# поэтому URL меняется вместе с файлом и его можно кешировать навсегда.
+# Старые файлы (uuid-имена) получают ?v=<хеш> в versioned_url().
+#
+# Хеш файла считается при записи (remember_hash) или в пуле потоков: запрос
+# берёт только готовый хеш из кеша (cached_hash) и не читает файл в event loop.
+# Пока хеша нет — URL без ?v и ответ с ревалидацией вместо immutable.
+import os
+import re
+import asyncio
+import hashlib
+import urllib.parse
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import StaticFiles, NotModifiedResponse
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+
+FINGERPRINT_LEN = 20
+# <hash>.<ext> и производные <hash>_thumb.jpg / <hash>_w640.webp
+_FINGERPRINT_RE = re.compile(r"^([0-9a-f]{%d})(?:_[a-z0-9]+)?\.[A-Za-z0-9]+$" % FINGERPRINT_LEN)
+
+# Если перед API стоит nginx с internal location на MEDIA_DIR —
+# отдаём файл через X-Accel-Redirect (sendfile в nginx, воркер не читает файл).
+MEDIA_ACCEL_REDIRECT_PREFIX = os.getenv("MEDIA_ACCEL_REDIRECT_PREFIX", "").rstrip("/")
+
+# path -> (mtime_ns, size, sha256 hex)
+_hash_cache = {}
+# пути, чей хеш сейчас считается в пуле потоков
+_hashing = set()
+
+
+def content_fingerprint(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:FINGERPRINT_LEN]
+
+
+def file_hash(path: str):
+    """sha256 файла, кешируется по (mtime, size), чтобы не читать файл на каждый запрос."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    cached = _hash_cache.get(path)
+    if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    _hash_cache[path] = (st.st_mtime_ns, st.st_size, digest)
+    return digest
+
+
+def _hash_in_background(path: str) -> None:
+    try:
+        file_hash(path)
+    except OSError as e:
+        print("[WARN] file hash failed:", path, e)
+    finally:
+        _hashing.discard(path)
+
+
+def cached_hash(path: str):
+    """sha256 из кеша без чтения файла (только stat); нет в кеше — None и подсчёт в фоне.
+
+    Вне event loop (CLI, пул потоков) считает сразу, как file_hash().
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return file_hash(path)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    cached = _hash_cache.get(path)
+    if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+    if path not in _hashing:
+        _hashing.add(path)
+        loop.run_in_executor(None, _hash_in_background, path)
+    return None
+
+
+def remember_hash(path: str, data: bytes):
+    """Записываем хеш сразу при записи файла — первый запрос не будет его пересчитывать."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return
+    _hash_cache[path] = (st.st_mtime_ns, st.st_size, hashlib.sha256(data).hexdigest())
+
+
+def file_etag(path: str):
+    digest = cached_hash(path)
+    return f'"{digest[:32]}"' if digest else None
+
+
+def is_fingerprinted(name: str) -> bool:
+    return bool(_FINGERPRINT_RE.match(os.path.basename(name or "")))
+
+
+def versioned_url(url: str, media_dir: str, url_prefix: str = "/media") -> str:
+    """/media/<uuid>.jpg -> /media/<uuid>.jpg?v=<hash>; уже хешированные имена не трогаем."""
+    if not url or not url.startswith(url_prefix + "/") or "?" in url:
+        return url
+    name = url[len(url_prefix) + 1:]
+    if is_fingerprinted(name):
+        return url
+    digest = cached_hash(os.path.join(media_dir, name))
+    if not digest:
+        return url
+    return f"{url}?v={digest[:FINGERPRINT_LEN]}"
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """StaticFiles с immutable-кешем для хешированных URL и ETag по содержимому.
+
+    Range-запросы и pathsend (sendfile) обрабатывает сам FileResponse starlette.
+    """
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        request_headers = Headers(scope=scope)
+        name = os.path.basename(str(full_path))
+
+        fingerprinted = is_fingerprinted(name)
+        if not fingerprinted:
+            # ?v= — immutable, только если совпадает с текущим содержимым: иначе старая
+            # ссылка (или подобранный v) закрепила бы в кешах чужую версию файла навсегда
+            query = urllib.parse.parse_qs(scope.get("query_string", b"").decode("latin-1"))
+            v = (query.get("v") or [""])[0]
+            digest = cached_hash(str(full_path)) if v else None
+            fingerprinted = bool(digest) and v == digest[:FINGERPRINT_LEN]
+
+        headers = {
+            "cache-control": IMMUTABLE_CACHE_CONTROL if fingerprinted else REVALIDATE_CACHE_CONTROL,
+        }
+        m = _FINGERPRINT_RE.match(name)
+        if m and "_" not in name:
+            # имя и есть хеш содержимого — ETag бесплатный
+            headers["etag"] = f'"{m.group(1)}"'
+        else:
+            etag = file_etag(str(full_path))
+            if etag:
+                headers["etag"] = etag
+
+        if MEDIA_ACCEL_REDIRECT_PREFIX:
+            rel = os.path.relpath(str(full_path), str(self.directory))
+            headers["x-accel-redirect"] = f"{MEDIA_ACCEL_REDIRECT_PREFIX}/{rel}"
+            response = Response(status_code=status_code, headers=headers)
+            if self.is_not_modified(response.headers, request_headers):
+                return NotModifiedResponse(response.headers)
+            return response
+
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result, headers=headers)
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+def html_file_response(request, path: str, etag: str | None = None):
+    """Отдаёт сгенерированную HTML-страницу с ETag по содержимому и 304 на повторные запросы."""
+    etag = etag or file_etag(path)
+    headers = {"cache-control": REVALIDATE_CACHE_CONTROL}
+    if etag:
+        headers["etag"] = etag
+        inm = request.headers.get("if-none-match") or ""
+        if etag in [t.strip() for t in inm.split(",")] or inm.strip() == "*":
+            return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type="text/html", headers=headers)
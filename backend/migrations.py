@@ -0,0 +1,296 @@
+# migrations.py
+# Версионные миграции схемы (таблица schema_migrations) и проверка индексов.
+#
+# create_all() создаёт только новые таблицы — существующие не меняет, поэтому
+# индексы, добавленные в models.py позже, на рабочей БД появлялись лишь через
+# _create_missing_indexes, а тот строил их обычным CREATE INDEX: запись в таблицу
+# блокируется на всё время построения. Здесь индексы на существующие таблицы
+# строятся CREATE INDEX CONCURRENTLY (вне транзакции, без блокировки записи);
+# недостроенный (INVALID) индекс после сбоя удаляется и строится заново — если его
+# не строит сейчас другой сеанс (pg_stat_progress_create_index).
+#
+#   python migrations.py            # применить недостающие миграции
+#   python migrations.py --status   # что применено / что ждёт
+#   python migrations.py --check    # каких индексов моделей нет в БД (код 1, если есть)
+#
+# Миграции не переписываются после выката — изменения идут новой версией.
+# Одновременный запуск из нескольких процессов — через pg_advisory_lock.
+import os
+import sys
+import json
+import asyncio
+import argparse
+import datetime
+import contextlib
+from collections import namedtuple
+
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex
+
+from models import Base
+
+# для миграций в транзакции: не вставать в очередь за долгими запросами, держа блокировку
+MIGRATION_LOCK_TIMEOUT = os.getenv("MIGRATION_LOCK_TIMEOUT", "5s")
+# ключ pg_advisory_lock (произвольная константа проекта)
+_LOCK_KEY = 0x6D61706B61
+
+# concurrent=True — шаги выполняются вне транзакции (CREATE INDEX CONCURRENTLY),
+# запись о версии — после последнего шага; шаги обязаны быть идемпотентными.
+Migration = namedtuple("Migration", "version name steps concurrent")
+
+
+# шаг: (имя индекса | None, таблица | None, SQL)
+def index_step(name: str, table: str, columns: str) -> tuple:
+    return (name, table, f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns})")
+
+
+def sql_step(sql: str) -> tuple:
+    return (None, None, sql)
+
+
+MIGRATIONS = [
+    Migration(1, "clubs.address_id", [index_step("ix_clubs_address_id", "clubs", "address_id")], True),
+    Migration(2, "clubs.category", [index_step("ix_clubs_category", "clubs", "category")], True),
+    Migration(3, "schedules.club_id", [index_step("ix_schedules_club_id", "schedules", "club_id")], True),
+    Migration(4, "images.club_id", [index_step("ix_images_club_id", "images", "club_id")], True),
+    # отдельный (club_id) не нужен: club_id — ведущая колонка индекса страницы отзывов
+    Migration(5, "reviews.club_id", [
+        index_step("ix_reviews_club_created", "reviews", "club_id, created_at, id"),
+    ], True),
+    Migration(6, "blog_posts(status, published_at)", [
+        index_step("ix_blog_posts_status_published", "blog_posts", "status, published_at"),
+    ], True),
+]
+
+_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+)
+"""
+
+
+# ---- индексы ----
+
+async def _live_indexes(conn) -> dict:
+    """{имя индекса: valid} для текущей схемы."""
+    r = await conn.execute(text(
+        "SELECT c.relname, i.indisvalid FROM pg_index i "
+        "JOIN pg_class c ON c.oid = i.indexrelid "
+        "JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE n.nspname = current_schema()"
+    ))
+    return {name: valid for name, valid in r.all()}
+
+
+async def _live_tables(conn) -> set:
+    r = await conn.execute(text(
+        "SELECT tablename FROM pg_tables WHERE schemaname = current_schema()"
+    ))
+    return set(r.scalars())
+
+
+async def _building_pids(conn, name: str) -> list:
+    """pid сеансов, которые сейчас строят индекс name (INVALID до конца построения)."""
+    r = await conn.execute(text(
+        "SELECT p.pid FROM pg_stat_progress_create_index p "
+        "JOIN pg_class c ON c.oid = p.index_relid "
+        "JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE n.nspname = current_schema() AND c.relname = :name"
+    ), {"name": name})
+    return list(r.scalars())
+
+
+async def _build_index(conn, name: str, sql: str) -> bool:
+    """CONCURRENTLY в autocommit-соединении. True — индекс строился."""
+    live = await _live_indexes(conn)
+    if live.get(name) is True:
+        return False
+    if name in live:
+        pids = await _building_pids(conn, name)
+        if pids:
+            # не остаток сбоя, а чужое построение (не под нашим advisory lock) — не мешаем
+            raise RuntimeError(f"index {name} is being built by pid {', '.join(map(str, pids))}, retry later")
+        # остаток прерванного CONCURRENTLY: IF NOT EXISTS его бы пропустил
+        print(f"[WARN] index {name} is INVALID, rebuilding")
+        await conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"'))
+    print(f"[INFO] building index {name} (concurrently)")
+    await conn.execute(text(sql))
+    return True
+
+
+def model_indexes() -> dict:
+    """{имя: (таблица, CREATE INDEX CONCURRENTLY IF NOT EXISTS ...)} для индексов из models.py."""
+    out = {}
+    dialect = postgresql.dialect()
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            opts = index.dialect_options["postgresql"]
+            prev = opts["concurrently"]
+            opts["concurrently"] = True
+            try:
+                sql = str(CreateIndex(index, if_not_exists=True).compile(dialect=dialect)).strip()
+            finally:
+                opts["concurrently"] = prev
+            out[index.name] = (table.name, sql)
+    return out
+
+
+def expected_indexes() -> dict:
+    """{имя индекса: таблица} — объявленные в моделях и в миграциях."""
+    out = {name: table for name, (table, _sql) in model_indexes().items()}
+    for m in MIGRATIONS:
+        for name, table, _sql in m.steps:
+            if name is not None:
+                out.setdefault(name, table)
+    return out
+
+
+async def check_indexes(conn) -> dict:
+    """{"missing": [...], "invalid": [...]} — по таблицам, которые есть в БД."""
+    live = await _live_indexes(conn)
+    tables = await _live_tables(conn)
+    missing, invalid = [], []
+    for name, table in sorted(expected_indexes().items()):
+        if table not in tables:
+            continue
+        if name not in live:
+            missing.append(name)
+        elif not live[name]:
+            invalid.append(name)
+    return {"missing": missing, "invalid": invalid}
+
+
+# ---- миграции ----
+
+async def applied_versions(conn) -> dict:
+    if "schema_migrations" not in await _live_tables(conn):
+        return {}
+    r = await conn.execute(text("SELECT version, applied_at FROM schema_migrations"))
+    return {v: at for v, at in r.all()}
+
+
+async def _record(conn, m) -> None:
+    await conn.execute(
+        text("INSERT INTO schema_migrations (version, name) VALUES (:v, :n) ON CONFLICT (version) DO NOTHING"),
+        {"v": m.version, "n": m.name},
+    )
+
+
+async def _apply(engine, conn, m) -> None:
+    if m.concurrent:
+        for name, _table, sql in m.steps:
+            if name is not None:
+                await _build_index(conn, name, sql)
+            else:
+                await conn.execute(text(sql))
+        await _record(conn, m)
+        return
+    async with engine.begin() as tx:
+        await tx.execute(text(f"SET LOCAL lock_timeout = '{MIGRATION_LOCK_TIMEOUT}'"))
+        for _name, _table, sql in m.steps:
+            await tx.execute(text(sql))
+        await _record(tx, m)
+
+
+@contextlib.asynccontextmanager
+async def _locked(engine):
+    """autocommit-соединение под pg_advisory_lock: индексы и миграции строит один процесс."""
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("SELECT pg_advisory_lock(:k)"), {"k": _LOCK_KEY})
+        try:
+            yield conn
+        finally:
+            await conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _LOCK_KEY})
+
+
+async def migrate(engine, target: int | None = None) -> list:
+    """Применить миграции до target (по умолчанию все). Возвращает применённые версии."""
+    done = []
+    async with _locked(engine) as conn:
+        await conn.execute(text(_CREATE_TABLE))
+        applied = await applied_versions(conn)
+        tables = await _live_tables(conn)
+        for m in MIGRATIONS:
+            if m.version in applied or (target is not None and m.version > target):
+                continue
+            missing = {table for _name, table, _sql in m.steps if table} - tables
+            if missing:
+                # таблицы ещё нет (create_all не запускали) — индекс создастся вместе с ней
+                print(f"[WARN] migration {m.version} ({m.name}) skipped: no table {', '.join(sorted(missing))}")
+                break
+            await _apply(engine, conn, m)
+            print(f"[INFO] migration {m.version} applied: {m.name}")
+            done.append(m.version)
+    return done
+
+
+async def create_missing_model_indexes(engine) -> list:
+    """Индексы из models.py, которых нет в БД, — CONCURRENTLY (на таблицы, которые есть)."""
+    built = []
+    async with _locked(engine) as conn:
+        tables = await _live_tables(conn)
+        for name, (table, sql) in model_indexes().items():
+            if table not in tables:
+                continue
+            try:
+                if await _build_index(conn, name, sql):
+                    built.append(name)
+            except Exception as e:
+                print(f"[WARN] index {name} not built:", e)
+    return built
+
+
+async def startup_check(engine) -> None:
+    """Предупреждение в лог, если в БД нет ожидаемых индексов или ждут миграции."""
+    async with engine.connect() as conn:
+        res = await check_indexes(conn)
+        applied = await applied_versions(conn)
+    pending = [m.version for m in MIGRATIONS if m.version not in applied]
+    if res["missing"] or res["invalid"]:
+        print("[WARN] schema lacks expected indexes:",
+              ", ".join(res["missing"] + [f"{n} (INVALID)" for n in res["invalid"]]),
+              "— run `python migrations.py`")
+    if pending:
+        print(f"[WARN] pending schema migrations: {pending} — run `python migrations.py`")
+
+
+async def _main():
+    ap = argparse.ArgumentParser(description="Apply versioned schema migrations")
+    ap.add_argument("--status", action="store_true", help="print applied/pending migrations and exit")
+    ap.add_argument("--check", action="store_true", help="list expected indexes missing in the DB; exit 1 if any")
+    ap.add_argument("--target", type=int, default=None, help="apply up to this version")
+    args = ap.parse_args()
+
+    from db import engine
+
+    try:
+        if args.status or args.check:
+            async with engine.connect() as conn:
+                applied = await applied_versions(conn)
+                res = await check_indexes(conn)
+            if args.status:
+                print(json.dumps([
+                    {
+                        "version": m.version,
+                        "name": m.name,
+                        "applied_at": applied[m.version].isoformat() if m.version in applied else None,
+                    }
+                    for m in MIGRATIONS
+                ], ensure_ascii=False, indent=2))
+            if args.check:
+                print(json.dumps(res, ensure_ascii=False, indent=2))
+                return 1 if res["missing"] or res["invalid"] else 0
+            return 0
+        done = await migrate(engine, args.target)
+        print(f"[INFO] {len(done)} migration(s) applied at {datetime.datetime.now().isoformat(timespec='seconds')}")
+        return 0
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main()))
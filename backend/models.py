@@ -3,10 +3,10 @@ import uuid
 import datetime
 from sqlalchemy import (
     Column, String, Integer, Text, ForeignKey, DateTime, Float,
-    Boolean, SmallInteger, Time, JSON
+    Boolean, SmallInteger, Time, JSON, Index, UniqueConstraint, text
 )
-from sqlalchemy.dialects.postgresql import UUID, JSONB
-from sqlalchemy.orm import relationship, declarative_base
+from sqlalchemy.dialects.postgresql import UUID, JSONB, TSVECTOR
+from sqlalchemy.orm import relationship, declarative_base, deferred
 from sqlalchemy.ext.mutable import MutableList
 
 Base = declarative_base()
@@ -27,6 +27,11 @@ class Address(Base):
     # добавляем обратную связь: Address.clubs
     clubs = relationship("Club", back_populates="address", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # адреса без координат (geocode-missing / фоновый геокодинг)
+        Index("ix_addresses_missing_coords", "id", postgresql_where=text("lat IS NULL OR lon IS NULL")),
+    )
+
 class Teacher(Base):
     __tablename__ = "teachers"
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
@@ -69,11 +74,38 @@ class Club(Base):
     # ✅ pricing items (multiple tariffs) stored as JSONB list
     pricing = Column(MutableList.as_mutable(JSONB), nullable=True, default=list)
 
+    # агрегаты отзывов (ratings.py): обновляются вместе с INSERT отзыва
+    rating_count = Column(Integer, nullable=True, default=0)
+    rating_sum = Column(Integer, nullable=True, default=0)
+    rating_avg = Column(Float, nullable=True)
+
     images = relationship("Image", back_populates="club", cascade="all, delete-orphan")
-    reviews = relationship("Review", back_populates="club", cascade="all, delete-orphan")
+    # удаление кружка: отзывы удаляет БД (ON DELETE CASCADE), без загрузки их в сессию
+    reviews = relationship("Review", back_populates="club", cascade="all, delete-orphan", passive_deletes=True)
     schedules = relationship("Schedule", back_populates="club", cascade="all, delete-orphan")
     teacher = relationship("Teacher")
 
+    __table_args__ = (
+        # поиск занятых slug'ов по префиксу (slug LIKE 'base-%')
+        Index("ix_clubs_slug_prefix", "slug", postgresql_ops={"slug": "varchar_pattern_ops"}),
+        # кружки без координат (geocode-missing / фоновый геокодинг)
+        Index("ix_clubs_missing_coords", "id", postgresql_where=text("lat IS NULL OR lon IS NULL")),
+        # инкрементальное обновление каталога в памяти: updated_at >= водяной знак
+        Index("ix_clubs_updated_at", "updated_at"),
+        # FK на addresses (JOIN карточки, удаление адреса) и фасет category в списке;
+        # на существующей БД создаются миграцией CONCURRENTLY (migrations.py)
+        Index("ix_clubs_address_id", "address_id"),
+        Index("ix_clubs_category", "category"),
+    )
+
+
+class ClubTombstone(Base):
+    """Удалённые кружки — чтобы каталог в памяти (catalog.py) убрал их без полной перезагрузки."""
+    __tablename__ = "club_tombstones"
+    club_id = Column(UUID(as_uuid=True), primary_key=True)
+    slug = Column(String(255), nullable=True)
+    deleted_at = Column(DateTime(timezone=True), default=datetime.datetime.utcnow, index=True)
+
 class Image(Base):
     __tablename__ = "images"
     id = Column(UUID(as_uuid=True), primary_key=True, default=gen_uuid)
@@ -83,6 +115,22 @@ class Image(Base):
     is_cover = Column(Boolean, default=False)
     club = relationship("Club", back_populates="images")
 
+    __table_args__ = (
+        # selectinload(Club.images) и ON DELETE CASCADE от clubs
+        Index("ix_images_club_id", "club_id"),
+    )
+
+
+# int4range [начало, конец) в минутах от полуночи. То же выражение стоит в GiST-индексе
+# ix_schedules_slot_range — запросы (schedule_search.py) берут его отсюда, иначе индекс
+# не сработает. Без end_time или при end <= start (через полночь) — слот в одну минуту.
+_SCHEDULE_START_MIN = "(extract(epoch from start_time) / 60)::int"
+_SCHEDULE_END_MIN = "(extract(epoch from end_time) / 60)::int"
+SCHEDULE_RANGE_SQL = (
+    f"int4range({_SCHEDULE_START_MIN}, "
+    f"greatest(coalesce({_SCHEDULE_END_MIN}, {_SCHEDULE_START_MIN} + 1), {_SCHEDULE_START_MIN} + 1), '[)')"
+)
+
 
 class Schedule(Base):
     __tablename__ = "schedules"
@@ -94,6 +142,14 @@ class Schedule(Base):
     note = Column(Text, nullable=True)
     club = relationship("Club", back_populates="schedules")
 
+    __table_args__ = (
+        # "что идёт в субботу": weekday = X [AND start_time ...]
+        Index("ix_schedules_weekday_start", "weekday", "start_time"),
+        Index("ix_schedules_club_id", "club_id"),
+        # пересечение/вложенность слота с интервалом времени: && / <@
+        Index("ix_schedules_slot_range", text(SCHEDULE_RANGE_SQL), postgresql_using="gist"),
+    )
+
 
 class Review(Base):
     __tablename__ = "reviews"
@@ -105,6 +161,11 @@ class Review(Base):
     created_at = Column(DateTime(timezone=True), default=datetime.datetime.utcnow)
     club = relationship("Club", back_populates="reviews")
 
+    __table_args__ = (
+        # страница отзывов кружка: WHERE club_id = ? ORDER BY created_at DESC, id DESC
+        Index("ix_reviews_club_created", "club_id", "created_at", "id"),
+    )
+
 class User(Base):
     __tablename__ = "users"
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
@@ -147,3 +208,79 @@ class BlogPost(Base):
     created_at = Column(DateTime(timezone=True), default=datetime.datetime.utcnow)
     updated_at = Column(DateTime(timezone=True), default=datetime.datetime.utcnow)
 
+    # полнотекстовый индекс (см. blog_search.py); в ORM не грузим
+    search_vector = deferred(Column(TSVECTOR, nullable=True))
+
+    # пререндер статьи (см. blog_render.py), пересчитывается при сохранении
+    rendered_html = Column(Text, nullable=True)
+    rendered_toc = Column(JSONB, nullable=True)
+    reading_time_min = Column(Integer, nullable=True)
+    faq_jsonld = Column(JSONB, nullable=True)
+    render_revision = Column(String(64), nullable=True)
+
+    __table_args__ = (
+        # фильтр по тегам в публичном списке: tags @> '["x"]' / tags ?| array[...]
+        Index("ix_blog_posts_tags_gin", "tags", postgresql_using="gin"),
+        Index("ix_blog_posts_search_gin", "search_vector", postgresql_using="gin"),
+        Index("ix_blog_posts_slug_prefix", "slug", postgresql_ops={"slug": "varchar_pattern_ops"}),
+        # публичная лента: status = 'published' ORDER BY published_at DESC
+        Index("ix_blog_posts_status_published", "status", "published_at"),
+    )
+
+
+class SlugHistory(Base):
+    """Старые slug'и кружков и статей — для 301-редиректов после переименования."""
+    __tablename__ = "slug_history"
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    # club | blog
+    entity_type = Column(String(20), nullable=False)
+    entity_id = Column(UUID(as_uuid=True), nullable=False, index=True)
+    old_slug = Column(String(255), nullable=False)
+    created_at = Column(DateTime(timezone=True), default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("entity_type", "old_slug", name="uq_slug_history_type_slug"),
+        # поиск занятых slug'ов по префиксу (slug LIKE 'base-%')
+        Index("ix_slug_history_prefix", "entity_type", "old_slug", postgresql_ops={"old_slug": "varchar_pattern_ops"}),
+    )
+
+
+class GeocodeCache(Base):
+    """Результаты геокодера по нормализованному адресу (в т.ч. "не найдено")."""
+    __tablename__ = "geocode_cache"
+    addr_norm = Column(Text, primary_key=True)
+    query = Column(Text, nullable=False)
+    # ok | not_found
+    status = Column(String(20), nullable=False, default="ok")
+    lat = Column(Float, nullable=True)
+    lon = Column(Float, nullable=True)
+    provider = Column(String(50), nullable=True)
+    created_at = Column(DateTime(timezone=True), default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime(timezone=True), default=datetime.datetime.utcnow)
+
+
+class Job(Base):
+    """Очередь фоновых задач (см. jobs.py)."""
+    __tablename__ = "jobs"
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    kind = Column(String(50), nullable=False)
+    payload = Column(JSONB, nullable=True)
+    dedup_key = Column(String(255), nullable=True)
+    # queued | running | done | failed
+    status = Column(String(20), nullable=False, default="queued")
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    run_at = Column(DateTime(timezone=True), nullable=False, default=datetime.datetime.utcnow)
+    locked_at = Column(DateTime(timezone=True), nullable=True)
+    locked_by = Column(String(255), nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime(timezone=True), default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        # выборка воркером: status = 'queued' AND run_at <= now() ORDER BY run_at
+        Index("ix_jobs_queued_run_at", "run_at", postgresql_where=text("status = 'queued'")),
+        # дедупликация: не больше одной queued-задачи на ключ
+        Index("uq_jobs_queued_dedup", "dedup_key", unique=True,
+              postgresql_where=text("status = 'queued' AND dedup_key IS NOT NULL")),
+    )
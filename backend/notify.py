@@ -0,0 +1,140 @@
+# notify.py
+# Межпроцессная инвалидация кэшей через Postgres LISTEN/NOTIFY.
+#
+# Запись (кружок, статья, рейтинг) вызывает publish() в своей транзакции —
+# Postgres доставит NOTIFY всем слушателям только после COMMIT. Каждый воркер
+# uvicorn держит отдельное соединение с LISTEN и вызывает подписчиков
+# (subscribe()), которые сбрасывают локальные кэши. Свои же события процесс
+# пропускает: он уже сбросил кэш сам, синхронно после записи.
+#
+# Соединение пропало — flush_all() (события могли потеряться) и переподключение
+# с экспоненциальной задержкой; после переподключения — ещё один flush_all().
+import os
+import json
+import random
+import socket
+import asyncio
+
+from sqlalchemy import text
+
+from db import DATABASE_URL
+
+CHANGES_CHANNEL = os.getenv("CHANGES_CHANNEL", "mapka_changes")
+NOTIFY_LISTENER = os.getenv("NOTIFY_LISTENER", "on").strip().lower() not in ("0", "off", "false", "no")
+HEALTHCHECK_SECONDS = 30
+
+SOURCE_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# entity_type -> [fn(entity_id | None, version | None)]; entity_id=None — "все записи этого типа"
+_subscribers = {}
+_flushers = []
+_task = None
+
+stats = {"received": 0, "skipped_own": 0, "reconnects": 0, "flushes": 0, "connected": False}
+
+
+async def publish(session, entity_type: str, entity_id=None, version=None) -> None:
+    """NOTIFY в транзакции session: уйдёт слушателям только если транзакция закоммитится."""
+    payload = json.dumps({
+        "t": entity_type,
+        "id": str(entity_id) if entity_id is not None else None,
+        "v": version.isoformat() if hasattr(version, "isoformat") else version,
+        "src": SOURCE_ID,
+    })
+    await session.execute(text("SELECT pg_notify(:ch, :payload)"), {"ch": CHANGES_CHANNEL, "payload": payload})
+
+
+def subscribe(entity_type: str, fn) -> None:
+    _subscribers.setdefault(entity_type, []).append(fn)
+
+
+def on_flush(fn) -> None:
+    """fn() — полный сброс локального кэша (после потери соединения)."""
+    _flushers.append(fn)
+
+
+def flush_all() -> None:
+    stats["flushes"] += 1
+    for fn in _flushers:
+        try:
+            fn()
+        except Exception as e:
+            print("[WARN] cache flush failed:", e)
+
+
+def _dispatch(raw: str) -> None:
+    stats["received"] += 1
+    try:
+        msg = json.loads(raw)
+    except ValueError:
+        return
+    if msg.get("src") == SOURCE_ID:
+        stats["skipped_own"] += 1
+        return
+    for fn in _subscribers.get(msg.get("t"), ()):
+        try:
+            fn(msg.get("id"), msg.get("v"))
+        except Exception as e:
+            print("[WARN] change subscriber failed:", e)
+
+
+def _dsn() -> str:
+    return DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://", 1)
+
+
+async def _listen_forever():
+    import asyncpg
+
+    backoff = 0.5
+    first = True
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(_dsn())
+            lost = asyncio.Event()
+            conn.add_termination_listener(lambda c: lost.set())
+            await conn.add_listener(CHANGES_CHANNEL, lambda c, pid, ch, payload: _dispatch(payload))
+            stats["connected"] = True
+            if not first:
+                # пока нас не было, события могли пройти мимо
+                flush_all()
+            first = False
+            backoff = 0.5
+            while not lost.is_set():
+                try:
+                    await asyncio.wait_for(lost.wait(), timeout=HEALTHCHECK_SECONDS)
+                except asyncio.TimeoutError:
+                    await asyncio.wait_for(conn.execute("SELECT 1"), timeout=5)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print("[WARN] change listener disconnected:", e)
+        finally:
+            stats["connected"] = False
+            if conn is not None and not conn.is_closed():
+                try:
+                    await conn.close(timeout=2)
+                except Exception:
+                    pass
+
+        stats["reconnects"] += 1
+        flush_all()
+        await asyncio.sleep(backoff * (1 + random.random() / 2))
+        backoff = min(backoff * 2, 30.0)
+
+
+def start() -> None:
+    global _task
+    if NOTIFY_LISTENER and _task is None:
+        _task = asyncio.get_running_loop().create_task(_listen_forever())
+
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
@@ -0,0 +1,106 @@
+# ratings.py
+# Средняя оценка и число отзывов кружка — хранятся в clubs (rating_avg, rating_count).
+#
+# Новый отзыв меняет агрегаты в той же транзакции, что и INSERT (apply_ratings):
+# UPDATE ... SET rating_count = rating_count + n — атомарно, без чтения всех отзывов.
+# rating_sum хранится рядом, чтобы среднее пересчитывалось точно. Раз в
+# RATING_RECONCILE_HOURS задача ratings.reconcile сверяет агрегаты с таблицей
+# reviews (удаления вручную, старые данные до появления колонок).
+#
+# updated_at кружка агрегаты не трогают: иначе каждый отзыв выглядел бы правкой
+# кружка (пересчёт "Кружков по теме", lastmod в sitemap). Об изменении рейтинга
+# сообщает отдельное событие NOTIFY "rating" (publish) — по нему каталог в памяти
+# перечитывает карточки с другим rating_count/rating_sum, а не по updated_at.
+import os
+
+from sqlalchemy import select, update, func, bindparam, exists, or_
+
+from models import Club, Review
+import jobs
+import notify
+
+RATING_RECONCILE_HOURS = float(os.getenv("RATING_RECONCILE_HOURS", "24"))
+
+_clubs = Club.__table__
+
+
+def rating_out(c) -> dict:
+    """Поля рейтинга для ответа API."""
+    avg = getattr(c, "rating_avg", None)
+    return {
+        "rating_avg": round(float(avg), 2) if avg is not None else None,
+        "rating_count": getattr(c, "rating_count", None) or 0,
+    }
+
+
+async def apply_ratings(session, deltas: dict) -> None:
+    """deltas: {club_id: (число оценок, сумма оценок)} — одним executemany-UPDATE."""
+    params = [{"cid": cid, "n": n, "total": total} for cid, (n, total) in deltas.items() if n]
+    if not params:
+        return
+    count = func.coalesce(_clubs.c.rating_count, 0) + bindparam("n")
+    total = func.coalesce(_clubs.c.rating_sum, 0) + bindparam("total")
+    await session.execute(
+        update(_clubs)
+        .where(_clubs.c.id == bindparam("cid"))
+        .values(
+            rating_count=count,
+            rating_sum=total,
+            rating_avg=total * 1.0 / count,
+        ),
+        params,
+    )
+
+
+async def publish(session, club_ids=None) -> None:
+    """NOTIFY "rating" в транзакции session; None — сверить рейтинги всех кружков."""
+    if club_ids is None:
+        await notify.publish(session, "rating")
+        return
+    for cid in club_ids:
+        await notify.publish(session, "rating", cid)
+
+
+async def reconcile(session) -> int:
+    """Сверить агрегаты с reviews. Возвращает число исправленных кружков (коммитит вызывающий)."""
+    agg = (
+        select(
+            Review.club_id.label("club_id"),
+            func.count(Review.rating).label("n"),
+            func.sum(Review.rating).label("total"),
+        )
+        .where(Review.rating.isnot(None))
+        .group_by(Review.club_id)
+        .subquery()
+    )
+    r1 = await session.execute(
+        update(_clubs)
+        .where(
+            _clubs.c.id == agg.c.club_id,
+            or_(
+                _clubs.c.rating_count.is_distinct_from(agg.c.n),
+                _clubs.c.rating_sum.is_distinct_from(agg.c.total),
+                _clubs.c.rating_avg.is_(None),
+            ),
+        )
+        .values(rating_count=agg.c.n, rating_sum=agg.c.total, rating_avg=agg.c.total * 1.0 / agg.c.n)
+    )
+    rated = exists().where(Review.club_id == _clubs.c.id, Review.rating.isnot(None))
+    r2 = await session.execute(
+        update(_clubs)
+        .where(
+            ~rated,
+            or_(
+                _clubs.c.rating_count.is_distinct_from(0),
+                _clubs.c.rating_sum.is_distinct_from(0),
+                _clubs.c.rating_avg.isnot(None),
+            ),
+        )
+        .values(rating_count=0, rating_sum=0, rating_avg=None)
+    )
+    return (r1.rowcount or 0) + (r2.rowcount or 0)
+
+
+async def schedule_reconcile(session, delay: float = 0) -> None:
+    """Поставить сверку в очередь (повторяет себя раз в RATING_RECONCILE_HOURS)."""
+    await jobs.enqueue(session, "ratings.reconcile", {}, dedup_key="ratings.reconcile", delay=delay)
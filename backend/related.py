@@ -0,0 +1,439 @@
+# related.py
+# Индекс "Читайте также" / "Кружки по теме" для статей блога.
+#
+# Похожесть = TF-IDF косинус по тексту + Жаккар по тегам + совпадение категории.
+# Индекс живёт в памяти процесса: полная сборка при первом обращении к статье
+# (related.get — воркер, не отдающий блог, не читает все статьи и кружки на
+# старте) и раз в RELATED_REBUILD_SECONDS, при сохранении статьи/кружка
+# пересчитываются только затронутые списки. Публичный эндпоинт читает готовый
+# список по slug — O(1).
+#
+# Пересчёт соседей (проход по всем статьям) идёт в потоке, правки индекса — по
+# одной (_write_lock). Полная сборка читает БД до начала сборки: правки, пришедшие
+# во время неё, запоминаются и повторяются поверх нового индекса после подмены.
+import os
+import re
+import math
+import asyncio
+from collections import defaultdict
+
+from sqlalchemy import select
+
+from db import AsyncSessionLocal
+from models import BlogPost, Club
+from blog_search import blocks_plain_text
+
+RELATED_TOP_N = int(os.getenv("RELATED_TOP_N", "4"))
+RELATED_REBUILD_SECONDS = int(os.getenv("RELATED_REBUILD_SECONDS", "900"))
+
+W_TEXT, W_TAGS, W_CATEGORY = 0.6, 0.3, 0.1
+MIN_SCORE = 0.05
+
+_TOKEN_RE = re.compile(r"[a-zа-яё0-9]+", re.I)
+_STOPWORDS = {
+    "и", "в", "во", "на", "с", "со", "по", "для", "не", "что", "как", "это", "или", "из", "от",
+    "до", "за", "при", "так", "же", "бы", "ли", "уже", "его", "она", "они", "мы", "вы", "вас",
+    "нас", "все", "всё", "был", "была", "были", "быть", "есть", "если", "чтобы", "когда",
+    "где", "кто", "the", "and", "for", "with",
+}
+# грубый стемминг: отрезаем частые окончания, чтобы "кружок/кружки/кружков" совпадали
+_ENDINGS = sorted([
+    "иями", "ями", "ами", "ией", "иям", "ием", "ого", "его", "ому", "ему", "ыми", "ими",
+    "ая", "яя", "ое", "ее", "ые", "ие", "ый", "ий", "ой", "ей", "ам", "ям", "ах", "ях",
+    "ом", "ем", "ов", "ев", "ую", "юю", "ия", "ии", "ию",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+], key=len, reverse=True)
+
+
+def _stem(w: str) -> str:
+    for end in _ENDINGS:
+        if w.endswith(end) and len(w) - len(end) >= 4:
+            return w[: -len(end)]
+    return w
+
+
+def tokenize(text: str):
+    out = []
+    for w in _TOKEN_RE.findall((text or "").lower().replace("ё", "е")):
+        if len(w) < 3 or w in _STOPWORDS:
+            continue
+        out.append(_stem(w))
+    return out
+
+
+def _norm_tags(tags):
+    return {str(t).strip().lower() for t in (tags or []) if str(t).strip()}
+
+
+class _Doc:
+    __slots__ = ("key", "slug", "tags", "category", "terms", "vec", "card")
+
+    def __init__(self, key, slug, text, tags, category, card):
+        self.key = key
+        self.slug = slug
+        self.tags = _norm_tags(tags)
+        self.category = (category or "").strip().lower()
+        self.terms = defaultdict(int)
+        for t in tokenize(text):
+            self.terms[t] += 1
+        self.vec = {}
+        self.card = card
+
+
+class RelatedIndex:
+    def __init__(self):
+        self.posts = {}   # post id -> _Doc
+        self.clubs = {}   # club id -> _Doc
+        self.df = defaultdict(int)
+        self.n_docs = 0
+        # inverted index: term -> {doc key: weight}
+        self.post_postings = defaultdict(dict)
+        self.club_postings = defaultdict(dict)
+        # результат: post slug -> {"posts": [...], "clubs": [...]}
+        self.related = {}
+        self._scores = {}  # post id -> ([(score, post id)], [(score, club id)])
+        self.ready = False
+        self._task = None
+        # None — сборки нет; иначе {("post"|"club", id)}, обновлённые во время сборки
+        self._pending = None
+
+    # ---------- математика ----------
+
+    def _idf(self, term):
+        return math.log((1 + self.n_docs) / (1 + self.df.get(term, 0))) + 1.0
+
+    def _vectorize(self, doc):
+        vec = {t: (1 + math.log(tf)) * self._idf(t) for t, tf in doc.terms.items()}
+        norm = math.sqrt(sum(v * v for v in vec.values())) or 1.0
+        doc.vec = {t: v / norm for t, v in vec.items()}
+
+    @staticmethod
+    def _meta_score(a, b):
+        tags = len(a.tags & b.tags) / len(a.tags | b.tags) if (a.tags and b.tags) else 0.0
+        cat = 1.0 if a.category and a.category == b.category else 0.0
+        return W_TAGS * tags + W_CATEGORY * cat
+
+    def _pair_score(self, a, b):
+        small, big = (a.vec, b.vec) if len(a.vec) <= len(b.vec) else (b.vec, a.vec)
+        cos = sum(v * big.get(t, 0.0) for t, v in small.items())
+        return W_TEXT * cos + self._meta_score(a, b)
+
+    def _rank(self, doc, pool, postings, exclude=None):
+        """Топ-N из pool для doc: косинус через inverted index + теги/категория."""
+        acc = defaultdict(float)
+        for t, w in doc.vec.items():
+            for key, w2 in postings.get(t, {}).items():
+                acc[key] += w * w2
+        # кандидаты без общих слов, но с общими тегами/категорией
+        for key, other in pool.items():
+            if key not in acc and ((doc.tags & other.tags) or (doc.category and doc.category == other.category)):
+                acc[key] = 0.0
+        scored = []
+        for key, cos in acc.items():
+            if key == exclude:
+                continue
+            s = W_TEXT * cos + self._meta_score(doc, pool[key])
+            if s >= MIN_SCORE:
+                scored.append((s, key))
+        scored.sort(key=lambda x: x[0], reverse=True)
+        return scored[:RELATED_TOP_N]
+
+    # ---------- индексирование ----------
+
+    def _add_postings(self, doc, postings):
+        for t, w in doc.vec.items():
+            postings[t][doc.key] = w
+
+    def _count(self, doc, sign):
+        """df и n_docs: sign=1 — документ добавлен, -1 — убран (или заменяется новой версией)."""
+        self.n_docs += sign
+        for t in doc.terms:
+            n = self.df.get(t, 0) + sign
+            if n > 0:
+                self.df[t] = n
+            else:
+                self.df.pop(t, None)
+
+    def _drop_postings(self, doc, postings):
+        for t in doc.vec:
+            p = postings.get(t)
+            if p is not None:
+                p.pop(doc.key, None)
+                if not p:
+                    postings.pop(t, None)
+
+    def _publish(self, post_id):
+        doc = self.posts.get(post_id)
+        if doc is None:
+            return
+        post_scores, club_scores = self._scores.get(post_id, ([], []))
+        self.related[doc.slug] = {
+            "posts": [self.posts[k].card for _, k in post_scores if k in self.posts],
+            "clubs": [self.clubs[k].card for _, k in club_scores if k in self.clubs],
+        }
+
+    def build(self, posts, clubs):
+        """Полная сборка (вызывается в потоке, результат подменяет текущее состояние)."""
+        fresh = RelatedIndex()
+        for d in posts + clubs:
+            for t in d.terms:
+                fresh.df[t] += 1
+        fresh.n_docs = len(posts) + len(clubs)
+        for d in posts:
+            fresh._vectorize(d)
+            fresh.posts[d.key] = d
+            fresh._add_postings(d, fresh.post_postings)
+        for d in clubs:
+            fresh._vectorize(d)
+            fresh.clubs[d.key] = d
+            fresh._add_postings(d, fresh.club_postings)
+        for d in posts:
+            fresh._scores[d.key] = (
+                fresh._rank(d, fresh.posts, fresh.post_postings, exclude=d.key),
+                fresh._rank(d, fresh.clubs, fresh.club_postings),
+            )
+            fresh._publish(d.key)
+        return fresh
+
+    def _swap(self, fresh):
+        self.posts, self.clubs = fresh.posts, fresh.clubs
+        self.df, self.n_docs = fresh.df, fresh.n_docs
+        self.post_postings, self.club_postings = fresh.post_postings, fresh.club_postings
+        self._scores, self.related = fresh._scores, fresh.related
+        self.ready = True
+
+    def upsert_post(self, doc):
+        old = self.posts.pop(doc.key, None)
+        if old is not None:
+            self._drop_postings(old, self.post_postings)
+            self.related.pop(old.slug, None)
+            self._count(old, -1)
+        self._count(doc, 1)
+        self._vectorize(doc)
+        self.posts[doc.key] = doc
+        self._add_postings(doc, self.post_postings)
+
+        self._scores[doc.key] = (
+            self._rank(doc, self.posts, self.post_postings, exclude=doc.key),
+            self._rank(doc, self.clubs, self.club_postings),
+        )
+        self._publish(doc.key)
+
+        # соседи: либо doc уже был в их списке (пересчёт), либо теперь может туда попасть
+        for pid, other in self.posts.items():
+            if pid == doc.key:
+                continue
+            post_scores, club_scores = self._scores.get(pid, ([], []))
+            if any(k == doc.key for _, k in post_scores):
+                post_scores = self._rank(other, self.posts, self.post_postings, exclude=pid)
+            else:
+                s = self._pair_score(other, doc)
+                if s >= MIN_SCORE and (len(post_scores) < RELATED_TOP_N or s > post_scores[-1][0]):
+                    post_scores = sorted(post_scores + [(s, doc.key)], key=lambda x: x[0], reverse=True)[:RELATED_TOP_N]
+                else:
+                    continue
+            self._scores[pid] = (post_scores, club_scores)
+            self._publish(pid)
+
+    def remove_post(self, post_id):
+        old = self.posts.pop(post_id, None)
+        if old is None:
+            return
+        self._drop_postings(old, self.post_postings)
+        self._count(old, -1)
+        self.related.pop(old.slug, None)
+        self._scores.pop(post_id, None)
+        for pid, other in self.posts.items():
+            post_scores, club_scores = self._scores.get(pid, ([], []))
+            if any(k == post_id for _, k in post_scores):
+                self._scores[pid] = (self._rank(other, self.posts, self.post_postings, exclude=pid), club_scores)
+                self._publish(pid)
+
+    def upsert_club(self, doc):
+        old = self.clubs.pop(doc.key, None)
+        if old is not None:
+            self._drop_postings(old, self.club_postings)
+            self._count(old, -1)
+        self._count(doc, 1)
+        self._vectorize(doc)
+        self.clubs[doc.key] = doc
+        self._add_postings(doc, self.club_postings)
+
+        for pid, post in self.posts.items():
+            post_scores, club_scores = self._scores.get(pid, ([], []))
+            if any(k == doc.key for _, k in club_scores):
+                club_scores = self._rank(post, self.clubs, self.club_postings)
+            else:
+                s = self._pair_score(post, doc)
+                if s >= MIN_SCORE and (len(club_scores) < RELATED_TOP_N or s > club_scores[-1][0]):
+                    club_scores = sorted(club_scores + [(s, doc.key)], key=lambda x: x[0], reverse=True)[:RELATED_TOP_N]
+                else:
+                    continue
+            self._scores[pid] = (post_scores, club_scores)
+            self._publish(pid)
+
+    def remove_club(self, club_id):
+        old = self.clubs.pop(club_id, None)
+        if old is None:
+            return
+        self._drop_postings(old, self.club_postings)
+        self._count(old, -1)
+        for pid, post in self.posts.items():
+            post_scores, club_scores = self._scores.get(pid, ([], []))
+            if any(k == club_id for _, k in club_scores):
+                self._scores[pid] = (post_scores, self._rank(post, self.clubs, self.club_postings))
+                self._publish(pid)
+
+    def get(self, slug):
+        return self.related.get(slug) or {"posts": [], "clubs": []}
+
+
+def post_doc(p):
+    text = " ".join([
+        p.title or "", p.title or "", p.excerpt or "", p.category or "",
+        " ".join(str(t) for t in (p.tags or [])),
+        p.content or "", blocks_plain_text(p.content_blocks),
+    ])
+    card = {
+        "slug": p.slug,
+        "title": p.title,
+        "excerpt": p.excerpt,
+        "cover_image": p.cover_image,
+        "published_at": p.published_at.isoformat() if p.published_at else None,
+    }
+    return _Doc(str(p.id), p.slug, text, p.tags, p.category, card)
+
+
+def club_doc(c):
+    text = " ".join([
+        c.name or "", c.name or "", c.category or "",
+        " ".join(str(t) for t in (c.tags or [])),
+        c.description or "",
+    ])
+    card = {
+        "slug": c.slug,
+        "name": c.name,
+        "category": c.category or "",
+        "image": c.main_image_url or "",
+    }
+    return _Doc(str(c.id), c.slug, text, c.tags, c.category, card)
+
+
+_POST_COLUMNS = (
+    BlogPost.id, BlogPost.slug, BlogPost.title, BlogPost.excerpt, BlogPost.content,
+    BlogPost.content_blocks, BlogPost.category, BlogPost.tags, BlogPost.cover_image,
+    BlogPost.published_at,
+)
+_CLUB_COLUMNS = (
+    Club.id, Club.slug, Club.name, Club.description, Club.category, Club.tags, Club.main_image_url,
+)
+
+
+index = RelatedIndex()
+# правки индекса (в потоке) и подмена после сборки — строго по одной
+_write_lock = asyncio.Lock()
+_rebuild_lock = asyncio.Lock()
+
+
+async def rebuild():
+    async with _rebuild_lock:
+        index._pending = set()
+        try:
+            async with AsyncSessionLocal() as session:
+                rp = await session.execute(select(*_POST_COLUMNS).where(BlogPost.status == "published"))
+                rc = await session.execute(select(*_CLUB_COLUMNS))
+                post_rows, club_rows = rp.all(), rc.all()
+
+            def _build():
+                return index.build([post_doc(r) for r in post_rows], [club_doc(r) for r in club_rows])
+
+            fresh = await asyncio.to_thread(_build)
+            async with _write_lock:
+                index._swap(fresh)
+            pending = index._pending
+        finally:
+            index._pending = None
+        # удалённые/снятые с публикации во время сборки не должны вернуться до следующей
+        for kind, key in pending:
+            await (refresh_post if kind == "post" else refresh_club)(key)
+
+
+async def refresh_post(post_id):
+    if index._pending is not None:
+        index._pending.add(("post", post_id))
+    async with AsyncSessionLocal() as session:
+        r = await session.execute(select(*_POST_COLUMNS, BlogPost.status).where(BlogPost.id == post_id))
+        row = r.first()
+    async with _write_lock:
+        if row is None or row.status != "published":
+            await asyncio.to_thread(index.remove_post, str(post_id))
+        else:
+            await asyncio.to_thread(lambda: index.upsert_post(post_doc(row)))
+
+
+async def refresh_club(club_id):
+    if index._pending is not None:
+        index._pending.add(("club", club_id))
+    async with AsyncSessionLocal() as session:
+        r = await session.execute(select(*_CLUB_COLUMNS).where(Club.id == club_id))
+        row = r.first()
+    async with _write_lock:
+        if row is None:
+            await asyncio.to_thread(index.remove_club, str(club_id))
+        else:
+            await asyncio.to_thread(lambda: index.upsert_club(club_doc(row)))
+
+
+def _spawn(coro):
+    """Фоновое обновление после записи — ответ API его не ждёт."""
+    async def _run():
+        try:
+            await coro
+        except Exception as e:
+            print("[WARN] related index refresh failed:", e)
+    return asyncio.get_running_loop().create_task(_run())
+
+
+def schedule_post_refresh(post_id):
+    # индекс ещё не собирался — соберётся целиком при первом обращении
+    return _spawn(refresh_post(post_id)) if index._task is not None else None
+
+
+def schedule_club_refresh(club_id):
+    return _spawn(refresh_club(club_id)) if index._task is not None else None
+
+
+def schedule_rebuild():
+    """Полный пересчёт после пакетной записи (импорт) — вместо refresh на каждую запись."""
+    return _spawn(rebuild()) if index._task is not None else None
+
+
+async def _maintain():
+    while True:
+        try:
+            await rebuild()
+        except Exception as e:
+            print("[WARN] related index rebuild failed:", e)
+        await asyncio.sleep(RELATED_REBUILD_SECONDS)
+
+
+def start():
+    if index._task is None:
+        index._task = asyncio.get_running_loop().create_task(_maintain())
+
+
+def get(slug):
+    """Списки для статьи. Первый вызов запускает сборку индекса (до её окончания — пустые)."""
+    if index._task is None:
+        start()
+    return index.get(slug)
+
+
+async def stop():
+    task, index._task = index._task, None
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except (asyncio.CancelledError, Exception):
+            pass
@@ -0,0 +1,269 @@
+# review_intake.py
+# Приём отзывов с отложенной записью (write-behind) и защитой от спама.
+#
+# Публичный POST отзыва не держит соединение с БД: проверка полей, лимит
+# (token bucket по IP и по кружку), затем отзыв с заранее выданными id/created_at
+# кладётся в asyncio.Queue и API сразу отвечает 202. Фоновая задача забирает
+# очередь пачками (до REVIEW_BATCH или раз в REVIEW_FLUSH_MS) и пишет пачку одной
+# транзакцией: FOR KEY SHARE по кружкам (удалённые отбрасываются), один
+# INSERT ... RETURNING, один apply_ratings на всю пачку, NOTIFY "rating".
+#
+# Отзыв между ответом API и записью пачки живёт только в памяти процесса: при
+# остановке stop() дописывает очередь, при падении процесса хвост теряется.
+# REVIEW_WRITE_BEHIND=0 — прежняя синхронная запись (crud.create_review_for_club).
+# Лимиты — на процесс: при N воркерах фактический лимит в N раз выше.
+import os
+import re
+import time
+import uuid
+import asyncio
+import datetime
+from collections import OrderedDict
+
+from sqlalchemy import select, insert
+
+from models import Club, Review
+from ratings import apply_ratings, publish as publish_ratings
+
+REVIEW_WRITE_BEHIND = os.getenv("REVIEW_WRITE_BEHIND", "1").strip().lower() not in ("0", "false", "no", "off")
+REVIEW_QUEUE_SIZE = int(os.getenv("REVIEW_QUEUE_SIZE", "10000"))
+REVIEW_BATCH = int(os.getenv("REVIEW_BATCH", "200"))
+REVIEW_FLUSH_MS = int(os.getenv("REVIEW_FLUSH_MS", "200"))
+
+# token bucket: ёмкость и пополнение (токенов в минуту)
+REVIEW_RATE_IP = float(os.getenv("REVIEW_RATE_IP", "5"))
+REVIEW_BURST_IP = float(os.getenv("REVIEW_BURST_IP", "5"))
+REVIEW_RATE_CLUB = float(os.getenv("REVIEW_RATE_CLUB", "30"))
+REVIEW_BURST_CLUB = float(os.getenv("REVIEW_BURST_CLUB", "60"))
+REVIEW_BUCKETS_MAX = int(os.getenv("REVIEW_BUCKETS_MAX", "50000"))
+
+REVIEW_TEXT_MAX = int(os.getenv("REVIEW_TEXT_MAX", "4000"))
+REVIEW_AUTHOR_MAX = 100
+REVIEW_MAX_LINKS = int(os.getenv("REVIEW_MAX_LINKS", "2"))
+
+_CONTROL_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]")
+_LINK_RE = re.compile(r"https?://|www\.", re.IGNORECASE)
+
+
+class Rejected(ValueError):
+    """Отзыв не принят: status — HTTP-код ответа (422 / 429 / 503)."""
+
+    def __init__(self, status: int, detail: str, retry_after: float | None = None):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+# ---- проверка полей ----
+
+def _clean(value, limit: int) -> str | None:
+    if value is None:
+        return None
+    value = _CONTROL_RE.sub("", str(value)).strip()
+    if len(value) > limit:
+        raise Rejected(422, f"field is longer than {limit} characters")
+    return value or None
+
+
+def validate(payload) -> dict:
+    """Поля отзыва после очистки; Rejected(422) на мусоре."""
+    rating = getattr(payload, "rating", None)
+    if rating is None or not 1 <= int(rating) <= 5:
+        raise Rejected(422, "rating must be 1..5")
+    author = _clean(getattr(payload, "author_name", None), REVIEW_AUTHOR_MAX)
+    text = _clean(getattr(payload, "text", None), REVIEW_TEXT_MAX)
+    if text and len(_LINK_RE.findall(text)) > REVIEW_MAX_LINKS:
+        raise Rejected(422, "too many links in review text")
+    if author and _LINK_RE.search(author):
+        raise Rejected(422, "links are not allowed in author name")
+    return {"author_name": author, "rating": int(rating), "text": text}
+
+
+# ---- token bucket ----
+
+class TokenBuckets:
+    """Ключ -> (токены, время последнего пополнения); старые ключи вытесняются (LRU)."""
+
+    def __init__(self, per_minute: float, burst: float, max_keys: int = REVIEW_BUCKETS_MAX):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    def _level(self, key, now: float) -> float:
+        hit = self._buckets.get(key)
+        if hit is None:
+            return self.burst
+        tokens, ts = hit
+        return min(self.burst, tokens + (now - ts) * self.rate)
+
+    def wait_time(self, key, now: float) -> float:
+        """0 — токен есть; иначе сколько секунд ждать."""
+        level = self._level(key, now)
+        if level >= 1 or self.rate <= 0:
+            return 0.0 if level >= 1 else float("inf")
+        return (1 - level) / self.rate
+
+    def take(self, key, now: float) -> None:
+        self._buckets[key] = (self._level(key, now) - 1, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+
+_by_ip = TokenBuckets(REVIEW_RATE_IP, REVIEW_BURST_IP)
+_by_club = TokenBuckets(REVIEW_RATE_CLUB, REVIEW_BURST_CLUB)
+
+
+def throttle(ip: str | None, club_id) -> None:
+    """Rejected(429), если у IP или у кружка кончились токены; иначе списывает по токену."""
+    now = time.monotonic()
+    ip_key, club_key = ip or "-", str(club_id)
+    wait = max(_by_ip.wait_time(ip_key, now), _by_club.wait_time(club_key, now))
+    if wait > 0:
+        raise Rejected(429, "too many reviews, try later", retry_after=wait)
+    # списываем только когда проходят оба лимита
+    _by_ip.take(ip_key, now)
+    _by_club.take(club_key, now)
+
+
+# ---- очередь и запись пачками ----
+
+_queue = None
+_task = None
+_closing = False
+_on_flushed = None
+_stats = {"accepted": 0, "written": 0, "dropped": 0, "batches": 0}
+
+
+def enabled() -> bool:
+    return REVIEW_WRITE_BEHIND and _task is not None and not _closing
+
+
+def submit(club_id: uuid.UUID, fields: dict) -> dict:
+    """Поставить проверенный отзыв в очередь; возвращает отзыв в виде ответа API."""
+    row = {
+        "id": uuid.uuid4(),
+        "club_id": club_id,
+        "created_at": datetime.datetime.now(datetime.timezone.utc),
+        **fields,
+    }
+    try:
+        _queue.put_nowait(row)
+    except asyncio.QueueFull:
+        raise Rejected(503, "review queue is full, try later", retry_after=1)
+    _stats["accepted"] += 1
+    return {k: row[k] for k in ("id", "author_name", "rating", "text", "created_at")}
+
+
+async def _write(session_factory, rows: list) -> set:
+    """Одна транзакция на пачку; возвращает club_id, у которых появились отзывы."""
+    async with session_factory() as session:
+        club_ids = {r["club_id"] for r in rows}
+        # FOR KEY SHARE: кружок не удалят, пока пишем; удалённые уже — отбрасываем
+        alive = set((await session.execute(
+            select(Club.id).where(Club.id.in_(club_ids)).with_for_update(key_share=True)
+        )).scalars())
+        kept = [r for r in rows if r["club_id"] in alive]
+        _stats["dropped"] += len(rows) - len(kept)
+        rows = kept
+        if not rows:
+            return set()
+        inserted = await session.execute(
+            insert(Review).returning(Review.club_id, Review.rating),
+            rows,
+        )
+        deltas = {}
+        for cid, rating in inserted:
+            if rating is not None:
+                n, total = deltas.get(cid, (0, 0))
+                deltas[cid] = (n + 1, total + rating)
+        await apply_ratings(session, deltas)
+        await publish_ratings(session, deltas)
+        await session.commit()
+        _stats["written"] += len(rows)
+        return set(deltas)
+
+
+async def _flush(session_factory, rows: list) -> None:
+    try:
+        changed = await _write(session_factory, rows)
+    except Exception as e:
+        if len(rows) == 1:
+            _stats["dropped"] += 1
+            print("[WARN] review write failed, dropped:", e)
+            return
+        # одна плохая строка не должна терять всю пачку — пишем по одной
+        print(f"[WARN] review batch of {len(rows)} failed, retrying one by one:", e)
+        for row in rows:
+            await _flush(session_factory, [row])
+        return
+    _stats["batches"] += 1
+    if changed and _on_flushed is not None:
+        _on_flushed(changed)
+
+
+async def _drain_batch():
+    """Ждёт первый отзыв, затем добирает пачку до REVIEW_BATCH или REVIEW_FLUSH_MS.
+
+    (пачка, стоп): None в очереди — сигнал stop().
+    """
+    first = await _queue.get()
+    if first is None:
+        return [], True
+    batch = [first]
+    deadline = asyncio.get_running_loop().time() + REVIEW_FLUSH_MS / 1000
+    while len(batch) < REVIEW_BATCH:
+        timeout = deadline - asyncio.get_running_loop().time()
+        if timeout <= 0:
+            break
+        try:
+            row = await asyncio.wait_for(_queue.get(), timeout)
+        except asyncio.TimeoutError:
+            break
+        if row is None:
+            return batch, True
+        batch.append(row)
+    return batch, False
+
+
+async def _loop(session_factory):
+    while True:
+        batch, stopping = await _drain_batch()
+        try:
+            if batch:
+                await _flush(session_factory, batch)
+        except Exception as e:
+            print("[WARN] review intake loop error:", e)
+        if stopping:
+            return
+
+
+def start(session_factory, on_flushed=None) -> None:
+    """on_flushed(club_ids) — после COMMIT пачки (рейтинг в каталоге, кэш отзывов)."""
+    global _queue, _task, _on_flushed
+    if REVIEW_WRITE_BEHIND and _task is None:
+        _queue = asyncio.Queue(maxsize=REVIEW_QUEUE_SIZE)
+        _on_flushed = on_flushed
+        _task = asyncio.get_running_loop().create_task(_loop(session_factory))
+
+
+async def stop() -> None:
+    """Перестать принимать отзывы и дописать очередь (без cancel: пачка в записи не теряется)."""
+    global _task, _closing
+    if _task is None:
+        return
+    _closing = True
+    await _queue.put(None)
+    await _task
+    _task = None
+    _closing = False
+
+
+def status() -> dict:
+    return {
+        "enabled": enabled(),
+        "queued": _queue.qsize() if _queue is not None else 0,
+        **_stats,
+    }
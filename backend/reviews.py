@@ -0,0 +1,80 @@
+# reviews.py
+# Отзывы кружка постранично: новые сверху, keyset по (created_at, id).
+#
+# Страница берётся по индексу ix_reviews_club_created (club_id, created_at, id) —
+# стоимость не зависит от того, сколько всего отзывов у кружка. Первая страница
+# (её открывает почти каждый посетитель карточки) кэшируется в памяти процесса по
+# club_id и сбрасывается при новом отзыве: своём (invalidate() после записи — сразу
+# или пачкой из review_intake) и чужом (NOTIFY "rating" от другого воркера; правка
+# или удаление кружка — NOTIFY "club").
+import os
+import time
+from collections import OrderedDict
+
+from sqlalchemy import select, desc, tuple_
+
+from models import Review
+
+REVIEWS_PAGE_SIZE = int(os.getenv("REVIEWS_PAGE_SIZE", "20"))
+REVIEWS_MAX_PAGE_SIZE = 100
+REVIEWS_CACHE_SIZE = int(os.getenv("REVIEWS_CACHE_SIZE", "2000"))
+REVIEWS_CACHE_TTL = int(os.getenv("REVIEWS_CACHE_TTL", "300"))
+
+_REVIEW_COLUMNS = (Review.id, Review.author_name, Review.rating, Review.text, Review.created_at)
+
+# club_id (str) -> (monotonic-время истечения, items, next_key)
+_first_pages = OrderedDict()
+# счётчик сбросов: страницу, прочитанную до сброса, в кэш не кладём
+_generation = 0
+
+
+def review_out(r) -> dict:
+    return {
+        "id": str(r.id),
+        "author_name": r.author_name,
+        "rating": r.rating,
+        "text": r.text,
+        "created_at": r.created_at.isoformat() if r.created_at else None,
+    }
+
+
+async def page(session, club_id, after=None, limit: int = REVIEWS_PAGE_SIZE):
+    """(отзывы, ключ следующей страницы (created_at, id) | None); after — ключ последнего отзыва."""
+    stmt = select(*_REVIEW_COLUMNS).where(Review.club_id == club_id)
+    if after is not None:
+        stmt = stmt.where(tuple_(Review.created_at, Review.id) < tuple_(*after))
+    # +1 строка, чтобы понять, есть ли следующая страница
+    r = await session.execute(stmt.order_by(desc(Review.created_at), desc(Review.id)).limit(limit + 1))
+    rows = r.all()
+    next_key = (rows[limit - 1].created_at, rows[limit - 1].id) if len(rows) > limit else None
+    return [review_out(x) for x in rows[:limit]], next_key
+
+
+def cached_first_page(club_id):
+    hit = _first_pages.get(str(club_id))
+    if hit is None or hit[0] <= time.monotonic():
+        return None
+    _first_pages.move_to_end(str(club_id))
+    return hit[1], hit[2]
+
+
+def generation() -> int:
+    return _generation
+
+
+def store_first_page(club_id, items, next_key, gen: int) -> None:
+    if gen != _generation:
+        return
+    _first_pages[str(club_id)] = (time.monotonic() + REVIEWS_CACHE_TTL, items, next_key)
+    _first_pages.move_to_end(str(club_id))
+    while len(_first_pages) > REVIEWS_CACHE_SIZE:
+        _first_pages.popitem(last=False)
+
+
+def invalidate(club_id=None) -> None:
+    global _generation
+    _generation += 1
+    if club_id is None:
+        _first_pages.clear()
+    else:
+        _first_pages.pop(str(club_id), None)
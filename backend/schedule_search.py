@@ -0,0 +1,152 @@
+# schedule_search.py
+# Поиск по расписанию: "что идёт в субботу утром", "после 18:00 по будням".
+#
+# Слот расписания — это weekday + интервал [start_time, end_time). Фильтр по времени
+# строится как int4range в минутах (то же выражение, что в GiST-индексе
+# ix_schedules_slot_range) и сравнивается с окном запроса оператором
+# && (пересекается) или <@ (целиком внутри окна).
+from sqlalchemy import select, func, literal_column, and_
+
+from models import Schedule, SCHEDULE_RANGE_SQL
+from club_fields import WEEKDAY_MAP
+
+DAY_MINUTES = 24 * 60
+
+TIME_MODES = ("overlap", "within")
+
+_WEEKDAY_NAMES = {v: k.capitalize() for k, v in WEEKDAY_MAP.items()}
+
+_DAY_ALIASES = {
+    "пн": 0, "вт": 1, "ср": 2, "чт": 3, "пт": 4, "сб": 5, "вс": 6,
+    "mon": 0, "tue": 1, "wed": 2, "thu": 3, "fri": 4, "sat": 5, "sun": 6,
+    **WEEKDAY_MAP,
+}
+_DAY_GROUPS = {
+    "будни": (0, 1, 2, 3, 4), "weekdays": (0, 1, 2, 3, 4),
+    "выходные": (5, 6), "weekend": (5, 6),
+}
+
+
+def parse_days(value: str | None) -> list[int]:
+    """'сб,вс' / '5,6' / 'будни' / 'Понедельник' -> [weekday...]; ValueError на мусоре."""
+    out = set()
+    for token in (value or "").replace(";", ",").split(","):
+        t = token.strip().lower()
+        if not t:
+            continue
+        if t in _DAY_GROUPS:
+            out.update(_DAY_GROUPS[t])
+        elif t.isdigit() and 0 <= int(t) <= 6:
+            out.add(int(t))
+        elif t in _DAY_ALIASES:
+            out.add(_DAY_ALIASES[t])
+        else:
+            # "субб", "monday": префикс полного названия или название с сокращением в начале
+            found = {v for k, v in _DAY_ALIASES.items() if len(t) >= 2 and (k.startswith(t) or t.startswith(k))}
+            if len(found) != 1:
+                raise ValueError(f"unknown day: {token.strip()}")
+            out.update(found)
+    return sorted(out)
+
+
+def parse_minutes(value: str | None):
+    """'18:00' / '9' / '24:00' -> минуты от полуночи (None, если не задано)."""
+    v = (value or "").strip()
+    if not v:
+        return None
+    hh, _, mm = v.partition(":")
+    try:
+        minutes = int(hh) * 60 + int(mm or 0)
+    except ValueError:
+        raise ValueError(f"bad time: {v} (expected HH:MM)")
+    if not 0 <= minutes <= DAY_MINUTES or int(mm or 0) >= 60:
+        raise ValueError(f"bad time: {v} (expected HH:MM)")
+    return minutes
+
+
+def _window(days=None, time_from=None, time_to=None, mode: str = "overlap"):
+    """(weekdays, lo, hi) окна поиска; lo/hi = None — фильтра по времени нет."""
+    weekdays = parse_days(days) if days else []
+    lo, hi = parse_minutes(time_from), parse_minutes(time_to)
+    if lo is None and hi is None:
+        return weekdays, None, None
+    lo = lo if lo is not None else 0
+    hi = hi if hi is not None else DAY_MINUTES
+    if hi <= lo:
+        raise ValueError("time_to must be later than time_from")
+    if mode not in TIME_MODES:
+        raise ValueError(f"time_mode must be one of: {', '.join(TIME_MODES)}")
+    return weekdays, lo, hi
+
+
+def slot_conditions(days=None, time_from=None, time_to=None, mode: str = "overlap") -> list:
+    """WHERE по Schedule. Пустой список — фильтр по расписанию не задан."""
+    conds = []
+    weekdays, lo, hi = _window(days, time_from, time_to, mode)
+    if weekdays:
+        conds.append(Schedule.weekday.in_(weekdays))
+    if lo is not None:
+        window = func.int4range(lo, hi, literal_column("'[)'"))
+        slot = literal_column(SCHEDULE_RANGE_SQL)
+        conds.append(Schedule.start_time.isnot(None))
+        conds.append(slot.op("&&" if mode == "overlap" else "<@")(window))
+    return conds
+
+
+def slot_range(start_min: int, end_min=None):
+    """[начало, конец) слота в минутах — как SCHEDULE_RANGE_SQL."""
+    return start_min, max(end_min if end_min is not None else start_min + 1, start_min + 1)
+
+
+def slot_predicate(days=None, time_from=None, time_to=None, mode: str = "overlap"):
+    """То же, что slot_conditions(), для слотов в памяти (catalog.py): fn(slot) -> bool или None."""
+    weekdays, lo, hi = _window(days, time_from, time_to, mode)
+    if not weekdays and lo is None:
+        return None
+    days_set = frozenset(weekdays)
+
+    def match(s) -> bool:
+        if days_set and s.weekday not in days_set:
+            return False
+        if lo is None:
+            return True
+        if s.start_min is None:
+            return False
+        a, b = slot_range(s.start_min, s.end_min)
+        return (a < hi and lo < b) if mode == "overlap" else (lo <= a and b <= hi)
+
+    return match
+
+
+def clubs_with_slots(conds):
+    """Подзапрос id кружков, у которых есть хотя бы один подходящий слот."""
+    return select(Schedule.club_id).where(and_(*conds))
+
+
+def _slot_out(s) -> dict:
+    time_str = ""
+    if s.start_time and s.end_time:
+        time_str = f"{s.start_time.strftime('%H:%M')}-{s.end_time.strftime('%H:%M')}"
+    elif s.start_time:
+        time_str = s.start_time.strftime("%H:%M")
+    return {
+        "weekday": s.weekday,
+        "day": _WEEKDAY_NAMES.get(s.weekday, "" if s.weekday is None else str(s.weekday)),
+        "time": time_str,
+        "note": s.note or "",
+    }
+
+
+async def matching_slots(session, club_ids, conds) -> dict:
+    """club_id -> [подходящие слоты] одним запросом для страницы выдачи."""
+    if not club_ids or not conds:
+        return {}
+    r = await session.execute(
+        select(Schedule.club_id, Schedule.weekday, Schedule.start_time, Schedule.end_time, Schedule.note)
+        .where(Schedule.club_id.in_(club_ids), *conds)
+        .order_by(Schedule.club_id, Schedule.weekday, Schedule.start_time)
+    )
+    out = {}
+    for s in r.all():
+        out.setdefault(s.club_id, []).append(_slot_out(s))
+    return out
@@ -1,4 +1,7 @@
 -- schema_fixed.sql
+-- Исходная схема (первый выкат). Дальше схему ведут models.py (новые таблицы и
+-- колонки — create_tables.py) и migrations.py (индексы на существующие таблицы,
+-- CREATE INDEX CONCURRENTLY); этот файл с ними не синхронизируется.
 CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
 
 CREATE TABLE addresses (
@@ -0,0 +1,129 @@
+# slugs.py
+# Выдача уникальных slug'ов и история старых slug'ов (для кружков и статей).
+#
+# allocate_slug() одним запросом забирает все занятые slug'и с тем же префиксом
+# (живые + исторические) и выбирает первый свободный суффикс: base, base-2, base-3...
+# slug_lookup_clause() — условие "этот slug или один из старых slug'ов этой сущности",
+# чтобы отдать 301 на актуальный адрес тем же запросом, которым ищем запись.
+from sqlalchemy import select, union_all, or_, and_, delete, literal
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from models import Club, BlogPost, SlugHistory
+
+ENTITY_MODELS = {
+    "club": Club,
+    "blog": BlogPost,
+}
+
+
+def _slugify_basic(text: str, fallback: str = "post") -> str:
+    """Очень простой slugify на случай, если фронт не прислал slug."""
+    s = (text or "").strip().lower()
+    out = []
+    prev_dash = False
+    for ch in s:
+        if ch.isalnum():
+            out.append(ch)
+            prev_dash = False
+        else:
+            if not prev_dash:
+                out.append("-")
+                prev_dash = True
+    slug = "".join(out).strip("-")
+    slug = "-".join([p for p in slug.split("-") if p])
+    return (slug or fallback)[:80]
+
+
+def _like_escape(s: str) -> str:
+    return s.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+async def allocate_slug(session, entity_type: str, base: str, exclude_id=None) -> str:
+    """Первый свободный slug вида base / base-N (один SELECT)."""
+    model = ENTITY_MODELS[entity_type]
+    pattern = _like_escape(base) + "-%"
+
+    live = select(model.slug.label("slug")).where(
+        or_(model.slug == base, model.slug.like(pattern, escape="\\"))
+    )
+    hist = select(SlugHistory.old_slug.label("slug")).where(
+        SlugHistory.entity_type == entity_type,
+        or_(SlugHistory.old_slug == base, SlugHistory.old_slug.like(pattern, escape="\\")),
+    )
+    if exclude_id is not None:
+        # своя текущая/старая запись slug не занимает
+        live = live.where(model.id != exclude_id)
+        hist = hist.where(SlugHistory.entity_id != exclude_id)
+
+    r = await session.execute(union_all(live, hist))
+    taken = {row[0] for row in r.all()}
+    return pick_free_slug(base, taken)
+
+
+def pick_free_slug(base: str, taken: set) -> str:
+    if base not in taken:
+        return base
+    i = 2
+    while f"{base}-{i}" in taken:
+        i += 1
+    return f"{base}-{i}"
+
+
+async def taken_slugs(session, entity_type: str) -> set:
+    """Все занятые slug'и сущности (живые + исторические) — для пакетной выдачи при импорте."""
+    model = ENTITY_MODELS[entity_type]
+    r = await session.execute(
+        union_all(
+            select(model.slug),
+            select(SlugHistory.old_slug).where(SlugHistory.entity_type == entity_type),
+        )
+    )
+    return {row[0] for row in r.all()}
+
+
+async def record_slug_change(session, entity_type: str, entity_id, old_slug, new_slug):
+    """Запоминает old_slug -> entity_id; new_slug из истории убираем (он снова живой)."""
+    if not old_slug or old_slug == new_slug:
+        return
+    await session.execute(
+        delete(SlugHistory).where(
+            SlugHistory.entity_type == entity_type,
+            SlugHistory.old_slug == new_slug,
+        )
+    )
+    stmt = pg_insert(SlugHistory).values(
+        entity_type=entity_type,
+        entity_id=entity_id,
+        old_slug=old_slug,
+    )
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_slug_history_type_slug",
+        set_={"entity_id": entity_id},
+    )
+    await session.execute(stmt)
+
+
+async def forget_slugs(session, entity_type: str, entity_id):
+    await session.execute(
+        delete(SlugHistory).where(
+            SlugHistory.entity_type == entity_type,
+            SlugHistory.entity_id == entity_id,
+        )
+    )
+
+
+def slug_lookup_clause(entity_type: str, slug: str):
+    """WHERE: запись с этим slug ИЛИ запись, у которой это один из старых slug'ов."""
+    model = ENTITY_MODELS[entity_type]
+    old = (
+        select(SlugHistory.entity_id)
+        .where(and_(SlugHistory.entity_type == entity_type, SlugHistory.old_slug == slug))
+        .scalar_subquery()
+    )
+    return or_(model.slug == slug, model.id == old)
+
+
+def live_first(entity_type: str, slug: str):
+    """ORDER BY: живой slug важнее исторического (на случай гонки при переименовании)."""
+    model = ENTITY_MODELS[entity_type]
+    return (model.slug == literal(slug)).desc()
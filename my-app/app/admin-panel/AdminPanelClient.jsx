@@ -43,7 +43,8 @@ const ADMIN_TABS = [
 
 // Planned backend endpoints for blog posts.
 // If backend does not have them yet, UI will fall back to localStorage.
-const BLOG_API_LIST = '/api/blog/posts?limit=5000';
+// список — только краткие поля (без тел статей), полная статья грузится при открытии
+const BLOG_API_LIST = '/api/blog/posts?view=summary&limit=500';
 const BLOG_API_BASE = '/api/blog/posts';
 const BLOG_STORAGE_KEY = 'mapka_admin_blog_posts_v1';
 
@@ -442,11 +443,16 @@ export default function AdminPanelClient() {
   const [blogSelectedId, setBlogSelectedId] = useState(null);
   const [blogSearch, setBlogSearch] = useState('');
   const [blogLog, setBlogLog] = useState('');
+  // загрузка тела статьи: ошибка и счётчик для повтора
+  const [blogBodyError, setBlogBodyError] = useState('');
+  const [blogBodyAttempt, setBlogBodyAttempt] = useState(0);
 
   const selectedPost = useMemo(
     () => blogPosts.find((p) => String(p.id) === String(blogSelectedId)) || null,
     [blogPosts, blogSelectedId]
   );
+  // summary из списка без content/faq: сохранение затёрло бы статью пустыми полями
+  const postBodyMissing = !!selectedPost && selectedPost.hasBody === false;
 
   const [postForm, setPostForm] = useState(() => ({
     id: '',
@@ -911,7 +917,14 @@ export default function AdminPanelClient() {
 
   const saveBlogLocal = (list) => {
     try {
-      localStorage.setItem(BLOG_STORAGE_KEY, JSON.stringify(list || []));
+      // summary-строки (без тела) не вытесняют полные копии из кэша
+      const cached = new Map(loadBlogLocal().map((p) => [String(p.id), p]));
+      const next = (list || []).map((p) => {
+        if (p.hasBody !== false) return p;
+        const full = cached.get(String(p.id));
+        return full && full.hasBody !== false ? full : p;
+      });
+      localStorage.setItem(BLOG_STORAGE_KEY, JSON.stringify(next));
     } catch {}
   };
 
@@ -929,6 +942,8 @@ export default function AdminPanelClient() {
         tags: Array.isArray(p.tags) ? p.tags : [],
         content: p.content ?? p.body ?? '',
         faq: normalizeFaqItems(p.faq ?? p.faq_items ?? null),
+        // summary-ответ списка не содержит content — тело догружаем при открытии
+        hasBody: p.hasBody ?? (p.content !== undefined || p.body !== undefined),
         createdAt: p.createdAt ?? p.created_at ?? '',
         updatedAt: p.updatedAt ?? p.updated_at ?? '',
         publishedAt: p.publishedAt ?? p.published_at ?? '',
@@ -939,9 +954,17 @@ export default function AdminPanelClient() {
   const fetchBlogPosts = async () => {
     setBlogLoading(true);
     try {
-      const r = await fetch(BLOG_API_LIST, { credentials: 'include' });
+      let r = await fetch(BLOG_API_LIST, { credentials: 'include' });
       if (r.ok) {
         const data = await r.json();
+        // keyset-пагинация: следующий курсор приходит в X-Next-Cursor
+        let cursor = r.headers.get('X-Next-Cursor');
+        while (cursor) {
+          r = await fetch(`${BLOG_API_LIST}&cursor=${encodeURIComponent(cursor)}`, { credentials: 'include' });
+          if (!r.ok) break;
+          data.push(...(await r.json()));
+          cursor = r.headers.get('X-Next-Cursor');
+        }
         const list = normalizePostsFromApi(data);
         setBlogPosts(list);
         // keep local copy as cache
@@ -970,6 +993,37 @@ export default function AdminPanelClient() {
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [activeTab]);
 
+  // Full body is fetched only when a post is opened
+  useEffect(() => {
+    setBlogBodyError('');
+    if (!selectedPost || selectedPost.hasBody) return;
+    let cancelled = false;
+    (async () => {
+      try {
+        const r = await fetch(`${BLOG_API_BASE}/${encodeURIComponent(selectedPost.id)}`, { credentials: 'include' });
+        if (cancelled) return;
+        if (!r.ok) {
+          setBlogBodyError(`HTTP ${r.status}`);
+          return;
+        }
+        const full = normalizePostsFromApi([await r.json()])[0];
+        if (cancelled) return;
+        setBlogPosts((prev) => {
+          const next = (prev || []).map((p) => (String(p.id) === String(full.id) ? full : p));
+          saveBlogLocal(next);
+          return next;
+        });
+      } catch (e) {
+        console.warn('fetch blog post failed', e);
+        if (!cancelled) setBlogBodyError(String(e?.message || e));
+      }
+    })();
+    return () => {
+      cancelled = true;
+    };
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [selectedPost?.id, selectedPost?.hasBody, blogBodyAttempt]);
+
   // When select post -> fill form
   useEffect(() => {
     if (!selectedPost) return;
@@ -1119,6 +1173,10 @@ export default function AdminPanelClient() {
 
   const savePost = async () => {
     if (!selectedPost) return;
+    if (postBodyMissing) {
+      toastShow(setToast, 'Текст статьи ещё не загружен');
+      return;
+    }
     const payload = buildPostPayload(postForm);
 
     try {
@@ -2403,11 +2461,25 @@ export default function AdminPanelClient() {
                     <div style={{ display: 'flex', alignItems: 'center', justifyContent: 'space-between', gap: 10 }}>
                       <h2 style={{ margin: 0, fontSize: 18 }}>Редактирование: {selectedPost.title || '—'}</h2>
                       <div style={{ display: 'flex', gap: 8 }}>
-                        <button className="btn" onClick={savePost} disabled={blogLoading}>
+                        <button className="btn" onClick={savePost} disabled={blogLoading || postBodyMissing}>
                           Сохранить
                         </button>
                       </div>
                     </div>
+                    {postBodyMissing ? (
+                      <div className="muted" style={{ marginTop: 6 }}>
+                        {blogBodyError ? (
+                          <>
+                            Не удалось загрузить текст статьи ({blogBodyError}).{' '}
+                            <button className="btn ghost" onClick={() => setBlogBodyAttempt((n) => n + 1)}>
+                              Повторить
+                            </button>
+                          </>
+                        ) : (
+                          'Загружаем текст статьи…'
+                        )}
+                      </div>
+                    ) : null}
 
                     <div className="row" style={{ marginTop: 14 }}>
                       <div style={{ flex: 1 }}>